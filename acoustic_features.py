@@ -0,0 +1,187 @@
+import os           # nice level of the worker process
+import sys          # command line arguments
+import time         # cpu time of the command line run
+import logging      # event logging
+import multiprocessing  # spawn context for the worker process
+from concurrent.futures import ProcessPoolExecutor  # low priority worker process
+
+import numpy as np  # vectorized spectra and indices
+import soundfile as sf  # streamed reading of flac/wav recordings
+
+# Octave band centre frequencies [Hz]; bands above the nyquist frequency are left out
+OCTAVE_CENTRES = (31.5, 63, 125, 250, 500, 1000, 2000, 4000, 8000, 16000)
+FEATURE_SUFFIX = ".features.npz"
+
+
+def band_edges(rate):
+    """Lower and upper edge of every octave band below the nyquist frequency."""
+    edges = [(centre / 2 ** 0.5, centre * 2 ** 0.5) for centre in OCTAVE_CENTRES]
+    return np.array([edge for edge in edges if edge[1] <= rate / 2])
+
+
+def spectrogram_bins(freqs, count):
+    """Log-spaced bin boundaries (as indices into `freqs`) for the downsampled spectrogram."""
+    edges = np.geomspace(max(freqs[1], 10.0), freqs[-1], count + 1)
+    return np.searchsorted(freqs, edges)
+
+
+def pooling(bins, size):
+    """Start index and bin count of every spectrogram band for `np.add.reduceat` over `size` bins.
+
+    reduceat sums up to the next start, the last band up to the end of the spectrum,
+    and takes a single bin where two starts coincide.
+    """
+    starts = np.minimum(bins[:-1], size - 1)
+    ends = np.append(starts[1:], size)
+    return starts, np.maximum(ends - starts, 1)
+
+
+class FeatureExtractor:
+    """Per-window band energies, a downsampled spectrogram and acoustic indices of a recording.
+
+    The file is read in blocks of one analysis window, so memory use depends on
+    `window_seconds` and `nfft` only, not on the recording length. Every window is
+    split into non-overlapping hann-weighted frames of `nfft` samples.
+    """
+
+    def __init__(self, window_seconds=1.0, nfft=2048, spectrogram_size=64):
+        self.window_seconds = window_seconds
+        self.nfft = nfft
+        self.spectrogram_size = spectrogram_size
+        self._hann = np.hanning(nfft).astype(np.float32)
+
+    def extract(self, path):
+        """Return a dict of feature arrays (one row per window) for the recording at `path`."""
+        info = sf.info(path)
+        rate = info.samplerate
+        window_frames = int(self.window_seconds * rate)
+        frames_per_window = window_frames // self.nfft
+        if frames_per_window < 2:
+            raise ValueError("Analysis window must hold at least two FFT frames")
+
+        freqs = np.fft.rfftfreq(self.nfft, 1 / rate)
+        bands = band_edges(rate)
+        band_masks = (freqs >= bands[:, :1]) & (freqs < bands[:, 1:])  # bands x bins
+        spec_starts, spec_counts = pooling(spectrogram_bins(freqs, self.spectrogram_size), len(freqs))
+
+        rows = {"time": [], "rms_db": [], "band_db": [], "spectrogram": [], "aci": [],
+                "spectral_entropy": [], "temporal_entropy": [], "peak_frequency": []}
+        for index, block in enumerate(sf.blocks(path, blocksize=window_frames, dtype="float32", always_2d=True)):
+            mono = block.mean(axis=1)
+            usable = len(mono) // self.nfft * self.nfft
+            if usable < 2 * self.nfft:
+                break  # incomplete last window
+            frames = mono[:usable].reshape(-1, self.nfft) * self._hann
+            amplitude = np.abs(np.fft.rfft(frames, axis=1))  # frames x bins
+            power = amplitude ** 2
+            spectrum = power.mean(axis=0)
+
+            rows["time"].append(index * self.window_seconds)
+            rows["rms_db"].append(10 * np.log10(np.mean(mono[:usable] ** 2) + 1e-20))
+            rows["band_db"].append(10 * np.log10(band_masks @ spectrum + 1e-20))
+            pooled = np.add.reduceat(spectrum, spec_starts) / spec_counts
+            rows["spectrogram"].append(10 * np.log10(pooled + 1e-20))
+
+            # acoustic complexity index: relative amplitude change between frames, summed over bins
+            rows["aci"].append(float(np.sum(np.abs(np.diff(amplitude, axis=0)).sum(axis=0)
+                                           / (amplitude.sum(axis=0) + 1e-20))))
+            # spectral and temporal entropy, normalised to 0..1
+            p = spectrum / (spectrum.sum() + 1e-20)
+            rows["spectral_entropy"].append(float(-np.sum(p * np.log2(p + 1e-20)) / np.log2(len(p))))
+            envelope = np.abs(mono[:usable])
+            q = envelope / (envelope.sum() + 1e-20)
+            rows["temporal_entropy"].append(float(-np.sum(q * np.log2(q + 1e-20)) / np.log2(len(q))))
+            rows["peak_frequency"].append(float(freqs[np.argmax(spectrum[1:]) + 1]))
+
+        features = {name: np.array(values, dtype=np.float32) for name, values in rows.items()}
+        features["spectrogram"] = features["spectrogram"].astype(np.float16)
+        features["band_edges"] = bands.astype(np.float32)
+        features["spectrogram_freqs"] = freqs[spec_starts].astype(np.float32)
+        features["samplerate"] = np.array(rate)
+        return features
+
+
+def feature_path(path):
+    """Feature file stored next to the recording."""
+    return os.path.splitext(path)[0] + FEATURE_SUFFIX
+
+
+def activity(features, threshold_db=6.0):
+    """Activity score (0..1): fraction of windows louder than the median of the recording by `threshold_db`."""
+    rms = features["rms_db"]
+    if not len(rms):
+        return 0.0
+    return float(np.mean(rms > np.median(rms) + threshold_db))
+
+
+def process(paths, window_seconds=1.0, nfft=2048):
+    """Compute and store the features of every recording that has none yet.
+
+    Returns the (path, activity) pairs written and the (path, error) pairs of
+    recordings that could not be read; one broken file does not stop the others.
+    """
+    extractor = FeatureExtractor(window_seconds, nfft)
+    written, failed = [], []
+    for path in paths:
+        target = feature_path(path)
+        if os.path.exists(target):
+            continue
+        try:
+            features = extractor.extract(path)
+        except Exception as e:  # e.g. a flac cut off by a power loss
+            failed.append((path, str(e)))
+            continue
+        temporary = target + ".tmp.npz"
+        np.savez_compressed(temporary, **features)
+        os.replace(temporary, target)  # a half-written file never looks finished
+        written.append((path, activity(features)))
+    return written, failed
+
+
+class FeatureWorker:
+    """Runs the extraction in a single background process at the lowest cpu priority."""
+
+    def __init__(self, window_seconds=1.0, nfft=2048, on_done=None):
+        self.window_seconds = window_seconds
+        self.nfft = nfft
+        self.on_done = on_done  # called with (recording, activity) of every processed recording
+        # spawn instead of fork: the main process runs camera and capture threads
+        self._executor = ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn"),
+                                             initializer=os.nice, initargs=(19,))
+
+    def submit(self, paths):
+        """Queue recordings for extraction and return immediately."""
+        future = self._executor.submit(process, list(paths), self.window_seconds, self.nfft)
+        future.add_done_callback(self._done)
+        return future
+
+    def _done(self, future):
+        try:
+            written, failed = future.result()
+            logging.info(f"[Audio] Acoustic features written: {len(written)} files")
+        except Exception as e:
+            logging.error(f"[Audio] Acoustic feature extraction failed: {e}")
+            return
+        for path, error in failed:
+            logging.error(f"[Audio] No acoustic features for {os.path.basename(path)}: {error}")
+        if self.on_done is not None:
+            for path, score in written:
+                self.on_done(path, score)
+
+    def shutdown(self, wait=False):
+        self._executor.shutdown(wait=wait, cancel_futures=True)
+
+
+if __name__ == "__main__":
+    # usage: python3 acoustic_features.py <recording.flac> [...]
+    if len(sys.argv) < 2:
+        print("usage: python3 acoustic_features.py <recording.flac> [...]")
+        sys.exit(1)
+    for path in sys.argv[1:]:
+        started = time.process_time()
+        features = FeatureExtractor().extract(path)
+        np.savez_compressed(feature_path(path), **features)
+        size = os.path.getsize(feature_path(path))
+        print(f"{path}: {len(features['time'])} windows, {size / 1024:.1f} kB, "
+              f"{time.process_time() - started:.2f} s cpu, mean ACI {features['aci'].mean():.1f}, "
+              f"activity {activity(features):.2f}")
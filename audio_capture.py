@@ -0,0 +1,265 @@
+import os           # filepath generation
+import time         # chunk timestamps, realtime pacing of the fake input
+import threading    # capture thread and ring buffer signalling
+import logging      # event logging
+import wave         # file-backed fake input device
+import argparse     # command line for manual recordings and benchmarks
+
+import numpy as np  # sample conversion
+import soundfile as sf  # flac output
+
+# ALSA sample format -> (numpy dtype of the raw block, flac subtype)
+# 32 bit samples of the ADC carry 24 significant bits, PCM_24 stores them losslessly
+SAMPLE_FORMATS = {
+    "S16_LE": ("<i2", "PCM_16"),
+    "S32_LE": ("<i4", "PCM_24"),
+}
+
+
+class AlsaInput:
+    """Capture device read in fixed-size periods through pyalsaaudio (same options as arecord)."""
+
+    wait_when_full = False  # a real device cannot be paused, full ring means dropped blocks
+
+    def __init__(self, device="hw:3,0", rate=44100, channels=2, sample_format="S32_LE", period_frames=4096):
+        import alsaaudio  # only available on the pi
+
+        self.rate = rate
+        self.channels = channels
+        self.sample_format = sample_format
+        self.period_frames = period_frames
+        self._pcm = alsaaudio.PCM(
+            type=alsaaudio.PCM_CAPTURE, mode=alsaaudio.PCM_NORMAL, device=device, channels=channels,
+            rate=rate, format=getattr(alsaaudio, f"PCM_FORMAT_{sample_format}"), periodsize=period_frames,
+        )
+
+    def read(self):
+        """Return (block, overrun); overrun is True when ALSA lost samples before this block."""
+        length, data = self._pcm.read()
+        if length < 0:  # -EPIPE, the driver buffer overflowed
+            return None, True
+        return data, False
+
+    def close(self):
+        self._pcm.close()
+
+
+class FileInput:
+    """Fake capture device that plays a WAV file, optionally paced like the real device."""
+
+    def __init__(self, path, period_frames=4096, realtime=True, loop=False):
+        self._wave = wave.open(path, "rb")
+        self.rate = self._wave.getframerate()
+        self.channels = self._wave.getnchannels()
+        self.sample_format = {2: "S16_LE", 4: "S32_LE"}[self._wave.getsampwidth()]
+        self.period_frames = period_frames
+        self.realtime = realtime
+        self.loop = loop
+        self.wait_when_full = not realtime  # unpaced benchmark input waits for the writer
+        self._next = None  # monotonic time the next block is "captured"
+
+    def read(self):
+        if self.realtime:
+            now = time.monotonic()
+            if self._next is None:
+                self._next = now
+            if self._next > now:
+                time.sleep(self._next - now)
+            self._next += self.period_frames / self.rate
+        data = self._wave.readframes(self.period_frames)
+        if not data and self.loop:
+            self._wave.rewind()
+            data = self._wave.readframes(self.period_frames)
+        if not data:
+            return None, False  # end of file, the capture stops
+        return data, False
+
+    def close(self):
+        self._wave.close()
+
+
+class BlockRing:
+    """Fixed number of preallocated block slots between the capture and the writer thread.
+
+    `put` does not block by default: when the writer falls behind the block is
+    dropped and counted, so the capture thread keeps draining the device.
+    """
+
+    def __init__(self, slots, block_size):
+        self._slots = [bytearray(block_size) for _ in range(slots)]
+        self._lengths = [0] * slots
+        self._read = 0   # number of blocks taken by the consumer
+        self._write = 0  # number of blocks stored by the producer
+        self._condition = threading.Condition()
+        self.dropped = 0
+
+    def put(self, data, wait=False):
+        if self._write - self._read >= len(self._slots):
+            if not wait:
+                self.dropped += 1
+                return False
+            with self._condition:
+                self._condition.wait_for(lambda: self._write - self._read < len(self._slots))
+        index = self._write % len(self._slots)
+        self._slots[index][:len(data)] = data
+        self._lengths[index] = len(data)
+        with self._condition:
+            self._write += 1
+            self._condition.notify()
+        return True
+
+    def get(self, timeout=None):
+        """Return a copy of the oldest block, or None if none arrived within `timeout`."""
+        with self._condition:
+            if not self._condition.wait_for(lambda: self._read != self._write, timeout=timeout):
+                return None
+        index = self._read % len(self._slots)
+        block = bytes(self._slots[index][:self._lengths[index]])
+        with self._condition:
+            self._read += 1
+            self._condition.notify()  # a waiting producer may continue
+        return block
+
+    def __len__(self):
+        return self._write - self._read
+
+
+class ChunkWriter:
+    """Writes blocks into rolling FLAC files of `chunk_seconds` each."""
+
+    def __init__(self, output_folder, prefix, rate, channels, sample_format, chunk_seconds=60, timestamp=None):
+        self.output_folder = output_folder
+        self.prefix = prefix
+        self.rate = rate
+        self.channels = channels
+        self.dtype, self.subtype = SAMPLE_FORMATS[sample_format]
+        self.chunk_frames = int(chunk_seconds * rate)
+        self._file = None
+        self._frames = 0
+        self._index = 0
+        self._timestamp = time.strftime("%Y-%m-%d--%H-%M-%S", time.localtime(timestamp))
+        self.files = []
+
+    def _open(self):
+        filename = f"{self.prefix}_{self._timestamp}_{self._index:03d}.flac"
+        path = os.path.join(self.output_folder, filename)
+        self._file = sf.SoundFile(path, "w", samplerate=self.rate, channels=self.channels,
+                                  format="FLAC", subtype=self.subtype)
+        self._frames = 0
+        self._index += 1
+        self.files.append(path)
+
+    def write(self, block):
+        samples = np.frombuffer(block, dtype=self.dtype).reshape(-1, self.channels)
+        while len(samples):
+            if self._file is None:
+                self._open()
+            take = min(len(samples), self.chunk_frames - self._frames)
+            self._file.write(samples[:take])
+            self._frames += take
+            samples = samples[take:]
+            if self._frames >= self.chunk_frames:
+                self.close()
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+class AudioCapture:
+    """Streams blocks from a capture device through a ring buffer into chunked FLAC files.
+
+    A capture thread only moves blocks from the device into the ring; the
+    calling thread compresses and writes them. The recording ends after
+    `duration` seconds, at the end of a file input, or when `stop_event` is set.
+    """
+
+    def __init__(self, open_input, output_folder, stop_event, prefix="hp", chunk_seconds=60, ring_blocks=64,
+                 clock=time):
+        self.open_input = open_input  # callable returning a fresh AlsaInput/FileInput
+        self.output_folder = output_folder
+        self.stop_event = stop_event
+        self.prefix = prefix
+        self.chunk_seconds = chunk_seconds
+        self.ring_blocks = ring_blocks
+        self.clock = clock  # file names use clock.time()
+        self.stats = {}
+
+    def _capture(self, source, ring, frames, frame_size, done, stats):
+        try:
+            # counted in frames, so the recording has exactly the requested length
+            while not self.stop_event.is_set() and frames > 0:
+                data, overrun = source.read()
+                if overrun:
+                    stats["overruns"] += 1
+                    continue
+                if data is None:
+                    break
+                stats["blocks"] += 1
+                frames -= len(data) // frame_size
+                ring.put(data, wait=source.wait_when_full)
+        except Exception as e:
+            stats["errors"] += 1
+            logging.error(f"[Audio] Capture error: {e}")
+        finally:
+            done.set()
+
+    def record(self, duration):
+        """Record `duration` seconds (or until stopped) and return the capture statistics."""
+        source = self.open_input()
+        dtype, _ = SAMPLE_FORMATS[source.sample_format]
+        frame_size = source.channels * np.dtype(dtype).itemsize
+        block_size = source.period_frames * frame_size
+        ring = BlockRing(self.ring_blocks, block_size)
+        writer = ChunkWriter(self.output_folder, self.prefix, source.rate, source.channels,
+                             source.sample_format, self.chunk_seconds, self.clock.time())
+        stats = {"blocks": 0, "overruns": 0, "dropped": 0, "errors": 0, "files": writer.files}
+        done = threading.Event()
+        capture = threading.Thread(target=self._capture, name="audio-capture",
+                                   args=(source, ring, duration * source.rate, frame_size, done, stats))
+
+        logging.info("[Audio] Recording started")
+        capture.start()
+        try:
+            while not (done.is_set() and len(ring) == 0):
+                block = ring.get(timeout=0.5)
+                if block is not None:
+                    writer.write(block)
+        finally:
+            capture.join()
+            writer.close()
+            source.close()
+            stats["dropped"] = ring.dropped
+            self.stats = stats
+
+        if self.stop_event.is_set():
+            logging.info("[Audio] Recording stopped (Emergency stop)")
+        logging.info(f"[Audio] Recording finished: {stats['blocks']} blocks, {stats['overruns']} overruns, "
+                     f"{stats['dropped']} dropped blocks, {len(writer.files)} files")
+        return stats
+
+
+if __name__ == "__main__":
+    # usage: python3 audio_capture.py <output folder> [--wav file.wav [--realtime]] [--seconds 10]
+    parser = argparse.ArgumentParser(description="Record or benchmark the audio capture pipeline")
+    parser.add_argument("output")
+    parser.add_argument("--wav", help="use a WAV file as fake input device instead of ALSA")
+    parser.add_argument("--realtime", action="store_true", help="pace the WAV input like the real device")
+    parser.add_argument("--device", default="hw:3,0")
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--chunk-seconds", type=float, default=60)
+    args = parser.parse_args()
+
+    if args.wav:
+        open_input = lambda: FileInput(args.wav, realtime=args.realtime)
+    else:
+        open_input = lambda: AlsaInput(args.device)
+    capture = AudioCapture(open_input, args.output, threading.Event(), chunk_seconds=args.chunk_seconds)
+
+    started, cpu = time.monotonic(), time.process_time()
+    stats = capture.record(args.seconds if not args.wav or args.realtime else float("inf"))
+    elapsed, cpu = time.monotonic() - started, time.process_time() - cpu
+    audio_seconds = sum(sf.info(path).duration for path in stats["files"])
+    print(f"{audio_seconds:.1f} s audio in {elapsed:.2f} s ({audio_seconds / max(elapsed, 1e-9):.1f}x realtime), "
+          f"{cpu:.2f} s cpu, {stats['overruns']} overruns, {stats['dropped']} dropped blocks")
@@ -0,0 +1,323 @@
+import time         # latencies, default clock
+import logging      # event logging
+import argparse     # command line interface
+import threading    # session state is changed from several scheduler workers
+
+from hal import FrameMonitor  # encoder frames
+
+# encoder settings per lighting phase: before the light is on, while exposure and white
+# balance adapt to it, and once they have converged
+PHASES = ("dark", "settling", "lit")
+
+# libcamera AeState value of a converged exposure (newer libcamera, replaces AeLocked)
+AE_STATE_CONVERGED = 2
+
+
+class ExposureTracker:
+    """Decides from per-frame metadata when auto exposure and white balance have converged.
+
+    Exposure counts as converged when libcamera reports it (AeLocked or AeState,
+    if present) and exposure time x gain as well as the colour gains changed by
+    less than `tolerance` (relative) over `stable_frames` consecutive frames.
+    """
+
+    def __init__(self, stable_frames=3, tolerance=0.05):
+        self.stable_frames = stable_frames
+        self.tolerance = tolerance
+        self.frames = 0
+        self._stable = 0
+        self._previous = None
+
+    @staticmethod
+    def _values(metadata):
+        exposure = metadata.get("ExposureTime", 0) * metadata.get("AnalogueGain", 1.0) * metadata.get("DigitalGain", 1.0)
+        return (exposure,) + tuple(metadata.get("ColourGains", ()))
+
+    def update(self, metadata):
+        """Feed the metadata of one frame; returns True once converged."""
+        self.frames += 1
+        values = self._values(metadata)
+        previous, self._previous = self._previous, values
+        if previous is not None and len(previous) == len(values) and all(
+                abs(value - before) <= self.tolerance * max(abs(before), 1e-9)
+                for value, before in zip(values, previous)):
+            self._stable += 1
+        else:
+            self._stable = 0
+        locked = metadata.get("AeLocked")
+        if locked is None and "AeState" in metadata:
+            locked = metadata["AeState"] == AE_STATE_CONVERGED
+        return locked is not False and self._stable >= self.stable_frames
+
+
+class CameraSession:
+    """Keeps the configured camera pipeline and sequences it with the light.
+
+    `warm_up` starts the sensor shortly before a recording, so
+    `start_recording` only has to start the encoder. `light_on` (or `warm_up`
+    when the light is already on) waits (at most `settle_timeout`) until exposure and white balance
+    have converged under the light, starting from the exposure of the previous
+    lit cycle (`seed`). The encoder settings follow the phase; a different
+    framerate or bitrate continues the recording in a new file with the phase as
+    suffix, since raw h264 carries no timestamps and every file has to play at
+    one framerate (`framerates` maps each file to it).
+
+    Every recording reports the time from its start to the first usable frame,
+    i.e. lit and converged (only for recordings with the light on).
+    """
+
+    def __init__(self, picam2, make_encoder, make_output, metrics, stop_event, clock=time, framerate=30,
+                 bitrate=800000, phases=None, quality=None, settle_timeout=3.0, stable_frames=3,
+                 tolerance=0.05, seed=True, keep_running=False, max_start_latency=0.1):
+        self.picam2 = picam2
+        self.make_encoder = make_encoder    # bitrate -> encoder
+        self.make_output = make_output      # filename -> picamera2 output
+        self.metrics = metrics
+        self.stop_event = stop_event
+        self.clock = clock
+        self.quality = quality
+        self.settle_timeout = settle_timeout
+        self.stable_frames = stable_frames
+        self.tolerance = tolerance
+        self.seed = seed
+        self.keep_running = keep_running
+        self.max_start_latency = max_start_latency
+        default = {"framerate": framerate, "bitrate": bitrate}
+        self.phases = {phase: dict(default, **(phases or {}).get(phase, {})) for phase in PHASES}
+
+        self._lock = threading.RLock()
+        self.running = False        # sensor streaming
+        self.light = False
+        self.phase = "dark"
+        self.framerate = framerate  # currently set on the camera
+        self._lit_controls = None   # converged exposure of the last lit cycle
+        self._encoders = {}         # bitrate -> encoder, reused between recordings
+        self._encoder = None        # running encoder
+        self._monitor = None
+        self._filename = None
+        self.files = []             # every file written, taken by the caller
+        self.framerates = {}        # file -> framerate it was recorded at
+        self._reset_cycle()
+
+    def _reset_cycle(self):
+        self._light_at = None       # clock monotonic times of this cycle
+        self._converged_at = None
+        self._recording_at = None
+        self._start_latency = None  # real seconds to start the encoder
+
+    # --- camera
+
+    def warm_up(self):
+        """Start the sensor, so exposure runs and the encoder can start at once.
+
+        When the light is already on, returns once exposure has settled.
+        """
+        with self._lock:
+            if self.running:
+                return
+            self._reset_cycle()
+            self._set_framerate(self.phases[self.phase]["framerate"])
+            with self.metrics.timer("camera.start"):
+                self.picam2.start()
+            self.running = True
+            if not self.light:
+                return
+            self._light_at = self.clock.monotonic()
+        self._settle()
+
+    def _idle(self):
+        if self.running and not self.keep_running and self._encoder is None:
+            with self.metrics.timer("camera.stop"):
+                self.picam2.stop()
+            self.running = False
+
+    def _set_framerate(self, framerate):
+        if framerate != self.framerate:
+            self.picam2.set_controls({"FrameRate": framerate})
+            self.framerate = framerate
+        if self._monitor is not None:
+            self._monitor.framerate = framerate
+
+    def _set_phase(self, phase):
+        with self._lock:
+            previous, self.phase = self.phase, phase
+            if not self.running:
+                return
+            settings = self.phases[phase]
+            # the bitrate of a running encoder can not be changed, and a file must keep its framerate
+            split = self._encoder is not None and (settings["bitrate"] != self.phases[previous]["bitrate"]
+                                                   or settings["framerate"] != self.framerate)
+            if split:
+                self._stop_encoder()
+            self._set_framerate(settings["framerate"])
+            if split:
+                self._start_encoder(self._segment_name(phase), settings["bitrate"])
+                logging.info(f"[Video] Phase {phase}: new segment at {settings['bitrate']} bit/s, "
+                             f"{settings['framerate']} fps")
+
+    def _segment_name(self, phase):
+        base = self._filename.rsplit(".", 1)[0]
+        name, number = f"{base}_{phase}.h264", 1
+        while name in self.files:  # e.g. a second lit phase in the same recording
+            number += 1
+            name = f"{base}_{phase}{number}.h264"
+        return name
+
+    def _start_encoder(self, filename, bitrate):
+        self._encoder = self._encoders.get(bitrate)
+        if self._encoder is None:
+            self._encoder = self._encoders[bitrate] = self.make_encoder(bitrate)
+        self._monitor = FrameMonitor(self.make_output(filename), self.metrics, self.framerate)
+        started = time.perf_counter()
+        try:
+            self.picam2.start_encoder(self._encoder, self._monitor, quality=self.quality)
+        except Exception:
+            self._encoder = None
+            self._monitor = None
+            self.metrics.counter("camera.start_failures").inc()
+            raise
+        latency = time.perf_counter() - started
+        self.files.append(filename)
+        self.framerates[filename] = self.framerate
+        self.metrics.observe("camera.start_encoder", latency)
+        return latency
+
+    def _stop_encoder(self):
+        with self.metrics.timer("camera.stop_encoder"):
+            self.picam2.stop_encoder()
+        self._encoder = None
+        self._monitor = None
+
+    # --- light
+
+    def _wait_converged(self):
+        """Metadata of the first converged frame, None on timeout."""
+        tracker = ExposureTracker(self.stable_frames, self.tolerance)
+        deadline = self.clock.monotonic() + self.settle_timeout
+        while self.clock.monotonic() < deadline and not self.stop_event.is_set():
+            metadata = self.picam2.capture_metadata()
+            if tracker.update(metadata):
+                return metadata
+        return None
+
+    def light_on(self):
+        """Called right after the light was switched on; returns once exposure has settled."""
+        with self._lock:
+            self.light = True
+            self._light_at = self.clock.monotonic()
+            if not self.running:
+                return
+        self._settle()
+
+    def _settle(self):
+        with self._lock:
+            self._set_phase("settling")
+            if self.seed and self._lit_controls is not None:
+                # start the exposure loops from the last lit exposure instead of the dark one
+                self.picam2.set_controls(self._lit_controls)
+                self.picam2.capture_metadata()
+                self.picam2.set_controls({"AeEnable": True, "AwbEnable": True})
+
+        metadata = self._wait_converged()
+        with self._lock:
+            if not self.light or not self.running:
+                return  # switched off or stopped while settling
+            settle = self.clock.monotonic() - self._light_at
+            self.metrics.observe("camera.settle", settle)
+            if metadata is None:
+                self.metrics.counter("camera.settle_timeouts").inc()
+                logging.warning(f"[Video] Exposure not converged {settle:.2f} s after light on")
+            else:
+                self._lit_controls = {name: metadata[name] for name in ("ExposureTime", "AnalogueGain", "ColourGains")
+                                      if name in metadata}
+            self._converged_at = self.clock.monotonic()
+            self._set_phase("lit")
+
+    def light_off(self):
+        with self._lock:
+            self.light = False
+            self._set_phase("dark")
+            self._idle()
+
+    # --- recording
+
+    def start_recording(self, filename):
+        with self._lock:
+            if not self.running:
+                # not warmed up (e.g. the warm-up was late): cold start
+                self.metrics.counter("camera.cold_starts").inc()
+                logging.warning("[Video] Camera was not warmed up, cold start")
+                self.warm_up()
+            self._filename = filename
+            try:
+                self._start_latency = self._start_encoder(filename, self.phases[self.phase]["bitrate"])
+            except Exception:
+                self._idle()  # do not keep the sensor running for a recording that never started
+                raise
+            self._recording_at = self.clock.monotonic()
+            if self._start_latency > self.max_start_latency:
+                logging.warning(f"[Video] Encoder start took {self._start_latency * 1000:.0f} ms")
+
+    def stop_recording(self):
+        with self._lock:
+            if self._encoder is None:
+                return
+            self._stop_encoder()
+            self._report()
+            self._idle()
+
+    def _report(self):
+        started = f"encoder started in {self._start_latency * 1000:.0f} ms"
+        if self._light_at is None:
+            logging.info(f"[Video] Recorded without light, {started}")
+            return
+        usable = max(self._converged_at or self.clock.monotonic(), self._recording_at) - self._recording_at
+        self.metrics.observe("camera.first_usable", usable)
+        settled = (f"light settled in {self._converged_at - self._light_at:.2f} s"
+                   if self._converged_at is not None else "light not settled")
+        logging.info(f"[Video] First usable frame {usable:.2f} s after the start of the recording "
+                     f"({settled}, {started})")
+
+    def close(self):
+        with self._lock:
+            if self._encoder is not None:
+                self._stop_encoder()
+            if self.running:
+                self.picam2.stop()
+                self.running = False
+
+
+if __name__ == "__main__":
+    # sequence of a cycle on the fake camera: warm-up, recording, light on/off
+    from hal import FakeCamera, FakeEncoder, FakeOutput, FakePwm, ScaledClock
+    from metrics import Metrics
+    import tempfile, os
+
+    parser = argparse.ArgumentParser(description="Camera session on the fake camera")
+    parser.add_argument("--cycles", type=int, default=3)
+    parser.add_argument("--no-seed", action="store_true", help="do not start from the last lit exposure")
+    args = parser.parse_args()
+
+    clock = ScaledClock(10.0)
+    light = FakePwm("D12", 50)
+    camera = FakeCamera(clock, lambda: light.duty_cycle / 65535)
+    camera.configure(camera.create_video_configuration(controls={"FrameRate": 30}))
+    metrics = Metrics(clock)
+    stop_event = threading.Event()
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    with tempfile.TemporaryDirectory() as folder:
+        session = CameraSession(camera, lambda bitrate: FakeEncoder(), FakeOutput, metrics, stop_event,
+                                clock=clock, phases={"dark": {"framerate": 15}}, seed=not args.no_seed)
+        for cycle in range(args.cycles):
+            session.warm_up()
+            session.start_recording(os.path.join(folder, f"cycle{cycle}.h264"))
+            clock.wait(stop_event, 2.0)
+            light.duty_cycle = int((1900 / 20000) * 65535)
+            session.light_on()
+            clock.wait(stop_event, 2.0)
+            session.stop_recording()
+            light.duty_cycle = int((1100 / 20000) * 65535)
+            session.light_off()
+    for name in ("camera.start", "camera.start_encoder", "camera.settle", "camera.first_usable"):
+        summary = metrics.histogram(name).summary()
+        print(f"{name}: mean {summary['mean'] * 1000:.1f} ms, max {summary['max'] * 1000:.1f} ms")
@@ -2,102 +2,227 @@ import threading    # Support threading
 import time         # Various timing functions
 import logging      # Functionality for automated error log creation
 import signal       # Safe Ctrl+C/Z functionality
-import pwmio        # For use with the main LED
-import board        # GPIO assertion
 import os           # filepath generation
-import subprocess   # calling subprocess commands
-from subprocess import call   # calling bash scripts in python
-import csv          # writing to a .csv
-import serial       # uart connection (for ina260)
-import digitalio    # reading GPIO states (for leak sensor)
 
-from picamera2.encoders import H264Encoder, Quality  # Camera functions
-from picamera2 import Picamera2
-from libcamera import controls
-
-from w1thermsensor import W1ThermSensor # Temperature sensor functionality
+from hal import PiDevices, SystemClock          # camera, uart, gpio, ... and the clock
+from log_pipeline import setup_logging, CONSOLE # queued, batched event log and console output
+from metrics import Metrics, MetricsFile, MetricsServer, ResourceSampler  # timings and resources
+from camera_session import CameraSession        # warm camera pipeline sequenced with the light
+from postprocess import PostProcessor           # remux, hashes, thumbnails and sidecars in the idle time
+from storage import StorageManager, RECORDINGS  # file catalog, disk budget and eviction
+from offload import Offloader, HttpTarget       # resumable uploads while wifi is up
+from tsdb import TimeSeriesStore        # sensor log with minute/hour rollups
+from energy import EnergyManager, SCHEDULES  # energy budget and adaptive duty cycle
+from uart_ingest import SampleRing, UartIngest  # non-blocking ina260 sample ingest
+from scheduler import Scheduler                 # monotonic timer queue for all timed actions
+from motion_recording import MotionRecorder     # motion-triggered video with pre-roll
+from audio_capture import AudioCapture          # in-process flac audio recording
+from acoustic_features import FeatureWorker, feature_path  # spectrograms and acoustic indices per recording
+from temperature import TemperatureReader       # background 1-wire temperature acquisition
+from safety import SafetyWatchdog, VoltageEvaluator  # leak and low voltage shutdown
+from status_leds import LedController, blink, heartbeat, error_code, PRIORITY_ERROR, PRIORITY_STATUS, PRIORITY_HEARTBEAT  # non-blocking status LEDs
+
+
+console = logging.getLogger(CONSOLE)  # status messages for the screen session only
+METRICS_PORT = 8765  # local metrics endpoint, see metrics.py
+UART_TIMEOUT = 10  # seconds without a sample from the Pico before its error code is shown
+# number of blinks of both red status LEDs per error
+ERROR_CODES = {"camera": 2, "storage": 3, "uart": 4}
 
 
 class VideoLogFilter(logging.Filter):
     def filter(self, record):
-        if "picamera2" in record.name or "libcamera" in record.name:
+        if record.name.split(".")[0] in ("picamera2", "libcamera"):
             record.msg = f"[Video] {record.msg}"
         return True  # Allow the message to be logged
 
 # Main functionality of the system
 class CameraSystem:
-    def __init__(self):
+    def __init__(self, schedule, devices=None, clock=None):
         try:
             """Initialize system components."""
+            self.schedule = schedule  # configured cycle, adapted per cycle by the energy manager
+            motion_video = schedule.get("motion_video", False)
+            # hardware and clock, replaced by fakes and a faster clock in simulate.py
+            self.devices = devices or PiDevices()
+            self.clock = clock or SystemClock()
+            storage = self.devices.storage
             self.stop_event = threading.Event()  # Shared stop signal for all threads
-
-            # Configure event logging
-            logging.basicConfig(
-                filename="/home/pi/seesaibling/error/system_log.txt",
-                level=logging.INFO,
-                format="%(asctime)s - %(levelname)s - %(message)s",
-            )
+            self.started = self.clock.monotonic()
+            self.telemetry = None  # created below, checked by signal_handler
+            self.energy = None
+            self.scheduler = None
+            self.feature_worker = None
+            self.metrics_file = None
+            self.metrics_server = None
+            self.led_main = None
+            self.led_controller = None
+            self.picam2 = None
+            self.camera = None
+            self.postprocess = None
+            self.offload = None
+
+            # Configure event logging: every thread only queues its records, one writer thread
+            # batches them into JSON lines and prints them to the console
+            self.log_pipeline = setup_logging(os.path.join(storage, "error", "system_log.jsonl"))
             
-            # Create a specific handler for camera logs
-            video_handler = logging.StreamHandler()
-            video_formatter = logging.Formatter("%(asctime)s - %(levelname)s - [Video] %(message)s")
-            video_handler.setFormatter(video_formatter)
-
-            # Apply this handler to picamera2 and libcamera loggers
+            # picamera2 and libcamera messages go through the same queue, tagged as [Video];
+            # the filter sits on the queue handler, logger filters would miss their child loggers
             for lib in ["picamera2", "libcamera"]:
-                logger = logging.getLogger(lib)
-                logger.setLevel(logging.INFO)
-                logger.addHandler(video_handler)
-                logger.propagate = False  # Prevent double logging
+                logging.getLogger(lib).setLevel(logging.INFO)
+            self.log_pipeline.handler.addFilter(VideoLogFilter())
+
+            # Metrics: task timings, blocking camera calls, encoder frames and resources,
+            # kept in memory and written as a snapshot every 15 minutes
+            self.metrics = Metrics(clock=self.clock)
+            self.metrics_file = MetricsFile(os.path.join(storage, "data"))
+            self.metrics_port = schedule.get("metrics_port")  # None: no endpoint
             
             # Camera setup
-            self.picam2 = Picamera2()
+            self.picam2 = self.devices.camera()
+            # the motion mode analyses an additional low resolution stream
+            lores = {"size": (320, 240), "format": "YUV420"} if motion_video else None
+            self.framerate = 30
             self.picam2.configure(self.picam2.create_video_configuration(
                 main={"size": (2028, 1080), "format": "YUV420"},
-                controls={"FrameRate": 30}
+                lores=lores,
+                controls={"FrameRate": self.framerate}
             ))
-            self.encoder = H264Encoder(bitrate=800000)
+            self.encoder = self.devices.encoder(bitrate=800000)
+            self.motion_recorder = None
+            self.camera_warmup = 2.0  # seconds the sensor is started before a recording
+            if not motion_video:
+                # fixed length recordings start the encoder on the warm pipeline; exposure settles
+                # under the light, frames before the light is on are recorded at a lower framerate
+                self.camera = CameraSession(
+                    self.picam2, self.devices.encoder, self.devices.file_output, self.metrics, self.stop_event,
+                    clock=self.clock, framerate=self.framerate, bitrate=800000,
+                    phases={"dark": {"framerate": 15}}, quality=self.devices.quality, settle_timeout=3.0,
+                )
+            else:
+                self.motion_recorder = MotionRecorder(
+                    self.picam2, self.encoder, os.path.join(storage, "video"), os.path.join(storage, "data"),
+                    self.stop_event, threshold=0.02, hold=5.0, preroll=3.0, framerate=self.framerate,
+                    metrics=self.metrics, clock=self.clock,
+                )
 
             # LED
-            self.led_main = None
             self.fre = 50  # Main LED PWM frequency
             
-            # Audio recording subprocess calling
-            self.process = None
+            # Audio recording, captured in-process into chunked flac files
+            self.audio_capture = AudioCapture(
+                self.devices.audio_input, os.path.join(storage, "recordings"), self.stop_event,
+                prefix="hp", chunk_seconds=60, clock=self.clock,
+            )
+            # Every recording and telemetry file is catalogued; recordings are evicted to stay
+            # within the disk budget (whole card without "storage_budget" [bytes])
+            self.storage_manager = StorageManager(storage, budget=schedule.get("storage_budget"),
+                                                  reserve=256 * 2 ** 20, clock=self.clock, metrics=self.metrics)
+
+            # Acoustic features are computed in a low priority process at the end of each cycle,
+            # their activity score goes into the catalog
+            self.feature_worker = FeatureWorker(window_seconds=1.0, nfft=2048, on_done=self.features_written)
+            self.new_recordings = []
+
+            # Finished recordings are remuxed, hashed and described in the idle part of each interval;
+            # the journal keeps the open jobs over a reboot
+            self.postprocess = PostProcessor(os.path.join(storage, "data", "postprocess.jsonl"), workers=1,
+                                             nice=19, framerate=self.framerate, clock=self.clock,
+                                             metrics=self.metrics, on_done=self.recording_processed)
+            self.idle_margin = 10.0  # seconds the background work pauses before the next cycle
+            self.cycle = 0
+            self.cycle_wall_start = None
+            self.cycle_schedule = None
+
+            # All timed actions (light, video, audio, sensor sampling) are dispatched from here
+            self.scheduler = Scheduler(self.stop_event, workers=4, clock=self.clock.monotonic,
+                                       timescale=self.clock.scale, metrics=self.metrics)
 
             # Register signal handlers
             signal.signal(signal.SIGINT, self.signal_handler)   # Ctrl + C
             signal.signal(signal.SIGTSTP, self.signal_handler)  # Ctrl + Z
             
+            # Sensor data store: raw segments flushed in batches plus minute/hour rollups
+            self.telemetry = TimeSeriesStore(os.path.join(storage, "data"), max_rows=64, max_age=300.0)
+
             # Temperature sensor setup
-            self.sensor = W1ThermSensor()
+            # conversions are triggered for the whole bus and collected in the background
+            self.temperature_reader = TemperatureReader(self.devices.w1_bus(), self.stop_event, interval=10.0,
+                                                        resolution=12, clock=self.clock)
+            self.temperature_max_age = 60.0  # older values are logged as missing
             self.temperature = None
             
             # uart connection setip
-            self.ser = serial.Serial('/dev/serial0', baudrate=115200, timeout=0.5)
+            self.ser = self.devices.uart()
+            self.samples = SampleRing(capacity=3600)  # about one hour of pico samples
+            # has to match PROTOCOL in rpi_pico_uart.py
+            self.uart_ingest = UartIngest(self.ser, self.samples, self.stop_event, protocol="binary",
+                                          clock=self.clock)
             
             # initiate variables for handling errors
             self.voltage = None # for low voltage shutdown
             self.voltage_treshold = 10.5 # set the lower voltage limit
-            self.current = None # not used at the moment
-            self.power = None   # not used at the moment
+            self.current = None # latest values, the energy manager books every sample
+            self.power = None
+            
+            # Energy budget: measured power per task, battery estimate and the adaptive schedule
+            self.battery_capacity = 1000.0  # Wh, nominal capacity of the battery pack
+            self.energy = EnergyManager(self.battery_capacity, schedule["target_days"],
+                                        state_path=os.path.join(storage, "data", "energy.json"),
+                                        started=self.clock.time(), reset=schedule.get("new_deployment", False))
             
-            # Setup leak sensor
-            input_pin = board.D16  # Example: GPIO 7 (physical pin 26)
-            self.leak_pin = digitalio.DigitalInOut(input_pin)
-            self.leak_pin.direction = digitalio.Direction.INPUT
-            self.leak_pin.pull = digitalio.Pull.DOWN  # Use pull-down to ensure LOW when no input
+            # Wifi state, read from sysfs and cached instead of calling ifconfig
+            self.network = self.devices.network()
+            self.network.subscribe(self.wifi_changed)
+
+            # Processed recordings and closed telemetry files are uploaded to "offload_url" in the
+            # idle part of each interval while the wifi is up; the queue survives a reboot
+            if schedule.get("offload_url"):
+                self.offload = Offloader(storage, HttpTarget(schedule["offload_url"]),
+                                         os.path.join(storage, "data", "offload.sqlite"),
+                                         rate=schedule.get("offload_rate", 250e3), chunk_size=256 * 1024, nice=19,
+                                         connected=self.network.is_connected, clock=self.clock, metrics=self.metrics)
+
+            # Setup leak sensor, with pull-down to ensure LOW when no input
+            self.leak_pin = self.devices.digital_in("D16")  # Example: GPIO 7 (physical pin 26)
+            
+            # Safety watchdog: polls the leak pin every 20 ms and evaluates every new voltage sample
+            self.safety = SafetyWatchdog(
+                lambda: self.leak_pin.value, self.shut_down, self.stop_event,
+                VoltageEvaluator(threshold=self.voltage_treshold, hysteresis=0.2, debounce=3),
+                poll_interval=0.02, clock=self.clock,
+            )
+            self.uart_ingest.listeners.append(self.safety.on_sample)
+            self.uart_ingest.listeners.append(self.energy.on_sample)  # after the watchdog, which is time critical
+            
+            # cpu temperature and load are kept per set of active tasks (light, video, audio)
+            self.resources = ResourceSampler(self.metrics, self.devices.thermal, storage,
+                                             active=lambda: self.energy.ledger.active)
+            # values read at every metrics snapshot
+            gauge = self.metrics.gauge
+            gauge("uart.frames", lambda: self.uart_ingest.frames)
+            gauge("uart.gaps", lambda: self.uart_ingest.gaps)
+            gauge("uart.resets", lambda: self.uart_ingest.resets)
+            gauge("uart.corrupt", lambda: self.uart_ingest.corrupt)
+            gauge("log.dropped", lambda: self.log_pipeline.handler.dropped)
+            gauge("energy.used_wh", lambda: round(self.energy.used_wh, 2))
+            gauge("postprocess.pending", lambda: len(self.postprocess.journal.jobs))
+            gauge("storage.used", self.storage_manager.used)  # catalogued bytes, free space: ResourceSampler
+            if self.offload is not None:
+                gauge("offload.pending", lambda: self.offload.queue.pending()[1])
             
             # initialize status LEDs (at back of monitoring unit)    
-            self.led_green1 = digitalio.DigitalInOut(board.D25)
-            self.led_green2 = digitalio.DigitalInOut(board.D26)
-            self.led_red1 = digitalio.DigitalInOut(board.D6)
-            self.led_red2 = digitalio.DigitalInOut(board.D13)
+            self.led_green1 = self.devices.digital_out("D25")
+            self.led_green2 = self.devices.digital_out("D26")
+            self.led_red1 = self.devices.digital_out("D6")
+            self.led_red2 = self.devices.digital_out("D13")
             
-            # put the leds into a list and define as output
+            # put the leds into a list
             self.leds = [self.led_green1, self.led_green2, self.led_red1, self.led_red2]
-            for led in self.leds:
-                led.direction = digitalio.Direction.OUTPUT
+            
+            # a single background thread plays all status LED patterns
+            self.led_controller = LedController(self.leds, self.stop_event)
+            self.led_controller.start()
             
             # You can add more setup code as needed
             logging.info("[System] Initialization successful.")
@@ -113,17 +238,42 @@ class CameraSystem:
     def signal_handler(self, sig, frame):
         """Handles termination signals and stops all running tasks safely."""
         logging.info("[System] Termination signal received, stopping...")
-        print("\n[\033[4;31mSystem \033[0m] Termination signal received, stopping...")
 
         self.stop_event.set()  # Stop all threads
+        if self.led_controller is not None:
+            self.led_controller.clear()  # no queued pattern is started anymore
+        if self.scheduler is not None:
+            self.scheduler.shutdown(wait=False)  # may run inside a scheduler worker
+        if self.feature_worker is not None:
+            self.feature_worker.shutdown()
+        if self.postprocess is not None:
+            self.postprocess.shutdown()  # interrupted jobs run again after the restart
+            self.storage_manager.close()
+        if self.offload is not None:
+            self.offload.shutdown()  # interrupted uploads continue at the offset of the server
+
+        # Write the remaining sensor rows and the energy state before anything else can fail
+        if self.telemetry is not None:
+            self.telemetry.close()
+        if self.energy is not None:
+            self.energy.save()
+        if self.metrics_file is not None:
+            self.write_metrics()
+        if self.metrics_server is not None:
+            self.metrics_server.stop()
+            self.metrics_server = None
+
         try:
+            if self.camera is not None:
+                self.camera.close()
             self.picam2.stop_recording()
             # Reset the encoder state
             encoder.reset()  # This should be used if available, or set encoder to a new state
         except:
             pass  # Ignore if already stopped
 
-        self.picam2.close()  # Properly release camera resources
+        if self.picam2 is not None:
+            self.picam2.close()  # Properly release camera resources
 
         # Turn off LED safely
         if self.led_main is not None:
@@ -132,295 +282,367 @@ class CameraSystem:
             self.led_main = None
             
         logging.info("[System] Shutdown complete.")
-        print("[\033[4;31mSystem\033[0m] Shutdown complete.")
+        self.log_pipeline.flush()
         exit(0)
     
-    def shut_down(self, voltage, leak):
-        # shuts down rpi
+    def shut_down(self, reason):
+        """Shuts down the rpi after a safety event, called by the safety watchdog."""
         shutdown_time = 120 # seconds
-        if type(self.voltage) == float or leak:
-            if self.voltage <= self.voltage_treshold:
-                error_reason = "Voltage treshold reached"
-            elif leak: 
-                error_reason = "Leak"
-            else:
-                error_reason = "Unknown"
-            logging.error(f"[System] Error: {error_reason}, shutting down...")
-            rc = call("./shutDown.sh")
-            print(f"[\033[4;31mSystem\033[0m] Shutting down in {shutdown_time} seconds")
-            # break from the while loop
-            print("[\033[4;31mSystem\033[0m] Terminating all threads.")
-            self.signal_handler(None, None)  # Manually invoke the shutdown method
-            return(True)
+        logging.error(f"[System] Error: {reason}, shutting down...")
+        self.telemetry.flush()  # make sure the last rows are on the card
+        self.devices.shutdown()
+        logging.info(f"[System] Shutting down in {shutdown_time} seconds")
+        # break from the while loop
+        logging.info("[System] Terminating all threads.")
+        self.signal_handler(None, None)  # Manually invoke the shutdown method
+        return(True)
     
-    def error_sensors(self, duration):
-        while not self.stop_event.is_set():
-            while self.ser.in_waiting:
-                temp = self.ser.readline().decode('utf-8').strip()
-                if ',' in temp:  # Avoid clearing valid messages
-                    data = temp
-                    break
-            else:
-                data = self.ser.readline().decode('utf-8').strip()
-
-            split_data = data.split(",")  
-            split_data = [x.strip() for x in split_data]
-
-            # Ensure the data is valid
-            if len(split_data) == 3:
-                try:
-                    voltage, current, power = map(float, split_data)
-                    if 5.0 <= voltage <= 15.0:  # sanity check on voltage range
-                        self.voltage, self.current, self.power = voltage, current, power
-                    else:
-                        print("Voltage out of expected range, ignoring.")
-                except ValueError:
-                    print("Data conversion error, ignoring.")
-            else:
-                print("Incomplete data received, ignoring.")
-            
-            if type(self.voltage) == float:
-                if self.voltage <= self.voltage_treshold:
-                    print("[\033[4;31mSystem\033[0m] Calling shutdown method.")
-                    self.shut_down(self.voltage, self.leak_pin.value)
-            
-            if self.leak_pin.value:
-                print("[\033[4;31mSystem\033[0m] Calling shutdown method.")
-                self.shut_down(self.voltage, self.leak_pin.value)
-                
-            if self.wifi_connection():
-                # print("[\033[4;31mSystem\033[0m] Wifi connection reached.")
-                self.blink_status_leds(leds_to_blink=[self.led_green2], times=1)
-            elif not self.wifi_connection():
-                self.blink_status_leds(leds_to_blink=[self.led_red1], times=1)
-                
-            
-            #here we assume everything is okay and we blink the leds
-            self.blink_status_leds(leds_to_blink=[self.led_green1], times=1)
-            time.sleep(duration)
+    def check_sensors(self):
+        """Updates the latest power readings and the status LEDs, scheduled every few seconds."""
+        # the uart ingest thread keeps the sample buffer up to date,
+        # leak and low voltage are handled by the safety watchdog
+        sample = self.samples.latest()
+        if sample is not None:
+            self.voltage, self.current, self.power = sample.voltage, sample.current, sample.power
+        last = sample.monotonic if sample is not None else self.started
+        if self.clock.monotonic() - last > UART_TIMEOUT:
+            self.show_error("uart")
+        
+        if self.wifi_connection():
+            # print("[\033[4;31mSystem\033[0m] Wifi connection reached.")
+            self.blink_status_leds(leds_to_blink=[self.led_green2], times=1)
+        else:
+            self.blink_status_leds(leds_to_blink=[self.led_red1], times=1)
+        
+        # the scheduler is alive
+        self.led_controller.post(heartbeat(self.led_green1), PRIORITY_HEARTBEAT)
         
     def log_sensor_data(self, duration):
-        """Logs sensor data every `duration` seconds until stopped."""
-        while not self.stop_event.is_set():
-            print("[Sensor] Logging data...")
-            # get temperature data
-            self.temperature = self.record_temperature()
-            # current, voltage and power data is handled by error_sensors method
-            # but data is logged in this method
-            data_to_Write = [time.time(), self.voltage, self.current, self.power, self.temperature]  # Merge all values
-            with open("/home/pi/seesaibling/data/data.txt", 'at', newline = '') as file:
-                wr = csv.writer(file, quoting=csv.QUOTE_MINIMAL)
-                wr.writerow(data_to_Write)
-            time.sleep(duration)
-            
-    def monitor_errors(self):
-        """Monitors for errors and triggers an emergency stop if needed."""
-        while not self.stop_event.is_set():
-            error_detected = False
-            # Add error detection functionality here
-            
-            if error_detected:
-                logging.error("[Error] Emergency stop triggered!")
-                print("[Error] Emergency stop triggered!")
-                self.stop_event.set()
-                break
-            time.sleep(1)  # Check every 1 second
+        """Logs one row of sensor data, averaged over the last `duration` seconds."""
+        console.info("[Sensor] Logging data...")
+        # get temperature data
+        self.temperature = self.record_temperature()
+        # current, voltage and power are averaged over all samples of the logging period
+        window = self.samples.window(duration, now=self.clock.monotonic())
+        if window:
+            voltage = sum(sample.voltage for sample in window) / len(window)
+            current = sum(sample.current for sample in window) / len(window)
+            power = sum(sample.power for sample in window) / len(window)
+            # binary frames also report the peak current between frames (e.g. light inrush)
+            current_max = max(sample.current if sample.current_max is None else sample.current_max
+                              for sample in window)
+        else:
+            voltage, current, power, current_max = self.voltage, self.current, self.power, self.current
+        data_to_Write = [self.clock.time(), voltage, current, power, self.temperature, current_max]  # Merge all values
+        with self.metrics.timer("telemetry.write"):
+            self.telemetry.write(data_to_Write)
             
-    def control_light(self, start_delay, duration):
-        """Controls the LED light with a delay and duration."""
-        time.sleep(start_delay)
+    def light_on(self):
+        """Switches the main light on."""
         if self.stop_event.is_set():
             return
         
         logging.info("[Light] ON")
-        print("[\033[4;33mLight\033[0m] ON")
         
         # Initialize LED
-        self.led_main = pwmio.PWMOut(board.D12, frequency=self.fre, duty_cycle=0)
+        self.led_main = self.devices.pwm("D12", frequency=self.fre)
         
         # Convert microseconds to a duty cycle percentage
         duty_cycle_on = int((1900 / 20000) * 65535)  # LED ON
-        duty_cycle_off = int((1100 / 20000) * 65535)  # LED OFF
-        
         self.led_main.duty_cycle = duty_cycle_on
+        self.energy.start_task("light")
+        if self.camera is not None:
+            self.camera.light_on()  # returns once exposure has settled, if the camera is running
         
-        for _ in range(duration):
-            if self.stop_event.wait(timeout=1):
-                logging.info("[Light] OFF (Emergency stop)")
-                print("[Light] OFF (Emergency stop)")
-                self.led_main.duty_cycle = duty_cycle_off
-                self.led_main.deinit()
-                self.led_main = None
-                return
+    def light_off(self):
+        """Switches the main light off."""
+        if self.led_main is None:
+            return
         
+        duty_cycle_off = int((1100 / 20000) * 65535)  # LED OFF
         self.led_main.duty_cycle = duty_cycle_off
         self.led_main.deinit()
         self.led_main = None
+        self.energy.stop_task("light")
+        if self.camera is not None:
+            self.camera.light_off()
         
         logging.info("[Light] OFF")
-        print("[\033[4;33mLight\033[0m] OFF")
         
-    def record_audio(self, start_delay, duration):
-        """Simulates audio recording."""
-        if duration == 0:
+    def record_audio(self, duration):
+        """Records `duration` seconds of audio, returns early when the stop event is set."""
+        if duration == 0 or self.stop_event.is_set():
             return
-        else:
-            time.sleep(start_delay) # wait to execute
-            
-        # check if event is already stopped
+        self.energy.start_task("audio")
+        try:
+            stats = self.audio_capture.record(duration)
+        finally:
+            self.energy.stop_task("audio")
+        self.submit_recordings(stats["files"], duration)
+        self.metrics.counter("audio.overruns").inc(stats["overruns"])
+        self.metrics.counter("audio.dropped").inc(stats["dropped"])
+        if stats["overruns"] or stats["dropped"]:
+            logging.warning(f"[Audio] {stats['overruns']} overruns, {stats['dropped']} dropped blocks")
+        self.new_recordings.extend(stats["files"])
+
+    def extract_features(self):
+        """Hands the recordings of the finished cycle to the feature worker."""
+        recordings, self.new_recordings = self.new_recordings, []
+        if recordings and not self.stop_event.is_set():
+            self.feature_worker.submit(recordings)
+
+    def start_video(self, duration):
+        """Starts a video recording, the stop is scheduled `duration` seconds later."""
         if self.stop_event.is_set():
             return
-        
-        output_folder = "/home/pi/seesaibling/recordings"
-        
-        timestamp = time.strftime("%Y-%m-%d--%H-%M-%S", time.localtime())
-        filename = f"hp_{timestamp}.wav"
-        filepath = os.path.join(output_folder, filename)
-        
-        # Start the audio recording in a separate thread
-        def start_recording():
-            command = ["arecord", "-D", "hw:3,0", "-f", "S32_LE", "-r", "44100", "-c", "2", "-d", str(int(duration)), filepath]
-            # Use Popen to start arecord as a subprocess
-            self.process = subprocess.Popen(command)
-            
-        recording_thread = threading.Thread(target=start_recording)
-        recording_thread.start()
-        
-        logging.info("[Audio] Recording started")
-        print("[\033[4;35mAudio\033[0m] Recording started")
-        
-        # Monitor stop_event and allow interruption during recording
-        for _ in range(duration):
-            if self.stop_event.wait(timeout=1):
-                logging.info("[Audio] Recording stopped (Emergency stop)")
-                print("[\033[4;35mAudio\033[0m] Recording stopped (Emergency stop)")
-                # Send a termination signal to the arecord process
-                self.process.terminate()  # Sends SIGTERM to the process
-                self.process.wait()  # Wait for the process to terminate cleanly
-                return
-        
-        # After the duration ends, make sure the process is terminated if not already done
-        if self.process is not None:
-            self.process.terminate()
-            try:
-                self.process.wait(timeout=2)  # Wait for the process to terminate cleanly
-            except subprocess.TimeoutExpired:
-                logging.error("[Audio] Timed out waiting for process to terminate")
-                print("[Audio] Timed out waiting for process to terminate")
-            self.process = None  # Reset the process reference after termination
-        
-        logging.info("[Audio] Recording finished")
-        print("[\033[4;35mAudio\033[0m] Recording finished")
-
-    def record_video(self, start_delay, duration):
-        """Records video with a delay and specified duration."""
-        time.sleep(start_delay)
-        filename = f"/home/pi/seesaibling/video/{time.strftime('%Y-%m-%d--%H-%M-%S')}_d{duration}.h264"
+        timestamp = time.strftime('%Y-%m-%d--%H-%M-%S', time.localtime(self.clock.time()))
+        filename = os.path.join(self.devices.storage, "video", f"{timestamp}_d{duration}.h264")
 
-        self.picam2.start_recording(self.encoder, filename, quality=Quality.VERY_HIGH)
+        self.energy.start_task("video")
+        try:
+            self.camera.start_recording(filename)
+        except Exception as e:
+            # counted as camera.start_failures; without this the cycle would silently record nothing
+            self.energy.stop_task("video")
+            logging.error(f"[Video] Recording could not be started: {e}")
+            self.show_error("camera")
+            return
         logging.info("[Video] Recording started")
-        print("[\033[4;32mVideo\033[0m] Recording started")
         
-        for _ in range(duration):
-            if self.stop_event.wait(timeout=1):
-                logging.info("[Video] Recording stopped (Emergency stop)")
-                print("[\033[4;32mVideo\033[0m] Recording stopped (Emergency stop)")
-                self.picam2.stop_recording()
-                return
-
-        self.picam2.stop_recording()
+    def stop_video(self):
+        """Stops the running video recording."""
+        self.camera.stop_recording()
+        self.energy.stop_task("video")
         logging.info("[Video] Recording finished")
-        print("[\033[4;32mVideo\033[0m] Recording finished.")
+        files, self.camera.files = self.camera.files, []
+        framerates, self.camera.framerates = self.camera.framerates, {}
+        self.submit_recordings(files, self.cycle_schedule["video_duration"], framerates=framerates)
         
-    def record_temperature(self):
-        """Retrieve the temperature from the sensor."""
+    def warm_up_camera(self):
+        """Starts the camera ahead of the recording (booked as video energy)."""
+        if self.stop_event.is_set():
+            return
+        self.energy.start_task("video")
+        self.camera.warm_up()
+
+    def record_motion(self, duration):
+        """Records motion-triggered clips during the next `duration` seconds."""
+        if self.stop_event.is_set():
+            return
+        self.energy.start_task("video")
         try:
-            temperature = self.sensor.get_temperature()
-            return temperature
-        except Exception as e:
-            logging.error(f"[Temperature] Error reading temperature: {e}")
-            print(f"[Temperature] Error reading temperature: {e}")
-            return None  # Return None if there's an error
+            self.motion_recorder.run(duration, quality=self.devices.quality)
+        finally:
+            self.energy.stop_task("video")
+        files, self.motion_recorder.files = self.motion_recorder.files, []
+        scores, self.motion_recorder.scores = self.motion_recorder.scores, {}
+        framerates = {path: self.motion_recorder.framerate for path in files}
+        self.submit_recordings(files, duration, scores, framerates)
+        
+    def submit_recordings(self, files, duration, scores=None, framerates=None):
+        """Catalogs finished recordings and queues them for post-processing with the conditions
+        of the last `duration` seconds, their activity `scores` and video `framerates` (path -> value), if known."""
+        if not files:
+            return
+        end = self.clock.time()
+        window = self.samples.window(duration, now=self.clock.monotonic())
+        temperature, _ = self.temperature_reader.latest()
+        conditions = {
+            "voltage": round(sum(sample.voltage for sample in window) / len(window), 3) if window else None,
+            "power": round(sum(sample.power for sample in window) / len(window), 3) if window else None,
+            "temperature": temperature,
+        }
+        recorded = [round(end - duration, 3), round(end, 3)]
+        self.storage_manager.register(files, *recorded, scores=scores, cycle=self.cycle)
+        for path in files:
+            self.postprocess.submit(path, cycle=self.cycle, cycle_start=self.cycle_wall_start, recorded=recorded,
+                                    schedule=self.cycle_schedule, conditions=conditions,
+                                    score=(scores or {}).get(path), framerate=(framerates or {}).get(path))
+
+    def recording_processed(self, job, record):
+        """Post-processing callback: catalog the final file and queue it with its sidecar for the offload."""
+        self.storage_manager.processed(job, record)
+        if self.offload is not None:
+            self.offload.add(os.path.join(os.path.dirname(job["path"]), record["file"]))
+
+    def features_written(self, path, score):
+        """Feature worker callback: activity score into the catalog, features into the offload."""
+        self.storage_manager.scored(path, score)
+        if self.offload is not None:
+            self.offload.add(feature_path(path))
+
+    def idle_start(self, idle_end):
+        """Opens the idle window for post-processing and offload until `idle_end` (scheduler time)."""
+        self.postprocess.resume(idle_end)
+        if self.offload is not None:
+            self.offload.resume()
+
+    def idle_stop(self):
+        """Closes the idle window before the next capture."""
+        self.postprocess.pause()
+        if self.offload is not None:
+            self.offload.pause()
+
+    def record_temperature(self):
+        """Retrieve the latest temperature collected by the background reader."""
+        temperature, age = self.temperature_reader.latest()
+        if temperature is None or age > self.temperature_max_age:
+            logging.error(f"[Temperature] No recent temperature reading (age: {age})")
+            return None  # Return None if there's no valid reading
+        return temperature
     
-    def blink_status_leds(self, leds_to_blink, times, on_duration=0.2, off_duration=0.2):
-        for _ in range(times):
-            # Turn on the selected LEDs
-            for led in leds_to_blink:
-                led.value = True  # LED ON
-            # Wait for the 'on' duration
-            time.sleep(on_duration)
-            # Turn off the selected LEDs
-            for led in leds_to_blink:
-                led.value = False  # LED OFF
-            time.sleep(off_duration)
+    def blink_status_leds(self, leds_to_blink, times, on_duration=0.2, off_duration=0.2, priority=PRIORITY_STATUS):
+        """Queues a blink pattern on the status LED controller and returns immediately."""
+        name = "blink-" + "-".join(str(self.leds.index(led)) for led in leds_to_blink) + f"x{times}"
+        self.led_controller.post(blink(name, leds_to_blink, times, on_duration, off_duration), priority)
+
+    def show_error(self, error):
+        """Queues the blink code of `error` (see ERROR_CODES) on both red status LEDs."""
+        self.led_controller.post(error_code([self.led_red1, self.led_red2], ERROR_CODES[error]), PRIORITY_ERROR)
     
+    def write_metrics(self):
+        """Appends a snapshot of all metrics to the daily metrics file."""
+        self.metrics_file.write(self.metrics.snapshot())
+
     def wifi_connection(self):
-        try:
-            # Run ifconfig to check for wlan0 interface
-            result = subprocess.run(['ifconfig', 'wlan0'], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-            if 'inet ' in result.stdout.decode():
-                return True
-            else:
-                return False
-        except Exception as e:
-            print(f"Error checking Wi-Fi connection: {e}")
-            return False
+        """Cached wifi state, see NetworkMonitor."""
+        return self.network.is_connected()
+
+    def wifi_changed(self, connected):
+        """Logs every change of the wifi connection."""
+        state = "connected" if connected else "disconnected"
+        logging.info(f"[Network] Wifi {state}")
+        if connected and self.offload is not None:
+            self.offload.wake()
+    
+    def schedule_cycle(self, cycle_start, schedule):
+        """Queues all timed actions of one cycle, returns the scheduler time the cycle ends."""
+        call_at = self.scheduler.call_at
+        light_delay, light_duration = schedule["light_delay"], schedule["light_duration"]
+        video_delay, video_duration = schedule["video_delay"], schedule["video_duration"]
+        audio_delay, audio_duration = schedule["audio_delay"], schedule["audio_duration"]
+        cycle_end = cycle_start
+        
+        if light_duration > 0:
+            call_at(cycle_start + light_delay, self.light_on, "light-on")
+            call_at(cycle_start + light_delay + light_duration, self.light_off, "light-off")
+            cycle_end = cycle_start + light_delay + light_duration
+        
+        if video_duration > 0 and self.motion_recorder is not None:
+            # the motion recorder runs for the whole video window and writes clips on activity
+            call_at(cycle_start + video_delay, self.record_motion, "video-motion", (video_duration,))
+            cycle_end = max(cycle_end, cycle_start + video_delay + video_duration)
+        elif video_duration > 0:
+            warm_up = max(cycle_start, cycle_start + video_delay - self.camera_warmup)
+            call_at(warm_up, self.warm_up_camera, "camera-warmup")
+            call_at(cycle_start + video_delay, self.start_video, "video-start", (video_duration,))
+            call_at(cycle_start + video_delay + video_duration, self.stop_video, "video-stop")
+            cycle_end = max(cycle_end, cycle_start + video_delay + video_duration)
+        
+        if audio_duration > 0:
+            call_at(cycle_start + audio_delay, self.record_audio, "audio", (audio_duration,))
+            cycle_end = max(cycle_end, cycle_start + audio_delay + audio_duration)
+            # analyse the recordings once all capture of this cycle is over
+            call_at(cycle_end, self.extract_features, "audio-features")
+        
+        return cycle_end
     
     def start(self):
         """Main loop for continuous monitoring and periodic recording."""
         logging.info("[System] Startup: Monitoring and recording initiated.")
-        print("[\033[4;31mSystem\033[0m] System startup: Monitoring and recording initiated.")
-
-        # Start continuous error monitoring
-        monitor_thread = threading.Thread(target=self.monitor_errors)
-        monitor_thread.start()
 
+        # Start reading the pico uart in the background
+        self.uart_ingest.start()
+        # Watch the wifi state so connection changes are reported
+        self.network.start(self.stop_event)
+
+        # Start the safety watchdog before anything else is scheduled
+        self.safety.start()
+        # Temperatures are acquired in the background
+        self.temperature_reader.start()
+        # Catalog the files of earlier runs and those copied or deleted by hand
+        added, updated, removed = self.storage_manager.sync()
+        if added or updated or removed:
+            logging.info(f"[Storage] Catalog: {added} files added, {updated} updated, {removed} removed")
+        # Post-processing workers, only busy while a window is open
+        self.postprocess.start()
+        for folder in ("video", "recordings"):
+            self.postprocess.recover(os.path.join(self.devices.storage, folder))
+        # Uploads, including processed recordings not queued yet (e.g. offload enabled later);
+        # telemetry only from days that are over, the files of today are still written
+        if self.offload is not None:
+            for kind in RECORDINGS:
+                for row in self.storage_manager.catalog.query(kind=kind, state="stored"):
+                    self.offload.add(os.path.join(self.devices.storage, row["path"]))
+            self.offload.add_telemetry()
+            self.offload.start()
+        # Local metrics endpoint for field tuning
+        if self.metrics_port is not None:
+            try:
+                self.metrics_server = MetricsServer(self.metrics, port=self.metrics_port).start()
+                logging.info(f"[Metrics] Serving on 127.0.0.1:{self.metrics_port}")
+            except OSError as e:
+                logging.error(f"[Metrics] Could not start the endpoint: {e}")
+
+        # Periodic sensor tasks, scheduled exactly once for the whole deployment
+        self.scheduler.start()
+        self.scheduler.every(2, self.check_sensors, "status-sensors")
+        sensor_duration = self.schedule["sensor"]
+        self.scheduler.every(sensor_duration, self.log_sensor_data, "sensor-log", (sensor_duration,))
+        self.scheduler.every(10, self.resources.sample, "metrics-resources")
+        self.scheduler.every(900, self.write_metrics, "metrics-snapshot", first=self.scheduler.now() + 900)
+
+        # Cycles start on a fixed grid of the monotonic clock, so they neither drift
+        # nor jump when the wall clock is set
+        cycle_start = self.scheduler.now()
         while not self.stop_event.is_set():
             logging.info("[System] Starting new cycle")
-            print("[\033[4;31mSystem\033[0m] > Starting new cycle (t=0)")
-
-            cycle_start_time = time.time()
-
-            # Start continuous sensor logging
-            error_sensor_thread = threading.Thread(target=self.error_sensors, args=(2,))
-            error_sensor_thread.start()
-            sensor_thread = threading.Thread(target=self.log_sensor_data, args=(sensor_duration,))
-            sensor_thread.start()
-
-            # Overlapping tasks
-            video_thread = threading.Thread(target=self.record_video, args=(video_delay, video_duration))
-            audio_thread = threading.Thread(target=self.record_audio, args=(audio_delay, audio_duration))
-            light_thread = threading.Thread(target=self.control_light, args=(light_delay, light_duration))
-
-            # Start timed tasks
-            video_thread.start()
-            audio_thread.start()
-            light_thread.start()
-
-            # Wait for all threads to finish their tasks
-            video_thread.join()
-            audio_thread.join()
-            light_thread.join()
-
-            # Ensure logging thread stops if an error occurred
-            if self.stop_event.is_set():
+            self.telemetry.new_cycle()
+            self.metrics.counter("cycles").inc()
+            self.cycle += 1
+            self.cycle_wall_start = round(self.clock.time(), 3)
+            if self.offload is not None:
+                self.offload.add_telemetry()
+
+            # Durations and interval of this cycle, shortened when the energy budget requires it
+            schedule = self.energy.plan(self.schedule, now=self.clock.time())
+            console.info(f"[Energy] {self.energy.describe(schedule)}")
+            self.energy.save()  # once per cycle, a power loss costs at most one cycle of counted energy
+            # and without recordings that would not fit on the card
+            checked = self.storage_manager.check(schedule)
+            if checked is not schedule:
+                self.show_error("storage")  # recording without video (and audio)
+            schedule = checked
+            self.metrics.gauge("schedule.scale").set(schedule.get("scale"))
+            self.metrics.gauge("schedule.interval").set(schedule["interval"])
+            self.cycle_schedule = schedule
+            cycle_end = self.schedule_cycle(cycle_start, schedule)
+
+            # Next slot on the interval grid that is not occupied by the current cycle
+            cycle_start += schedule["interval"]
+            while cycle_start < cycle_end:
+                cycle_start += schedule["interval"]
+
+            # post-processing and offload only in the idle part of the interval, never during capture
+            idle_start, idle_end = cycle_end + 1.0, cycle_start - self.idle_margin
+            if idle_end > idle_start:
+                self.scheduler.call_at(idle_start, self.idle_start, "idle-start", (idle_end,))
+                self.scheduler.call_at(idle_end, self.idle_stop, "idle-stop")
+
+            remaining_time = cycle_start - self.scheduler.now()
+            console.info(f"[System] Next cycle in {remaining_time:.2f} seconds")
+            if self.clock.wait(self.stop_event, timeout=remaining_time):
                 break
 
-            # Calculate remaining time and wait for the next cycle
-            elapsed_time = time.time() - cycle_start_time
-            interval_time = interval_duration
-            remaining_time = interval_time - elapsed_time
-            if remaining_time > 0:
-                print(f"[\033[4;31mSystem\033[0m] Waiting {remaining_time:.2f} seconds for next cycle")
-                time.sleep(remaining_time)
+            # How late the scheduled actions were started so far
+            for line in self.scheduler.report():
+                logging.info(f"[Scheduler] {line}")
 
         self.stop_event.set()
-        error_sensor_thread.join()
-        sensor_thread.join()
-        monitor_thread.join()
+        self.scheduler.shutdown()
 
         logging.info("[System] Stopped due to error or shutdown request.")
-        print("\n[\033[4;31mSystem\033[0m] Stopped due to error or shutdown request.")
+        self.log_pipeline.flush()
 
 
 # Run the system
@@ -429,43 +651,34 @@ if __name__ == "__main__":
     print("--Monitoring unit--")
     operation_mode = input("Choose between predefined [p], test [t] or custom [c] operation:")
     if operation_mode == "p":
-        interval_duration = 30*60
-        sensor_duration = 30
-        sensor_delay = 0
-        video_delay = 10
-        video_duration = 40
-        audio_delay = 3
-        audio_duration = 50
-        light_delay = 15
-        light_duration = 40
+        schedule = dict(SCHEDULES["p"], target_days=None, motion_video=False, metrics_port=METRICS_PORT)
         print("\n[\033[4;31mSystem\033[0m] [predefined] automatically choosing delay and duration lengths")
     elif operation_mode == "t":
-        interval_duration = 60
-        sensor_duration = 5
-        sensor_delay = 0
-        video_delay = 1
-        video_duration = 20
-        audio_delay = 7
-        audio_duration = 23
-        light_delay = 10
-        light_duration = 20
+        schedule = dict(SCHEDULES["t"], target_days=None, motion_video=False, metrics_port=METRICS_PORT)
         print("\n[\033[4;31mSystem\033[0m] [test] automatically choosing delay and duration lengths")
     elif operation_mode == "c":
-        interval_duration = int(input("[\033[4;34mInterval\033[0m] Enter total interval duration [s]: "))
+        schedule = {}
+        schedule["interval"] = int(input("[\033[4;34mInterval\033[0m] Enter total interval duration [s]: "))
         
-        sensor_duration = int(input("[Sensor] Enter sensor sampling interval [s]: "))
-        sensor_delay = 0
+        schedule["sensor"] = int(input("[Sensor] Enter sensor sampling interval [s]: "))
 
-        video_delay = int(input("[\033[4;32mVideo\033[0m] > Recording delay [s]: "))
-        video_duration = int(input("[\033[4;32mVideo\033[0m] > Recording duration [s]: "))
+        schedule["video_delay"] = int(input("[\033[4;32mVideo\033[0m] > Recording delay [s]: "))
+        schedule["video_duration"] = int(input("[\033[4;32mVideo\033[0m] > Recording duration [s]: "))
 
-        audio_delay = int(input("[\033[4;35mAudio\033[0m] > Recording delay [s]: "))
-        audio_duration = int(input("[\033[4;35mAudio\033[0m] > Recording duration [s]: "))
+        schedule["audio_delay"] = int(input("[\033[4;35mAudio\033[0m] > Recording delay [s]: "))
+        schedule["audio_duration"] = int(input("[\033[4;35mAudio\033[0m] > Recording duration [s]: "))
 
-        light_delay = int(input("[\033[4;33mLight\033[0m] > Delay [s]: "))
-        light_duration = int(input("[\033[4;33mLight\033[0m] > Duration [s]: "))
+        schedule["light_delay"] = int(input("[\033[4;33mLight\033[0m] > Delay [s]: "))
+        schedule["light_duration"] = int(input("[\033[4;33mLight\033[0m] > Duration [s]: "))
+        
+        schedule["motion_video"] = input("[\033[4;32mVideo\033[0m] > Motion-triggered recording [y/n]: ") == "y"
+        schedule["offload_url"] = input("[\033[4;34mOffload\033[0m] > Upload server url [empty for none]: ") or None
+        target_days = input("[\033[4;34mEnergy\033[0m] > Target deployment length [days, empty for none]: ")
+        schedule["target_days"] = float(target_days) if target_days else None
+        schedule["metrics_port"] = METRICS_PORT
     else: 
         print("Please enter [p], [t] or [c]")
+    schedule["new_deployment"] = input("[\033[4;34mEnergy\033[0m] > New deployment, reset the energy state [y/n]: ") == "y"
 
-    system = CameraSystem()
+    system = CameraSystem(schedule)
     system.start()
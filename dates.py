@@ -0,0 +1,6 @@
+import time         # local time of the timestamps
+
+
+def day_name(timestamp):
+    """Local date of a wall clock `timestamp` as used in the names of daily files, e.g. 2025-03-01."""
+    return time.strftime("%Y-%m-%d", time.localtime(timestamp))
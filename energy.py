@@ -0,0 +1,456 @@
+import os           # state file
+import csv          # telemetry traces
+import json         # persistent energy state
+import time         # wall clock of the deployment
+import bisect       # voltage curve interpolation
+import logging      # plan changes
+import argparse     # command line interface
+import threading    # task state is changed from scheduler threads
+from collections import deque
+
+import numpy as np  # per-task power fit, voltage trend
+
+TASKS = ("light", "video", "audio")
+
+# resting voltage -> state of charge of the 3S li-ion pack, down to the shutdown threshold
+VOLTAGE_CURVE = ((10.5, 0.0), (11.1, 0.1), (11.4, 0.2), (11.6, 0.3), (11.75, 0.4), (11.9, 0.5),
+                 (12.0, 0.6), (12.15, 0.7), (12.3, 0.8), (12.45, 0.9), (12.6, 1.0))
+
+# used until enough measurements of a task exist [W]
+DEFAULT_POWER = {"idle": 3.0, "light": 15.0, "video": 1.5, "audio": 0.5}
+
+SCHEDULES = {
+    "p": {"interval": 30 * 60, "sensor": 30, "video_delay": 10, "video_duration": 40,
+          "audio_delay": 3, "audio_duration": 50, "light_delay": 15, "light_duration": 40},
+    "t": {"interval": 60, "sensor": 5, "video_delay": 1, "video_duration": 20,
+          "audio_delay": 7, "audio_duration": 23, "light_delay": 10, "light_duration": 20},
+}
+
+
+def active_tasks(schedule, offset):
+    """Tasks of `schedule` that run `offset` seconds after the cycle start."""
+    return frozenset(task for task in TASKS
+                     if schedule[f"{task}_delay"] <= offset < schedule[f"{task}_delay"] + schedule[f"{task}_duration"])
+
+
+class EnergyLedger:
+    """Integrates measured power separately for every combination of active tasks.
+
+    Each power sample covers its window when the length is known (binary
+    frames), otherwise the time since the previous sample, and is booked on the
+    task set active when it arrives. Gaps longer than `max_gap` are not
+    integrated. `task_power` fits idle power plus
+    the additional power of every task to all combinations seen so far.
+    """
+
+    def __init__(self, max_gap=10.0):
+        self.max_gap = max_gap
+        self.active = frozenset()
+        self.states = {}  # frozenset of tasks -> [joules, seconds]
+        self._last = None
+        self._lock = threading.Lock()
+
+    def start_task(self, task):
+        with self._lock:
+            self.active = self.active | {task}
+
+    def stop_task(self, task):
+        with self._lock:
+            self.active = self.active - {task}
+
+    def add(self, power, monotonic, window=None):
+        """Book one power sample [W] at `monotonic` [s], the mean over `window` seconds if given."""
+        last, self._last = self._last, monotonic
+        if power is None:
+            return
+        if window is not None:
+            dt = window
+        elif last is None:
+            return
+        else:
+            dt = monotonic - last
+        if 0 < dt <= self.max_gap:
+            with self._lock:
+                entry = self.states.setdefault(self.active, [0.0, 0.0])
+                entry[0] += power * dt
+                entry[1] += dt
+
+    def _copy(self):
+        """Snapshot of `states`; the uart thread adds to it while the cycle thread reads it."""
+        with self._lock:
+            return {state: list(values) for state, values in self.states.items()}
+
+    @property
+    def joules(self):
+        return sum(joules for joules, _ in self._copy().values())
+
+    def task_power(self, defaults=DEFAULT_POWER, min_seconds=60.0):
+        """Idle power and additional power per task [W], fitted by weighted least squares."""
+        states = [(state, joules / seconds, seconds) for state, (joules, seconds) in self._copy().items()
+                  if seconds >= min_seconds]
+        power = dict(defaults)
+        seen = [task for task in TASKS if any(task in state for state, _, _ in states)]
+        if not any(not state for state, _, _ in states):
+            return power  # idle power is needed as the base of every task
+        weights = np.sqrt([seconds for _, _, seconds in states])
+        design = np.array([[1.0] + [task in state for task in seen] for state, _, _ in states]) * weights[:, None]
+        means = np.array([mean for _, mean, _ in states]) * weights
+        solution, _, rank, _ = np.linalg.lstsq(design, means, rcond=None)
+        if rank < len(solution):
+            # tasks that always ran together cannot be separated, split them by their defaults
+            return power
+        # a bad fit (few or noisy states) must not make idle power vanish or go negative
+        power["idle"] = max(defaults["idle"] * 0.5, float(solution[0]))
+        for task, value in zip(seen, solution[1:]):
+            power[task] = max(0.0, float(value))
+        return power
+
+    def state(self):
+        return {"+".join(sorted(state)) or "idle": values for state, values in self._copy().items()}
+
+    def load(self, states):
+        with self._lock:
+            self.states = {frozenset() if key == "idle" else frozenset(key.split("+")): list(values)
+                           for key, values in states.items()}
+
+
+class BatteryEstimator:
+    """Remaining battery energy from counted energy and the resting voltage.
+
+    The initial state of charge comes from the first resting voltage (no task
+    active) on VOLTAGE_CURVE; afterwards the counted energy is subtracted and
+    blended with the voltage estimate by `voltage_weight`, which corrects a
+    wrong capacity or drift slowly. The trend of the resting voltage over the
+    last `window` seconds gives a second, independent runtime estimate.
+    """
+
+    def __init__(self, capacity_wh, curve=VOLTAGE_CURVE, voltage_weight=0.2, window=24 * 3600, cutoff=10.5):
+        self.capacity_wh = capacity_wh
+        self.curve = curve
+        self.voltage_weight = voltage_weight
+        self.window = window
+        self.cutoff = cutoff
+        self.initial_soc = None
+        self._rest = deque()  # (minute, mean resting voltage of that minute)
+        self._minute = None   # [minute, voltage sum, count] being collected
+
+    def soc_from_voltage(self, voltage):
+        voltages = [point[0] for point in self.curve]
+        index = bisect.bisect_left(voltages, voltage)
+        if index == 0:
+            return self.curve[0][1]
+        if index == len(self.curve):
+            return self.curve[-1][1]
+        (v0, s0), (v1, s1) = self.curve[index - 1], self.curve[index]
+        return s0 + (s1 - s0) * (voltage - v0) / (v1 - v0)
+
+    def add_rest(self, timestamp, voltage):
+        """Voltage measured while no task was drawing power."""
+        if self.initial_soc is None:
+            self.initial_soc = self.soc_from_voltage(voltage)
+        minute = timestamp // 60 * 60
+        if self._minute is not None and self._minute[0] != minute:
+            start, total, count = self._minute
+            self._rest.append((start, total / count))
+            self._minute = None
+            while self._rest and self._rest[0][0] < timestamp - self.window:
+                self._rest.popleft()
+        if self._minute is None:
+            self._minute = [minute, 0.0, 0]
+        self._minute[1] += voltage
+        self._minute[2] += 1
+
+    def trend(self):
+        """(fitted resting voltage now, slope in V/s) or None while too few points exist."""
+        if len(self._rest) < 10 or self._rest[-1][0] - self._rest[0][0] < 3600:
+            return None
+        times = np.array([point[0] for point in self._rest])
+        voltages = np.array([point[1] for point in self._rest])
+        slope, intercept = np.polyfit(times - times[-1], voltages, 1)
+        return float(intercept), float(slope)
+
+    def estimate(self, used_wh):
+        """Dict with state of charge, remaining energy [Wh] and the voltage trend runtime [s]."""
+        if self.initial_soc is None:
+            return None
+        soc = self.initial_soc - used_wh / self.capacity_wh
+        trend = self.trend()
+        runtime_trend = None
+        if trend is not None:
+            voltage, slope = trend
+            soc = (1 - self.voltage_weight) * soc + self.voltage_weight * self.soc_from_voltage(voltage)
+            if slope < 0:
+                runtime_trend = max(0.0, (voltage - self.cutoff) / -slope)
+        soc = min(1.0, max(0.0, soc))
+        return {"soc": soc, "remaining_wh": soc * self.capacity_wh, "runtime_trend": runtime_trend}
+
+
+class DutyPolicy:
+    """Shortens the recordings and light, then stretches the interval, to last until `target_end`.
+
+    The budget is the remaining energy (less `reserve`) spread over the time
+    left. Durations are scaled down to at most `min_fraction` of the configured
+    schedule before the interval is stretched, up to `max_interval_factor`
+    times. The configured schedule is never exceeded.
+    """
+
+    def __init__(self, target_end, reserve=0.05, min_fraction=0.25, max_interval_factor=4.0):
+        self.target_end = target_end
+        self.reserve = reserve
+        self.min_fraction = min_fraction
+        self.max_interval_factor = max_interval_factor
+
+    @staticmethod
+    def cycle_power(schedule, power):
+        """Mean power [W] over one cycle of `schedule`."""
+        extra = sum(power[task] * schedule[f"{task}_duration"] for task in TASKS)
+        return power["idle"] + extra / schedule["interval"]
+
+    def plan(self, base, power, remaining_wh, now):
+        """Copy of `base` adapted to the energy budget, with the budget and prediction in watts."""
+        plan = dict(base)
+        time_left = self.target_end - now
+        if time_left <= 0:
+            plan.update(scale=1.0, budget=None, predicted=self.cycle_power(base, power), time_left=0.0)
+            return plan
+        budget = remaining_wh * 3600 * (1 - self.reserve) / time_left
+        extra = sum(power[task] * base[f"{task}_duration"] for task in TASKS)  # J per cycle above idle
+        available = budget - power["idle"]
+        scale, interval = 1.0, base["interval"]
+        if extra > 0 and available * interval < extra:
+            scale = max(self.min_fraction, available * interval / extra)
+            if scale == self.min_fraction:
+                longest = base["interval"] * self.max_interval_factor
+                interval = longest if available <= 0 else min(longest, max(interval, scale * extra / available))
+        for task in TASKS:
+            plan[f"{task}_duration"] = int(base[f"{task}_duration"] * scale)
+        plan["interval"] = int(interval)
+        plan.update(scale=scale, budget=budget, predicted=self.cycle_power(plan, power), time_left=time_left)
+        return plan
+
+
+class EnergyManager:
+    """Energy accounting and the adaptive schedule of a deployment.
+
+    `on_sample` is a UartIngest listener; CameraSystem reports task starts and
+    stops. Without `target_days` the configured schedule is kept and only the
+    estimates are reported. The deployment start, counted energy and per-task statistics are
+    kept in `state_path`, so a reboot does not reset them. A new deployment
+    (`reset`, or a resting voltage at least `reset_soc` above the counted state
+    of charge, i.e. a charged or swapped battery) starts the state over; while
+    running this also needs a step of `reset_jump` volts between resting minutes.
+    """
+
+    def __init__(self, capacity_wh, target_days, state_path=None, reserve=0.05, min_fraction=0.25,
+                 max_interval_factor=4.0, started=None, max_gap=10.0, reset=False, reset_soc=0.3, reset_jump=0.3):
+        self.ledger = EnergyLedger(max_gap)
+        self.battery = BatteryEstimator(capacity_wh)
+        self.state_path = state_path
+        self.started = time.time() if started is None else started
+        self.target_days = target_days
+        self.reset_soc = reset_soc
+        self.reset_jump = reset_jump
+        self._checked = False  # resting voltage compared with the loaded state
+        if not reset:
+            self._load()
+        self.policy = None
+        if target_days is not None:
+            self.policy = DutyPolicy(self.started + target_days * 86400, reserve, min_fraction, max_interval_factor)
+        self.last_plan = None
+
+    def reset(self, started, reason):
+        """Forget the deployment start, initial state of charge and counted energy."""
+        logging.warning(f"[Energy] State reset: {reason}")
+        self.started = started
+        self.battery.initial_soc = None
+        self.battery._rest.clear()
+        self.battery._minute = None
+        self.ledger.load({})
+        if self.policy is not None:
+            self.policy.target_end = started + self.target_days * 86400
+        self.last_plan = None
+
+    def _load(self):
+        if self.state_path is None or not os.path.exists(self.state_path):
+            return
+        try:
+            with open(self.state_path) as file:
+                state = json.load(file)
+            self.started = state["started"]
+            self.battery.initial_soc = state["initial_soc"]
+            self.ledger.load(state["states"])
+        except (OSError, ValueError, KeyError) as e:
+            logging.error(f"[Energy] Could not load {self.state_path}: {e}")
+
+    def save(self):
+        if self.state_path is None:
+            return
+        state = {"started": self.started, "initial_soc": self.battery.initial_soc, "states": self.ledger.state()}
+        temporary = self.state_path + ".tmp"
+        with open(temporary, "w") as file:
+            json.dump(state, file)
+        os.replace(temporary, self.state_path)
+
+    def start_task(self, task):
+        self.ledger.start_task(task)
+
+    def stop_task(self, task):
+        self.ledger.stop_task(task)
+
+    def add(self, timestamp, monotonic, voltage, power, window=None):
+        """Book one measurement; voltages without an active task feed the battery estimate."""
+        self.ledger.add(power, monotonic, window)
+        if not self.ledger.active:
+            if self._jumped(voltage):
+                self.reset(timestamp, f"resting voltage {voltage:.2f} V above the counted state of charge")
+            self.battery.add_rest(timestamp, voltage)
+
+    def _jumped(self, voltage):
+        """True if `voltage` shows a fuller battery than counted: on the first resting voltage after
+        loading the state, and later on a step above the last resting minute (charged in place)."""
+        if self.battery.initial_soc is None:
+            return False
+        if self._checked:
+            if not self.battery._rest or voltage - self.battery._rest[-1][1] < self.reset_jump:
+                return False
+        self._checked = True
+        soc = self.battery.initial_soc - self.used_wh / self.battery.capacity_wh
+        return self.battery.soc_from_voltage(voltage) - soc > self.reset_soc
+
+    def on_sample(self, sample):
+        """UART listener."""
+        power = sample.power if sample.power is not None else sample.voltage * sample.current
+        self.add(sample.time, sample.monotonic, sample.voltage, power, sample.window)
+
+    @property
+    def used_wh(self):
+        return self.ledger.joules / 3600
+
+    def plan(self, schedule, now=None):
+        """Schedule for the next cycle; the configured one until the battery state is known."""
+        now = time.time() if now is None else now
+        estimate = self.battery.estimate(self.used_wh)
+        if estimate is None:
+            return dict(schedule)
+        power = self.ledger.task_power()
+        if self.policy is None:
+            plan = dict(schedule, scale=1.0, budget=None, predicted=DutyPolicy.cycle_power(schedule, power),
+                        time_left=None)
+        else:
+            plan = self.policy.plan(schedule, power, estimate["remaining_wh"], now)
+        plan["soc"] = estimate["soc"]
+        plan["runtime"] = estimate["remaining_wh"] * 3600 / plan["predicted"] if plan["predicted"] > 0 else None
+        plan["runtime_trend"] = estimate["runtime_trend"]
+        previous, self.last_plan = self.last_plan, plan
+        if previous is None or (previous["interval"], previous["scale"]) != (plan["interval"], plan["scale"]):
+            logging.info(f"[Energy] {self.describe(plan)}")
+        return plan
+
+    def describe(self, plan):
+        if "soc" not in plan:
+            return "Battery state unknown, configured schedule"
+        trend = plan["runtime_trend"]
+        trend = "-" if trend is None else f"{trend / 86400:.1f} d"
+        runtime = "-" if plan["runtime"] is None else f"{plan['runtime'] / 86400:.1f} d"
+        budget = "-" if plan["budget"] is None else f"{plan['budget']:.2f}"
+        target = "no target" if plan["time_left"] is None else f"target in {plan['time_left'] / 86400:.1f} d"
+        return (f"SoC {plan['soc'] * 100:.0f}%, runtime {runtime} (voltage trend {trend}), "
+                f"{target}: interval {plan['interval']} s, durations x{plan['scale']:.2f}, "
+                f"{plan['predicted']:.2f} W of {budget} W")
+
+
+def read_trace(path):
+    """(time, voltage, power) rows of a telemetry csv (see telemetry.py / tsdb.py)."""
+    rows = []
+    with open(path, newline="") as file:
+        for line in csv.reader(file):
+            try:
+                timestamp, voltage, current = float(line[0]), float(line[1]), float(line[2])
+            except (ValueError, IndexError):
+                continue
+            power = float(line[3]) if len(line) > 3 and line[3] not in ("", "None") else voltage * current
+            rows.append((timestamp, voltage, power))
+    return rows
+
+
+def replay(path, schedule, capacity_wh, target_days, cycle_start=None):
+    """Feed a recorded trace to the manager; task states follow `schedule` from `cycle_start`."""
+    rows = read_trace(path)
+    # rows of the sensor log are much further apart than uart samples
+    spacing = float(np.median(np.diff([row[0] for row in rows])))
+    manager = EnergyManager(capacity_wh, target_days, started=rows[0][0], max_gap=3 * spacing)
+    cycle_start = rows[0][0] if cycle_start is None else cycle_start
+    cutoff = next((row[0] for row in rows if row[1] <= manager.battery.cutoff), None)
+    next_plan = rows[0][0]
+    errors = []
+    for timestamp, voltage, power in rows:
+        active = active_tasks(schedule, (timestamp - cycle_start) % schedule["interval"])
+        manager.ledger.active = active
+        manager.add(timestamp, timestamp, voltage, power)
+        if timestamp >= next_plan:
+            next_plan += 6 * 3600
+            plan = manager.plan(schedule, timestamp)
+            print(f"day {(timestamp - rows[0][0]) / 86400:5.1f}  {voltage:5.2f} V  {manager.describe(plan)}")
+            if cutoff is not None and plan.get("runtime") is not None:
+                errors.append(plan["runtime"] - (cutoff - timestamp))
+    print("fitted power:", {task: round(value, 2) for task, value in manager.ledger.task_power().items()})
+    if errors:
+        print(f"runtime estimate error vs. measured cutoff: mean {np.mean(errors) / 86400:+.2f} d, "
+              f"max {np.max(np.abs(errors)) / 86400:.2f} d")
+
+
+def simulate(schedule, capacity_wh, target_days, power=DEFAULT_POWER, adaptive=True, step=5.0, noise=0.02):
+    """Battery model driven by `power`: days until the cutoff with the fixed or the adaptive schedule."""
+    rng = np.random.default_rng(1)
+    manager = EnergyManager(capacity_wh, target_days, started=0.0)
+    curve_v = [point[0] for point in VOLTAGE_CURVE]
+    curve_s = [point[1] for point in VOLTAGE_CURVE]
+    energy = capacity_wh * 3600
+    now, cycle_start = 0.0, 0.0
+    plan = manager.plan(schedule, now) if adaptive else schedule
+    light_seconds = 0.0
+    while energy > 0 and now < 2 * target_days * 86400:
+        offset = now - cycle_start
+        if offset >= plan["interval"]:
+            cycle_start = now
+            offset = 0.0
+            plan = manager.plan(schedule, now) if adaptive else schedule
+        active = active_tasks(plan, offset)
+        draw = (power["idle"] + sum(power[task] for task in active)) * (1 + rng.normal(0, noise))
+        energy -= draw * step
+        light_seconds += step if "light" in active else 0
+        # resting voltage from the curve, sagging under load
+        voltage = float(np.interp(energy / (capacity_wh * 3600), curve_s, curve_v)) - 0.01 * draw
+        manager.ledger.active = active
+        manager.add(now, now, voltage, draw)
+        now += step
+    return now / 86400, light_seconds / 3600
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Energy estimator and duty cycle policy")
+    commands = parser.add_subparsers(dest="command", required=True)
+    command = commands.add_parser("replay", help="run estimator and policy on a telemetry csv")
+    command.add_argument("trace")
+    command.add_argument("--cycle-start", type=float, help="epoch time of a cycle start (default: first row)")
+    command = commands.add_parser("simulate", help="fixed vs. adaptive schedule on a battery model")
+    command = commands.add_parser("reset", help="start the persisted state over, e.g. for a new deployment")
+    command.add_argument("state", help="state file, data/energy.json of the storage")
+    for command in commands.choices.values():
+        command.add_argument("--schedule", choices=sorted(SCHEDULES), default="p")
+        command.add_argument("--capacity", type=float, default=1000.0, help="battery capacity [Wh]")
+        command.add_argument("--target-days", type=float, default=13.0)
+    args = parser.parse_args()
+
+    schedule = SCHEDULES[args.schedule]
+    if args.command == "reset":
+        manager = EnergyManager(args.capacity, args.target_days, state_path=args.state, reset=True)
+        manager.save()
+        print(f"{args.state}: deployment starts {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(manager.started))}")
+    elif args.command == "replay":
+        replay(args.trace, schedule, args.capacity, args.target_days, args.cycle_start)
+    else:
+        for adaptive in (False, True):
+            days, light = simulate(schedule, args.capacity, args.target_days, adaptive=adaptive)
+            print(f"{'adaptive' if adaptive else 'fixed':8s}: {days:5.1f} days (target {args.target_days:g}), "
+                  f"{light:.1f} h of light")
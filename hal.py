@@ -0,0 +1,592 @@
+import os           # storage folders, fake sysfs
+import time         # clocks, paced uart replay
+import threading    # fake uart blocking reads
+import logging      # fake shutdown, encoder reports
+import struct       # pico frames of the uart replay
+import tempfile     # storage of the fake devices
+import collections  # pre-roll buffer of the circular output stand-in
+from subprocess import call   # shutdown script
+
+from uart_ingest import FRAME_SYNC, FRAME_VERSION, FRAME_BODY, VOLTAGE_LSB, CURRENT_LSB, POWER_LSB, crc16
+from temperature import W1Bus, FakeW1Bus
+from network_state import NetworkMonitor
+
+try:
+    from picamera2.outputs import Output  # picamera2 encoders only accept subclasses ("Must pass Output")
+except ImportError:
+    class Output:
+        """Stand-in for picamera2.outputs.Output off the pi, with the same interface."""
+
+        def __init__(self, pts=None):
+            self.recording = False
+            self.ptsoutput = pts
+
+        def start(self):
+            self.recording = True
+
+        def stop(self):
+            self.recording = False
+
+        def outputframe(self, frame, keyframe=True, timestamp=None, packet=None, audio=False):
+            pass
+
+try:
+    from picamera2.outputs import CircularOutput  # pre-roll of the motion recordings
+except ImportError:
+    class CircularOutput(Output):
+        """Stand-in for picamera2.outputs.CircularOutput off the pi.
+
+        Keeps the last `buffersize` frames in memory. While started with a
+        `fileoutput`, the buffered frames from the oldest keyframe on are
+        written first, then every following frame until `stop`.
+        """
+
+        def __init__(self, file=None, pts=None, buffersize=150):
+            super().__init__(pts=pts)
+            self._circular = collections.deque(maxlen=buffersize)
+            self._file = None
+            self._flushed = False
+            self.fileoutput = file
+
+        @property
+        def fileoutput(self):
+            return self._file
+
+        @fileoutput.setter
+        def fileoutput(self, file):
+            self._file = open(file, "wb") if isinstance(file, str) else file
+            self._flushed = False
+
+        def outputframe(self, frame, keyframe=True, timestamp=None, packet=None, audio=False):
+            self._circular.append((frame, keyframe))
+            if not self.recording or self._file is None:
+                return
+            if not self._flushed:
+                frames = list(self._circular)
+                while frames and not frames[0][1]:  # a clip starts with a keyframe
+                    frames.pop(0)
+                for buffered, _ in frames:
+                    self._file.write(buffered)
+                self._flushed = bool(frames)
+            else:
+                self._file.write(frame)
+
+        def stop(self):
+            super().stop()
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+class FrameMonitor(Output):
+    """Output wrapper that counts the frames the encoder delivers and detects dropped ones.
+
+    Wraps a picamera2 output (FileOutput, CircularOutput, ...) and is passed to
+    `start_recording` in its place; it is an Output itself, since picamera2
+    encoders refuse anything else. Gaps between frame timestamps longer than
+    one frame period count as dropped frames. Every recording reports the
+    frames, drops and the time from the encoder start to the first frame.
+    """
+
+    def __init__(self, output, metrics, framerate, name="encoder"):
+        super().__init__()
+        self.output = output
+        self.metrics = metrics
+        self.framerate = framerate
+        self.name = name
+        self.frames = 0
+        self.dropped = 0
+        self._started = None
+        self._first = None
+        self._last = None
+
+    def __getattr__(self, name):
+        return getattr(self.output, name)
+
+    def start(self):
+        self.frames, self.dropped, self._first, self._last = 0, 0, None, None
+        self._started = time.perf_counter()
+        super().start()
+        self.output.start()
+
+    def outputframe(self, frame, keyframe=True, timestamp=None, *args, **kwargs):
+        if kwargs.get("audio"):
+            return self.output.outputframe(frame, keyframe, timestamp, *args, **kwargs)
+        now = time.perf_counter()
+        # sensor timestamps are in microseconds
+        stamp = timestamp / 1e6 if timestamp is not None else now
+        if self._first is None:
+            self._first = now
+            self.metrics.observe(f"{self.name}.first_frame", now - self._started)
+        elif self._last is not None:
+            interval = stamp - self._last
+            self.metrics.observe(f"{self.name}.frame_interval", interval)
+            missing = round(interval * self.framerate) - 1
+            if missing > 0:
+                self.dropped += missing
+        self._last = stamp
+        self.frames += 1
+        return self.output.outputframe(frame, keyframe, timestamp, *args, **kwargs)
+
+    def stop(self):
+        super().stop()
+        self.output.stop()
+        self.metrics.counter(f"{self.name}.frames").inc(self.frames)
+        self.metrics.counter(f"{self.name}.dropped").inc(self.dropped)
+        self.metrics.counter(f"{self.name}.recordings").inc()
+        if not self.frames:
+            logging.warning("[Video] Encoder delivered no frames")
+            return
+        first = (self._first - self._started) * 1000
+        expected = self.frames + self.dropped
+        logging.info(f"[Video] Encoder: {self.frames} frames, {self.dropped} dropped "
+                     f"({self.dropped / expected:.1%}), first frame after {first:.0f} ms")
+
+
+class SystemClock:
+    """Wall clock and monotonic clock of the system; waits take real seconds."""
+
+    scale = 1.0
+
+    def time(self):
+        return time.time()
+
+    def monotonic(self):
+        return time.monotonic()
+
+    def wait(self, event, timeout=None):
+        return event.wait(timeout)
+
+
+class ScaledClock:
+    """Simulated clock running `scale` times faster than real time, starting at wall time `start`.
+
+    `monotonic` starts at 0 and `time` at `start`, both advance `scale`
+    seconds per real second; `wait` converts simulated to real timeouts.
+    """
+
+    def __init__(self, scale=1000.0, start=None):
+        self.scale = scale
+        self.start = time.time() if start is None else start
+        self._origin = time.monotonic()
+
+    def monotonic(self):
+        return (time.monotonic() - self._origin) * self.scale
+
+    def time(self):
+        return self.start + self.monotonic()
+
+    def wait(self, event, timeout=None):
+        return event.wait(None if timeout is None else timeout / self.scale)
+
+
+class PiDevices:
+    """The hardware of the monitoring unit; libraries are only imported on the pi."""
+
+    def __init__(self, storage="/home/pi/seesaibling"):
+        from picamera2.encoders import Quality
+
+        self.storage = storage
+        self.quality = Quality.VERY_HIGH
+        self.thermal = "/sys/class/thermal/thermal_zone0/temp"  # cpu temperature [m°C]
+
+    def camera(self):
+        from picamera2 import Picamera2
+        return Picamera2()
+
+    def file_output(self, filename):
+        from picamera2.outputs import FileOutput
+        return FileOutput(filename)
+
+    def encoder(self, bitrate):
+        from picamera2.encoders import H264Encoder
+        return H264Encoder(bitrate=bitrate)
+
+    def uart(self):
+        import serial
+        return serial.Serial('/dev/serial0', baudrate=115200, timeout=0.5)
+
+    def w1_bus(self):
+        return W1Bus()
+
+    def audio_input(self):
+        from audio_capture import AlsaInput
+        return AlsaInput(device="hw:3,0", rate=44100, channels=2, sample_format="S32_LE")
+
+    def network(self):
+        return NetworkMonitor("wlan0", ttl=10.0)
+
+    def pwm(self, pin, frequency):
+        import board, pwmio
+        return pwmio.PWMOut(getattr(board, pin), frequency=frequency, duty_cycle=0)
+
+    def digital_in(self, pin):
+        """Input with pull-down, so it reads LOW when nothing is connected."""
+        import board, digitalio
+        gpio = digitalio.DigitalInOut(getattr(board, pin))
+        gpio.direction = digitalio.Direction.INPUT
+        gpio.pull = digitalio.Pull.DOWN
+        return gpio
+
+    def digital_out(self, pin):
+        import board, digitalio
+        gpio = digitalio.DigitalInOut(getattr(board, pin))
+        gpio.direction = digitalio.Direction.OUTPUT
+        return gpio
+
+    def shutdown(self):
+        """Power the pi off (delayed by the script)."""
+        return call("./shutDown.sh")
+
+    def close(self):
+        pass
+
+
+class FakePin:
+    """GPIO stand-in; set `value` to simulate an input."""
+
+    def __init__(self, pin):
+        self.pin = pin
+        self.value = False
+
+
+class FakePwm:
+    def __init__(self, pin, frequency):
+        self.pin = pin
+        self.frequency = frequency
+        self.duty_cycle = 0
+        self.closed = False
+
+    def deinit(self):
+        self.closed = True
+
+
+class FakeEncoder:
+    def reset(self):
+        pass
+
+
+class FakeOutput(Output):
+    """FileOutput stand-in."""
+
+    def __init__(self, filename):
+        super().__init__()
+        self.filename = filename
+        self._file = None
+
+    def start(self):
+        super().start()
+        self._file = open(self.filename, "wb")
+
+    def outputframe(self, frame, keyframe=True, timestamp=None, *args, **kwargs):
+        self._file.write(frame)
+
+    def stop(self):
+        super().stop()
+        self._file.close()
+
+
+class FakeCamera:
+    """Picamera2 stand-in: writes one frame per recording and simulates exposure.
+
+    While started, `capture_metadata` returns one frame per frame period of
+    `clock`. Exposure and colour gains move a third of the (logarithmic) way
+    to their target every frame the sensor runs; the target depends on
+    `light()`, the duty cycle of the main light (0..1). The lores stream
+    shows a bright square moving for 20 s of every 2 minutes, every captured
+    buffer is also passed to the running encoder output.
+    """
+
+    DARK = {"ExposureTime": 33000, "AnalogueGain": 8.0, "ColourGains": (1.5, 1.5)}
+    LIT = {"ExposureTime": 4000, "AnalogueGain": 1.0, "ColourGains": (2.1, 1.7)}
+
+    def __init__(self, clock=None, light=None):
+        self.clock = clock or SystemClock()
+        self.light = light or (lambda: 0.0)
+        self.recording = None
+        self.recordings = 0
+        self.started = False
+        self.framerate = 30
+        self.metadata = dict(self.DARK, AeLocked=False)
+        self._frame = None  # index of the last frame the exposure was updated for
+        self._target = self.DARK
+        self._encoded = None  # index of the last frame passed to the encoder output
+
+    def create_video_configuration(self, **config):
+        return config
+
+    def configure(self, config):
+        self.config = config
+        self.framerate = (config.get("controls") or {}).get("FrameRate", self.framerate)
+
+    def start(self):
+        self.started = True
+        self._frame = int(self.clock.monotonic() * self.framerate)
+        self._target = self._light_target()
+
+    def stop(self):
+        self.started = False
+
+    def set_controls(self, controls):
+        if self.started:
+            # controls apply to the following frames
+            frame = int(self.clock.monotonic() * self.framerate)
+            self._adapt(self._target, frame - self._frame)
+        self.framerate = controls.get("FrameRate", self.framerate)
+        self._frame = int(self.clock.monotonic() * self.framerate)
+        for name in ("ExposureTime", "AnalogueGain", "ColourGains"):
+            if name in controls:
+                self.metadata[name] = controls[name]
+
+    def _light_target(self):
+        return self.LIT if self.light() > 0.075 else self.DARK
+
+    def _adapt(self, target, frames):
+        """Move exposure and colour gains towards `target` for `frames` frames."""
+        if frames <= 0:
+            return
+        step = 1 - (2 / 3) ** frames
+        metadata = self.metadata
+        exposure = metadata["ExposureTime"] * metadata["AnalogueGain"]
+        exposure *= (target["ExposureTime"] * target["AnalogueGain"] / exposure) ** step
+        # the shortest exposure first, then gain
+        metadata["ExposureTime"] = min(exposure, 33000)
+        metadata["AnalogueGain"] = max(1.0, exposure / 33000)
+        metadata["ColourGains"] = tuple(gain * (goal / gain) ** step
+                                        for gain, goal in zip(metadata["ColourGains"], target["ColourGains"]))
+
+    def _next_frame(self):
+        """Waits for the next frame period of the clock and returns its index."""
+        if not self.started:
+            raise RuntimeError("Camera is not running")
+        period = 1.0 / self.framerate
+        now = self.clock.monotonic()
+        time.sleep(((int(now / period) + 1) * period - now) / self.clock.scale)
+        return int(now / period) + 1
+
+    def stream_configuration(self, name):
+        width, height = self.config[name]["size"]
+        return {"size": (width, height), "stride": width, "format": self.config[name].get("format")}
+
+    def capture_buffer(self, name):
+        import numpy as np  # only needed by the motion recordings
+        frame = self._next_frame()
+        width, height = self.config[name]["size"]
+        buffer = np.full(width * height * 3 // 2, 16, dtype=np.uint8)
+        if self.clock.monotonic() % 120 < 20:
+            x = frame * 4 % (width - 60)
+            luma = buffer[:width * height].reshape(height, width)
+            luma[height // 2 - 30:height // 2 + 30, x:x + 60] = 200
+        if self.recording is not None:
+            # the encoder got every frame since the last capture
+            for index in range(self._encoded + 1, frame + 1):
+                self.recording.outputframe(b"\x00\x00\x00\x01", True, int(index / self.framerate * 1e6))
+            self._encoded = frame
+        return buffer
+
+    def capture_metadata(self):
+        frame = self._next_frame()
+        # frames since the last call saw the previous light, only the newest one sees a change
+        self._adapt(self._target, frame - 1 - self._frame)
+        self._target = self._light_target()
+        self._adapt(self._target, 1)
+        self._frame = frame
+        metadata = self.metadata
+        goal = self._target["ExposureTime"] * self._target["AnalogueGain"]
+        exposure = metadata["ExposureTime"] * metadata["AnalogueGain"]
+        metadata["AeLocked"] = abs(exposure / goal - 1) < 0.05
+        return dict(metadata)
+
+    def start_encoder(self, encoder, output, quality=None):
+        if isinstance(output, str):
+            output = FakeOutput(output)
+        if not isinstance(output, Output):
+            raise RuntimeError("Must pass Output")  # like the encoder output setter of picamera2
+        self.recording = output
+        self.recordings += 1
+        self._encoded = int(self.clock.monotonic() * self.framerate)
+        output.start()
+        output.outputframe(b"\x00\x00\x00\x01", True, int(time.monotonic() * 1e6))
+
+    def stop_encoder(self):
+        if self.recording is None:
+            raise RuntimeError("Encoder is not running")
+        self.recording.stop()
+        self.recording = None
+
+    def start_recording(self, encoder, output, quality=None):
+        self.start_encoder(encoder, output, quality)
+        self.start()
+
+    def stop_recording(self):
+        if self.recording is None:
+            raise RuntimeError("Camera is not recording")
+        self.stop()
+        self.stop_encoder()
+
+    def close(self):
+        pass
+
+
+class SilentInput:
+    """Capture device stand-in that delivers silence as fast as it is read."""
+
+    wait_when_full = True
+
+    def __init__(self, rate=8000, channels=1, period_frames=4096):
+        self.rate = rate
+        self.channels = channels
+        self.sample_format = "S16_LE"
+        self.period_frames = period_frames
+        self._block = bytes(period_frames * channels * 2)
+
+    def read(self):
+        return self._block, False
+
+    def close(self):
+        pass
+
+
+class ReplaySerial:
+    """Pico stand-in: plays (voltage, current, power) rows as binary frames, one per `period` of `clock`.
+
+    Rows are repeated from the start when the trace ends. `voltage` overrides
+    the voltage of all following frames (e.g. to inject a low battery).
+    """
+
+    def __init__(self, rows, clock, period=1.0, timeout=0.5):
+        self.rows = rows
+        self.clock = clock
+        self.period = period
+        self.timeout = timeout
+        self.voltage = None
+        self.frames = 0
+        self._start = clock.monotonic()
+        self._closed = threading.Event()
+
+    def _due(self):
+        return int((self.clock.monotonic() - self._start) / self.period) + 1 - self.frames
+
+    def _frame(self):
+        voltage, current, power = self.rows[self.frames % len(self.rows)]
+        if self.voltage is not None:
+            voltage = self.voltage
+        v, i, p = round(voltage / VOLTAGE_LSB), round(current / CURRENT_LSB), round(power / POWER_LSB)
+        body = FRAME_BODY.pack(FRAME_VERSION, self.frames & 0xFFFF, 200, 1000, v, v, v, i, i, i, p, p, p)
+        self.frames += 1
+        return FRAME_SYNC + body + struct.pack("<H", crc16(body))
+
+    @property
+    def in_waiting(self):
+        return max(0, self._due()) * (len(FRAME_SYNC) + FRAME_BODY.size + 2)
+
+    def read(self, size=1):
+        """Frames that are due; waits up to `timeout` (real seconds) for the next one."""
+        if self._due() <= 0:
+            wait = (self._start + self.frames * self.period - self.clock.monotonic()) / self.clock.scale
+            if self._closed.wait(min(self.timeout, max(0.0, wait))) or self._due() <= 0:
+                return b""
+        return b"".join(self._frame() for _ in range(self._due()))
+
+    def close(self):
+        self._closed.set()
+
+
+def read_rows(path):
+    """(voltage, current, power) rows of a telemetry csv, see telemetry.py."""
+    import csv
+
+    rows = []
+    with open(path, newline="") as file:
+        for line in csv.reader(file):
+            try:
+                voltage, current = float(line[1]), float(line[2])
+            except (ValueError, IndexError):
+                continue
+            power = float(line[3]) if len(line) > 3 and line[3] not in ("", "None") else voltage * current
+            rows.append((voltage, current, power))
+    return rows
+
+
+class FakeDevices:
+    """Simulated hardware: fake camera, encoder, GPIO and PWM, a replayed pico trace and a fake 1-Wire bus.
+
+    Everything is written below `storage` (a temporary directory by default).
+    `pins` holds every GPIO by name, so a test can set the leak input, and
+    `shutdowns` the clock times the shutdown command was given.
+    """
+
+    def __init__(self, clock, rows=None, storage=None, temperatures=None, quality=None):
+        self._tempdir = tempfile.TemporaryDirectory() if storage is None else None
+        self.storage = storage or self._tempdir.name
+        for folder in ("video", "recordings", "data", "error", "sys"):
+            os.makedirs(os.path.join(self.storage, folder), exist_ok=True)
+        self.clock = clock
+        self.quality = quality
+        self.rows = rows or [(12.4, 0.3, 3.7)]
+        self.serial = None
+        self.pins = {}
+        self.pwms = []
+        self.shutdowns = []
+        self._w1 = FakeW1Bus(os.path.join(self.storage, "sys", "w1"), temperatures or {"28-000000000001": 6.5},
+                             clock=clock)
+
+        # wifi interface that is up with a route
+        os.makedirs(os.path.join(self.storage, "sys", "net", "wlan0"), exist_ok=True)
+        with open(os.path.join(self.storage, "sys", "net", "wlan0", "operstate"), "w") as file:
+            file.write("up\n")
+        with open(os.path.join(self.storage, "sys", "route"), "w") as file:
+            file.write("Iface\tDestination\tGateway\nwlan0\t00000000\t0100A8C0\n")
+        self.thermal = os.path.join(self.storage, "sys", "thermal_zone0_temp")
+        with open(self.thermal, "w") as file:
+            file.write("45000\n")
+
+    def camera(self):
+        return FakeCamera(self.clock, self.light_level)
+
+    def light_level(self):
+        """Duty cycle of the brightest pwm output that is in use (0..1)."""
+        return max((pwm.duty_cycle / 65535 for pwm in self.pwms if not pwm.closed), default=0.0)
+
+    def file_output(self, filename):
+        return FakeOutput(filename)
+
+    def encoder(self, bitrate):
+        return FakeEncoder()
+
+    def uart(self):
+        self.serial = ReplaySerial(self.rows, self.clock)
+        return self.serial
+
+    def w1_bus(self):
+        return self._w1.bus
+
+    def audio_input(self):
+        return SilentInput()
+
+    def network(self):
+        return NetworkMonitor("wlan0", ttl=10.0, sysfs=os.path.join(self.storage, "sys", "net"),
+                              route_table=os.path.join(self.storage, "sys", "route"))
+
+    def pwm(self, pin, frequency):
+        pwm = FakePwm(pin, frequency)
+        self.pwms.append(pwm)
+        return pwm
+
+    def digital_in(self, pin):
+        return self.pins.setdefault(pin, FakePin(pin))
+
+    def digital_out(self, pin):
+        return self.pins.setdefault(pin, FakePin(pin))
+
+    def shutdown(self):
+        self.shutdowns.append(self.clock.monotonic())
+        logging.info("[System] Shutdown command (simulated)")
+        return 0
+
+    def close(self):
+        if self.serial is not None:
+            self.serial.close()
+        self._w1.close()
+        if self._tempdir is not None:
+            self._tempdir.cleanup()
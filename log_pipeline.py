@@ -0,0 +1,416 @@
+import os           # log rotation
+import sys          # console output
+import json         # structured records
+import time         # batching and rate limit timing
+import queue        # producers hand records to the writer
+import atexit       # last flush on interpreter exit
+import logging      # standard logging front end
+import argparse     # command line interface
+import threading    # writer thread
+from logging.handlers import QueueHandler
+
+CONSOLE = "console"  # records of this logger are only printed, never written to the log file
+
+# ANSI colour of the tag on the console, as used by the status prints of cst_main.py
+COLORS = {"System": "4;31", "Safety": "4;31", "Light": "4;33", "Video": "4;32", "Audio": "4;35",
+          "Network": "4;34", "Energy": "4;34", "Interval": "4;34"}
+
+_FLUSH = object()  # queue marker: write everything buffered now
+_STOP = object()
+
+
+def split_tag(message):
+    """("Tag", "rest") of a "[Tag] rest" message, (None, message) without tag."""
+    if message.startswith("["):
+        end = message.find("] ", 1, 40)
+        if end > 0:
+            return message[1:end].strip(), message[end + 2:]
+    return None, message
+
+
+def repeated_text(count):
+    return f" (repeated {count:,} time{'' if count == 1 else 's'})" if count else ""
+
+
+def console_line(tag, message, repeated=0):
+    suffix = repeated_text(repeated)
+    if tag is None:
+        return message + suffix
+    color = COLORS.get(tag)
+    tag = f"\033[{color}m{tag}\033[0m" if color else tag
+    return f"[{tag}] {message}{suffix}"
+
+
+class DroppingQueueHandler(QueueHandler):
+    """QueueHandler that never blocks the logging thread; records that do not fit are counted and dropped."""
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class LogWriter(threading.Thread):
+    """The only thread that touches the log file and the console.
+
+    Repeated messages (same level, logger and text) are written once and then
+    counted for `repeat_window` seconds, after which one summary record carries
+    the count. Other records below ERROR are rate limited per tag with a token
+    bucket (`rate` per second, bursts of `burst`). Records are written as JSON
+    lines in batches of `batch_size` or every `flush_interval` seconds; errors
+    are written and synced at once. The file is rotated at `max_bytes`.
+    Records the `handler` could not queue are reported as well.
+    """
+
+    def __init__(self, log_queue, path, console=True, level=logging.INFO, max_bytes=1_000_000, backups=5,
+                 batch_size=200, flush_interval=5.0, rate=20.0, burst=100, repeat_window=60.0, handler=None):
+        super().__init__(name="log-writer", daemon=True)
+        self.queue = log_queue
+        self.handler = handler
+        self.path = path
+        self.console = console
+        self.level = level
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.rate = rate
+        self.burst = burst
+        self.repeat_window = repeat_window
+
+        self._file = None
+        self._lines = []            # JSON lines not written yet
+        self._first_buffered = None  # monotonic time of the oldest of them
+        self._recent = {}           # (level, logger, message) -> [suppressed, first created, last created]
+        self._buckets = {}          # tag -> [tokens, monotonic time of the last refill]
+        self._rate_dropped = {}     # tag -> records dropped by the rate limit since the last report
+        self._queue_dropped = 0     # queue drops already reported
+        self.flushed = threading.Event()
+        self.writes = 0             # write calls to the file
+        self.errors = 0
+
+    # --- file
+
+    def _open(self):
+        if self._file is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            self._file = open(self.path, "a", encoding="utf-8")
+
+    def _rotate(self):
+        self._file.close()
+        self._file = None
+        for index in range(self.backups - 1, 0, -1):
+            if os.path.exists(f"{self.path}.{index}"):
+                os.replace(f"{self.path}.{index}", f"{self.path}.{index + 1}")
+        os.replace(self.path, f"{self.path}.1")
+
+    def _write(self, sync=False):
+        if not self._lines:
+            return
+        lines, self._lines, self._first_buffered = self._lines, [], None
+        try:
+            self._open()
+            self._file.write("".join(lines))
+            self._file.flush()
+            if sync:
+                os.fsync(self._file.fileno())
+            self.writes += 1
+            if self._file.tell() >= self.max_bytes:
+                self._rotate()
+        except OSError as e:
+            self.errors += 1
+            print(f"[Log] Could not write {self.path}: {e}", file=sys.stderr)
+
+    # --- records
+
+    def _emit(self, created, levelno, name, thread, message, repeated=0, since=None):
+        tag, text = split_tag(message)
+        if self.console:
+            print(console_line(tag, text, repeated), flush=True)
+        if name == CONSOLE:
+            return
+        entry = {"t": round(created, 3), "level": logging.getLevelName(levelno), "tag": tag, "msg": text,
+                 "thread": thread}
+        if name != "root":
+            entry["logger"] = name
+        if repeated:
+            entry["repeated"] = repeated
+            entry["since"] = round(since, 3)
+        if not self._lines:
+            self._first_buffered = time.monotonic()
+        self._lines.append(json.dumps(entry, ensure_ascii=False) + "\n")
+        if levelno >= logging.ERROR:
+            self._write(sync=True)
+        elif len(self._lines) >= self.batch_size:
+            self._write()
+
+    def _summary(self, key, entry):
+        levelno, name, message = key
+        suppressed, first, last = entry
+        if suppressed:
+            self._emit(last, levelno, name, None, message, suppressed, first)
+
+    def _allowed(self, tag, now):
+        tokens, refilled = self._buckets.get(tag, (self.burst, now))
+        tokens = min(self.burst, tokens + (now - refilled) * self.rate)
+        if tokens < 1:
+            self._buckets[tag] = (tokens, now)
+            self._rate_dropped[tag] = self._rate_dropped.get(tag, 0) + 1
+            return False
+        self._buckets[tag] = (tokens - 1, now)
+        return True
+
+    def handle(self, record):
+        if record.levelno < self.level:
+            return
+        message = record.getMessage()
+        key = (record.levelno, record.name, message)
+        entry = self._recent.get(key)
+        if entry is not None:
+            if record.created - entry[1] < self.repeat_window:
+                entry[0] += 1
+                entry[2] = record.created
+                return
+            self._summary(key, entry)
+        if record.levelno < logging.ERROR and not self._allowed(split_tag(message)[0], time.monotonic()):
+            return
+        self._recent[key] = [0, record.created, record.created]
+        self._emit(record.created, record.levelno, record.name, record.threadName, message)
+
+    def _expire(self, now, everything=False):
+        """Write the summaries of repeat windows that are over (all of them when stopping)."""
+        for key, entry in list(self._recent.items()):
+            if everything or now - entry[1] >= self.repeat_window:
+                self._summary(key, entry)
+                del self._recent[key]
+        for tag, count in self._rate_dropped.items():
+            self._emit(now, logging.WARNING, "log", None, f"[Log] {count} records of [{tag}] dropped by the rate limit")
+        self._rate_dropped.clear()
+        dropped = self.handler.dropped if self.handler is not None else 0
+        if dropped > self._queue_dropped:
+            self._emit(now, logging.WARNING, "log", None,
+                       f"[Log] {dropped - self._queue_dropped} records dropped, log queue full")
+            self._queue_dropped = dropped
+
+    def run(self):
+        next_expire = time.monotonic() + 1.0
+        while True:
+            if self._first_buffered is not None:
+                timeout = max(0.0, self._first_buffered + self.flush_interval - time.monotonic())
+            else:
+                timeout = 1.0
+            try:
+                record = self.queue.get(timeout=min(timeout, max(0.0, next_expire - time.monotonic())))
+            except queue.Empty:
+                record = None
+            if record is _STOP or record is _FLUSH:
+                self._expire(time.time(), everything=record is _STOP)
+                self._write(sync=True)
+                self.flushed.set()
+                if record is _STOP:
+                    break
+                continue
+            if record is not None:
+                try:
+                    self.handle(record)
+                except Exception as e:
+                    self.errors += 1
+                    print(f"[Log] Could not handle a record: {e}", file=sys.stderr)
+            now = time.monotonic()
+            if now >= next_expire:
+                next_expire = now + 1.0
+                self._expire(time.time())
+            if self._first_buffered is not None and now - self._first_buffered >= self.flush_interval:
+                self._write()
+        if self._file is not None:
+            self._file.close()
+
+
+class LogPipeline:
+    """Queue based logging: a non-blocking handler on the root logger and one LogWriter thread."""
+
+    def __init__(self, path, console=True, level=logging.INFO, queue_size=10000, **options):
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.handler = DroppingQueueHandler(self.queue)
+        self.writer = LogWriter(self.queue, path, console=console, level=level, handler=self.handler, **options)
+        self._stopped = False
+        self._replaced = []
+
+    def install(self):
+        root = logging.getLogger()
+        self._replaced = list(root.handlers)
+        for handler in self._replaced:
+            root.removeHandler(handler)
+        root.addHandler(self.handler)
+        root.setLevel(self.writer.level)
+        # loggers used only for console messages do not need the root level
+        logging.getLogger(CONSOLE).setLevel(logging.INFO)
+        self.writer.start()
+        atexit.register(self.stop)
+        return self
+
+    def flush(self, timeout=2.0):
+        """Have everything queued so far written and synced; returns False on timeout."""
+        if self._stopped:
+            return True
+        self.writer.flushed.clear()
+        self.queue.put(_FLUSH)
+        return self.writer.flushed.wait(timeout)
+
+    def stop(self, timeout=5.0):
+        if self._stopped:
+            return
+        self._stopped = True
+        root = logging.getLogger()
+        root.removeHandler(self.handler)
+        # give the root its handlers back; a NullHandler keeps logging.info() from calling basicConfig
+        for handler in self._replaced or [logging.NullHandler()]:
+            root.addHandler(handler)
+        self.queue.put(_STOP)
+        self.writer.join(timeout)
+        atexit.unregister(self.stop)
+
+
+_active = None
+
+
+def setup_logging(path, console=True, level=logging.INFO, **options):
+    """Route all logging through a LogPipeline writing JSON lines to `path`; replaces a previous one."""
+    global _active
+    if _active is not None:
+        _active.stop()
+    _active = LogPipeline(path, console=console, level=level, **options).install()
+    return _active
+
+
+def read_records(paths):
+    """Records of JSON line logs, oldest file first (rotated files end in .1, .2, ...)."""
+    for path in paths:
+        with open(path, encoding="utf-8") as file:
+            for line in file:
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    continue  # line cut off by a power loss
+
+
+def log_files(path):
+    """`path` and its rotated files, oldest first."""
+    rotated = []
+    index = 1
+    while os.path.exists(f"{path}.{index}"):
+        rotated.append(f"{path}.{index}")
+        index += 1
+    return rotated[::-1] + ([path] if os.path.exists(path) else [])
+
+
+class StallingFile:
+    """File wrapper that makes every flush as slow as a busy SD card."""
+
+    def __init__(self, file, stall):
+        self._file = file
+        self.stall = stall
+        self.flushes = 0
+
+    def __getattr__(self, name):
+        return getattr(self._file, name)
+
+    def flush(self):
+        self.flushes += 1
+        self._file.flush()
+        time.sleep(self.stall)
+
+
+def benchmark(path, threads=4, messages=2000, stall=0.002):
+    """Producer latency and file writes of the pipeline compared with a synchronous FileHandler."""
+    def produce(latencies):
+        logger = logging.getLogger("bench")
+        for index in range(messages):
+            started = time.perf_counter()
+            if index % 10 == 0:
+                logger.info(f"[Sensor] Reading {index}")
+            else:
+                logger.warning("[UART] Read error: device reports readiness to read but returned no data")
+            latencies.append(time.perf_counter() - started)
+
+    def run():
+        results = [[] for _ in range(threads)]
+        workers = [threading.Thread(target=produce, args=(result,)) for result in results]
+        started = time.perf_counter()
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        latencies = sorted(latency for result in results for latency in result)
+        return time.perf_counter() - started, latencies
+
+    for name in ("FileHandler", "LogPipeline"):
+        if os.path.exists(path):
+            os.remove(path)
+        root = logging.getLogger()
+        if name == "FileHandler":
+            handler = logging.FileHandler(path)
+            handler.setFormatter(logging.Formatter("%(asctime)s - %(levelname)s - %(message)s"))
+            handler.stream = stream = StallingFile(handler.stream, stall)
+            root.addHandler(handler)
+            root.setLevel(logging.INFO)
+            elapsed, latencies = run()
+            root.removeHandler(handler)
+            handler.close()
+            writes = f"{stream.flushes} flushes"
+        else:
+            pipeline = setup_logging(path, console=False)
+            writer = pipeline.writer
+            streams = []
+            open_file = writer._open
+
+            def stalling_open():
+                if writer._file is None:
+                    open_file()
+                    writer._file = StallingFile(writer._file, stall)
+                    streams.append(writer._file)
+
+            writer._open = stalling_open
+            elapsed, latencies = run()
+            pipeline.stop()
+            writes = f"{sum(stream.flushes for stream in streams)} flushes, {pipeline.handler.dropped} dropped in the queue"
+        size = sum(os.path.getsize(file) for file in log_files(path))
+        print(f"{name} ({stall * 1000:g} ms per flush): {threads * messages} records in {elapsed:.2f} s, call latency "
+              f"median {latencies[len(latencies) // 2] * 1e6:.0f} us, p99.9 {latencies[int(len(latencies) * 0.999)] * 1e6:.0f} us, "
+              f"max {latencies[-1] * 1e3:.1f} ms; {size / 1024:.0f} kB, {writes}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Filter the JSON line event log")
+    parser.add_argument("log", help="log file, rotated files are included")
+    parser.add_argument("--level", default="DEBUG", help="minimum level")
+    parser.add_argument("--tag", help="only records with this tag, e.g. Safety")
+    parser.add_argument("--since", help="YYYY-MM-DD[THH:MM] local time")
+    parser.add_argument("--grep", help="text contained in the message")
+    parser.add_argument("--bench", action="store_true", help="benchmark the pipeline, writes to LOG")
+    args = parser.parse_args()
+
+    if args.bench:
+        benchmark(args.log)
+        sys.exit(0)
+    minimum = logging.getLevelName(args.level.upper())
+    since = None
+    if args.since:
+        since = time.mktime(time.strptime(args.since, "%Y-%m-%dT%H:%M" if "T" in args.since else "%Y-%m-%d"))
+    for record in read_records(log_files(args.log)):
+        if logging.getLevelName(record["level"]) < minimum:
+            continue
+        if args.tag and record.get("tag") != args.tag:
+            continue
+        if since is not None and record["t"] < since:
+            continue
+        if args.grep and args.grep not in record["msg"]:
+            continue
+        stamp = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(record["t"]))
+        tag = f"[{record['tag']}] " if record.get("tag") else ""
+        print(f"{stamp} {record['level']:8s} {tag}{record['msg']}{repeated_text(record.get('repeated'))}")
@@ -0,0 +1,423 @@
+import os           # metrics files, load average, process memory
+import re           # metric names of the text format
+import json         # snapshots
+import time         # timers and snapshot times
+import bisect       # histogram buckets
+import logging      # encoder reports
+import argparse     # command line interface
+import threading    # metrics are updated from every thread
+import socketserver # local unix socket endpoint
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer  # local http endpoint
+
+from dates import day_name  # daily metrics files, like the sensor data
+
+# upper bucket bounds [s] for durations: 100 us to about 3 min, four buckets per decade
+TIME_BUCKETS = tuple(10 ** (exponent / 4) for exponent in range(-16, 10))
+TEMPERATURE_BUCKETS = tuple(range(20, 92, 2))  # cpu temperature [°C]
+LOAD_BUCKETS = (0.25, 0.5, 0.75, 1.0, 1.5, 2.0, 3.0, 4.0, 6.0, 8.0)  # 1 min load average
+QUANTILES = (0.5, 0.9, 0.99)
+
+
+class Counter:
+    """Monotonically increasing count."""
+
+    def __init__(self):
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+
+class Gauge:
+    """Last value set, or the value of `fn` at the time of the snapshot."""
+
+    def __init__(self, fn=None):
+        self.value = None
+        self.fn = fn
+
+    def set(self, value):
+        self.value = value
+
+    def read(self):
+        if self.fn is None:
+            return self.value
+        try:
+            return self.fn()
+        except Exception:
+            return None
+
+
+class Histogram:
+    """Distribution of observed values in fixed buckets plus count, sum, min and max.
+
+    Observing is a bisect and a few additions, so it can be used for every
+    frame or task run. Quantiles are the upper bound of the bucket they fall
+    into (clamped to the observed range).
+    """
+
+    def __init__(self, buckets=TIME_BUCKETS):
+        self.bounds = tuple(buckets)
+        self.counts = [0] * (len(self.bounds) + 1)  # last bucket: above the highest bound
+        self.count = 0
+        self.sum = 0.0
+        self.min = None
+        self.max = None
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.bounds, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.count += 1
+            self.sum += value
+            if self.min is None or value < self.min:
+                self.min = value
+            if self.max is None or value > self.max:
+                self.max = value
+
+    def quantile(self, q):
+        if not self.count:
+            return None
+        rank, seen = q * self.count, 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank and count:
+                bound = self.bounds[index] if index < len(self.bounds) else self.max
+                return min(max(bound, self.min), self.max)
+        return self.max
+
+    def summary(self):
+        with self._lock:
+            if not self.count:
+                return {"count": 0}
+            summary = {"count": self.count, "sum": self.sum, "mean": self.sum / self.count,
+                       "min": self.min, "max": self.max}
+            for q in QUANTILES:
+                summary[f"p{round(q * 100)}"] = self.quantile(q)
+            return summary
+
+
+class Timer:
+    """Context manager observing the real time spent in the block [s]."""
+
+    def __init__(self, histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self._started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self._started)
+        return False
+
+
+class Metrics:
+    """Registry of named counters, gauges and histograms, kept in memory.
+
+    Metrics are created on first use, so call sites only name them:
+    `metrics.counter("audio.overruns").inc()`,
+    `with metrics.timer("camera.start_recording"): ...`.
+    `snapshot` returns all current values; counters and histograms count since
+    the start of the process.
+    """
+
+    def __init__(self, clock=time):
+        self.clock = clock
+        self.started = clock.time()
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _get(self, name, kind, *args):
+        metric = self._metrics.get(name)
+        if metric is None:
+            with self._lock:
+                metric = self._metrics.get(name)
+                if metric is None:
+                    metric = self._metrics[name] = kind(*args)
+        if not isinstance(metric, kind):
+            raise TypeError(f"Metric {name} is a {type(metric).__name__}, not a {kind.__name__}")
+        return metric
+
+    def counter(self, name):
+        return self._get(name, Counter)
+
+    def gauge(self, name, fn=None):
+        """Gauge `name`; with `fn` it is read from `fn()` at every snapshot."""
+        gauge = self._get(name, Gauge)
+        if fn is not None:
+            gauge.fn = fn
+        return gauge
+
+    def histogram(self, name, buckets=TIME_BUCKETS):
+        return self._get(name, Histogram, buckets)
+
+    def observe(self, name, value, buckets=TIME_BUCKETS):
+        self.histogram(name, buckets).observe(value)
+
+    def timer(self, name):
+        return Timer(self.histogram(name))
+
+    def snapshot(self):
+        with self._lock:
+            metrics = sorted(self._metrics.items())
+        snapshot = {"t": round(self.clock.time(), 3), "uptime": round(self.clock.time() - self.started, 3),
+                    "counters": {}, "gauges": {}, "histograms": {}}
+        for name, metric in metrics:
+            if isinstance(metric, Counter):
+                snapshot["counters"][name] = metric.value
+            elif isinstance(metric, Gauge):
+                snapshot["gauges"][name] = metric.read()
+            else:
+                snapshot["histograms"][name] = metric.summary()
+        return snapshot
+
+
+class MetricsFile:
+    """Snapshots as JSON lines in one file per day, `<prefix>_<YYYY-MM-DD>.jsonl` in `directory`."""
+
+    def __init__(self, directory, prefix="metrics"):
+        self.directory = directory
+        self.prefix = prefix
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, timestamp):
+        return os.path.join(self.directory, f"{self.prefix}_{day_name(timestamp)}.jsonl")
+
+    def write(self, snapshot):
+        try:
+            with open(self.path(snapshot["t"]), "a") as file:
+                file.write(json.dumps(snapshot) + "\n")
+        except OSError as e:
+            logging.error(f"[Metrics] Could not write snapshot: {e}")
+
+    def files(self):
+        return sorted(os.path.join(self.directory, name) for name in os.listdir(self.directory)
+                      if name.startswith(self.prefix + "_") and name.endswith(".jsonl"))
+
+
+def read_snapshots(paths):
+    for path in paths:
+        with open(path) as file:
+            for line in file:
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    continue  # line cut off by a power loss
+
+
+class ResourceSampler:
+    """Samples cpu temperature, load, process cpu, memory and free storage into gauges.
+
+    Temperature and load are also kept as histograms per set of active tasks
+    (`active()` returns task names, e.g. the tasks of the energy ledger), so
+    e.g. `cpu.temperature.light+video` shows how warm the pi gets while filming.
+    """
+
+    def __init__(self, metrics, thermal="/sys/class/thermal/thermal_zone0/temp", storage=None, active=None):
+        self.metrics = metrics
+        self.thermal = thermal
+        self.storage = storage
+        self.active = active
+        self._cpu = None  # (monotonic, process time) of the previous sample
+
+    def cpu_temperature(self):
+        try:
+            with open(self.thermal) as file:
+                return int(file.read()) / 1000
+        except (OSError, ValueError):
+            return None
+
+    @staticmethod
+    def rss():
+        """Resident memory of the process [bytes]."""
+        try:
+            with open("/proc/self/statm") as file:
+                return int(file.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+        except (OSError, ValueError, IndexError):
+            return None
+
+    def sample(self):
+        metrics = self.metrics
+        state = "+".join(sorted(self.active())) if self.active is not None else ""
+        state = state or "idle"
+
+        temperature = self.cpu_temperature()
+        metrics.gauge("cpu.temperature").set(temperature)
+        if temperature is not None:
+            metrics.observe(f"cpu.temperature.{state}", temperature, TEMPERATURE_BUCKETS)
+        load = os.getloadavg()[0]
+        metrics.gauge("cpu.load").set(load)
+        metrics.observe(f"cpu.load.{state}", load, LOAD_BUCKETS)
+
+        now, cpu = time.monotonic(), time.process_time()
+        if self._cpu is not None and now > self._cpu[0]:
+            metrics.gauge("process.cpu_percent").set(round(100 * (cpu - self._cpu[1]) / (now - self._cpu[0]), 1))
+        self._cpu = (now, cpu)
+        metrics.gauge("process.rss").set(self.rss())
+        metrics.gauge("process.threads").set(threading.active_count())
+        if self.storage is not None:
+            stat = os.statvfs(self.storage)
+            metrics.gauge("storage.free").set(stat.f_bavail * stat.f_frsize)
+
+
+def text_format(snapshot):
+    """Snapshot as `name value` lines (Prometheus text format, without types)."""
+    def clean(name):
+        return re.sub(r"[^a-zA-Z0-9_]", "_", name)
+
+    lines = []
+    for name, value in snapshot["counters"].items():
+        lines.append(f"{clean(name)}_total {value}")
+    for name, value in snapshot["gauges"].items():
+        if value is not None:
+            lines.append(f"{clean(name)} {value}")
+    for name, summary in snapshot["histograms"].items():
+        name = clean(name)
+        lines.append(f"{name}_count {summary['count']}")
+        if summary["count"]:
+            lines.append(f"{name}_sum {summary['sum']}")
+            for q in QUANTILES:
+                lines.append(f'{name}{{quantile="{q}"}} {summary[f"p{round(q * 100)}"]}')
+    return "\n".join(lines) + "\n"
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        snapshot = self.server.metrics.snapshot()
+        if self.path.rstrip("/") in ("", "/metrics"):
+            body, content_type = json.dumps(snapshot).encode(), "application/json"
+        elif self.path == "/metrics.txt":
+            body, content_type = text_format(snapshot).encode(), "text/plain; version=0.0.4"
+        else:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass  # requests are not worth an entry in the event log
+
+
+class _UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+class MetricsServer:
+    """Serves the current snapshot on 127.0.0.1:`port` and/or the unix socket `socket_path`.
+
+    `GET /metrics` returns the snapshot as JSON, `GET /metrics.txt` in text
+    format. Only local connections are possible; use an ssh tunnel or
+    `curl --unix-socket` on the pi.
+    """
+
+    def __init__(self, metrics, port=None, socket_path=None):
+        self.metrics = metrics
+        self.port = port
+        self.socket_path = socket_path
+        self._servers = []
+
+    def start(self):
+        if self.port is not None:
+            server = ThreadingHTTPServer(("127.0.0.1", self.port), _Handler)
+            server.daemon_threads = True
+            self._servers.append(server)
+        if self.socket_path is not None:
+            if os.path.exists(self.socket_path):
+                os.remove(self.socket_path)  # left over from a previous run
+            self._servers.append(_UnixHTTPServer(self.socket_path, _Handler))
+        for server in self._servers:
+            server.metrics = self.metrics
+            threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True).start()
+        return self
+
+    def stop(self):
+        for server in self._servers:
+            server.shutdown()
+            server.server_close()
+        self._servers = []
+        if self.socket_path is not None and os.path.exists(self.socket_path):
+            os.remove(self.socket_path)
+
+
+def show(snapshot, prefix=""):
+    """Console table of one snapshot; durations in milliseconds."""
+    print(f"{time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(snapshot['t']))}, "
+          f"uptime {snapshot['uptime'] / 3600:.1f} h")
+    for name, value in snapshot["counters"].items():
+        if name.startswith(prefix):
+            print(f"  {name:<40} {value}")
+    for name, value in snapshot["gauges"].items():
+        if name.startswith(prefix):
+            print(f"  {name:<40} {value}")
+    for name, summary in snapshot["histograms"].items():
+        if not name.startswith(prefix) or not summary["count"]:
+            continue
+        # histograms in the time buckets are durations
+        factor, unit = (1000, "ms") if not name.startswith(("cpu.temperature", "cpu.load")) else (1, "")
+        print(f"  {name:<40} n={summary['count']:<6} " + " ".join(
+            f"{key}={summary[key] * factor:.2f}{unit}" for key in ("mean", "p50", "p90", "p99", "max")))
+
+
+def benchmark(iterations=200000):
+    """Cost of the instrumentation calls."""
+    metrics = Metrics()
+    counter, histogram = metrics.counter("bench.counter"), metrics.histogram("bench.histogram")
+
+    def timed():
+        with metrics.timer("bench.timer"):
+            pass
+
+    for label, fn in (("counter.inc", counter.inc),
+                      ("histogram.observe", lambda: histogram.observe(0.0123)),
+                      ("metrics.observe by name", lambda: metrics.observe("bench.histogram", 0.0123)),
+                      ("with metrics.timer", timed)):
+        started = time.perf_counter()
+        for _ in range(iterations):
+            fn()
+        print(f"{label}: {(time.perf_counter() - started) / iterations * 1e6:.2f} us per call")
+    started = time.perf_counter()
+    snapshot = metrics.snapshot()
+    print(f"snapshot: {(time.perf_counter() - started) * 1e6:.0f} us, {len(json.dumps(snapshot))} bytes")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Metrics of the monitoring unit")
+    parser.add_argument("command", choices=("show", "fetch", "bench"))
+    parser.add_argument("path", nargs="?", help="show: metrics directory or file")
+    parser.add_argument("--name", default="", help="only metrics starting with this prefix")
+    parser.add_argument("--all", action="store_true", help="show: every snapshot, not only the latest")
+    parser.add_argument("--port", type=int, default=8765, help="fetch: port of the running system")
+    parser.add_argument("--socket", help="fetch: unix socket of the running system")
+    args = parser.parse_args()
+
+    if args.command == "bench":
+        benchmark()
+    elif args.command == "fetch":
+        if args.socket:
+            import socket
+            client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            client.connect(args.socket)
+            client.sendall(b"GET /metrics HTTP/1.0\r\n\r\n")
+            response = b"".join(iter(lambda: client.recv(65536), b""))
+            client.close()
+            snapshot = json.loads(response.split(b"\r\n\r\n", 1)[1])
+        else:
+            from urllib.request import urlopen
+            with urlopen(f"http://127.0.0.1:{args.port}/metrics", timeout=5) as response:
+                snapshot = json.load(response)
+        show(snapshot, args.name)
+    else:
+        if args.path is None:
+            parser.error("show needs a metrics directory or file")
+        paths = MetricsFile(args.path).files() if os.path.isdir(args.path) else [args.path]
+        snapshots = list(read_snapshots(paths))
+        if not snapshots:
+            print("No snapshots")
+        for snapshot in (snapshots if args.all else snapshots[-1:]):
+            show(snapshot, args.name)
@@ -0,0 +1,213 @@
+import os           # filepath generation
+import time         # default clock, clip file names
+import logging      # event logging
+import subprocess   # decoding .h264 files for the replay harness
+import argparse     # replay harness options
+
+import numpy as np  # vectorized frame differencing
+
+from telemetry import TelemetryWriter   # per-clip activity scores
+from hal import CircularOutput, FrameMonitor  # pre-roll buffer (stand-in off the pi), encoder frame drops
+
+CLIP_FIELDS = ("time", "duration", "peak_score", "mean_score", "frames")
+
+
+class MotionDetector:
+    """Scores activity between consecutive luma frames.
+
+    The score is the fraction of (downscaled) pixels whose brightness changed by
+    more than `pixel_threshold`, so it is independent of the analysis resolution.
+    """
+
+    def __init__(self, pixel_threshold=12, downscale=2):
+        self.pixel_threshold = pixel_threshold
+        self.downscale = downscale
+        self._previous = None
+
+    def reset(self):
+        self._previous = None
+
+    def score(self, luma):
+        """Activity score (0..1) of a 2D uint8 luma frame against the previous one."""
+        frame = luma[::self.downscale, ::self.downscale].astype(np.int16)
+        previous, self._previous = self._previous, frame
+        if previous is None or previous.shape != frame.shape:
+            return 0.0
+        changed = np.count_nonzero(np.abs(frame - previous) > self.pixel_threshold)
+        return float(changed) / frame.size
+
+
+class ActivityTracker:
+    """Turns activity scores into clip start/stop decisions.
+
+    A clip starts when the score reaches `threshold` and ends once the score
+    stayed below it for `hold` seconds, so short pauses do not split a clip.
+    """
+
+    def __init__(self, threshold=0.02, hold=5.0):
+        self.threshold = threshold
+        self.hold = hold
+        self.active = False
+        self.started = None
+        self._last_active = None
+        self._scores = []
+
+    def update(self, score, now):
+        """Feed one score; returns "start", "stop" or None."""
+        if score >= self.threshold:
+            self._last_active = now
+            if not self.active:
+                self.active, self.started, self._scores = True, now, []
+                self._scores.append(score)
+                return "start"
+        if self.active:
+            self._scores.append(score)
+            if now - self._last_active > self.hold:
+                self.active = False
+                return "stop"
+        return None
+
+    def summary(self, now):
+        """(start, duration, peak score, mean score, analysed frames) of the current clip."""
+        scores = self._scores or [0.0]
+        return (self.started, now - self.started, max(scores), sum(scores) / len(scores), len(self._scores))
+
+
+class MotionRecorder:
+    """Records clips only while the lores stream shows activity.
+
+    The encoder runs continuously into a CircularOutput that holds the last
+    `preroll` seconds of encoded video in memory; when activity starts the
+    buffer is written out first, so every clip starts before the trigger.
+    With `metrics` the frames of the encoder are counted (see FrameMonitor).
+    Times and waits are taken from `clock`.
+    """
+
+    def __init__(self, picam2, encoder, output_folder, data_folder, stop_event, threshold=0.02, hold=5.0,
+                 preroll=3.0, framerate=30, analysis_rate=5.0, pixel_threshold=12, metrics=None, clock=time):
+        self.picam2 = picam2
+        self.encoder = encoder
+        self.output_folder = output_folder
+        self.stop_event = stop_event
+        self.preroll = preroll
+        self.framerate = framerate
+        self.analysis_rate = analysis_rate
+        self.detector = MotionDetector(pixel_threshold)
+        self.tracker = ActivityTracker(threshold, hold)
+        self.clips = TelemetryWriter(data_folder, prefix="clips", fields=CLIP_FIELDS, max_rows=16)
+        self.metrics = metrics
+        self.clock = clock
+        self.files = []   # every clip written, taken by the caller
+        self.scores = {}  # clip -> peak activity score, taken by the caller
+
+    def _luma(self, width, height, stride):
+        buffer = self.picam2.capture_buffer("lores")
+        return buffer[:stride * height].reshape(height, stride)[:, :width]
+
+    def _start_clip(self, output):
+        filename = os.path.join(self.output_folder, f"{time.strftime('%Y-%m-%d--%H-%M-%S', time.localtime(self.clock.time()))}_motion.h264")
+        output.fileoutput = filename
+        output.start()
+        self.files.append(filename)
+        logging.info(f"[Video] Motion clip started: {filename}")
+
+    def _stop_clip(self, output, now):
+        output.stop()
+        _, duration, peak, mean, frames = self.tracker.summary(now)
+        self.scores[self.files[-1]] = peak
+        self.clips.write([self.clock.time() - duration, duration, peak, mean, frames])
+        logging.info(f"[Video] Motion clip finished: {duration:.1f} s, peak score {peak:.3f}")
+
+    def run(self, duration, quality=None):
+        """Watches for activity for `duration` seconds, writing clips while it lasts."""
+        output = CircularOutput(buffersize=int(self.preroll * self.framerate))
+        # clips are started and stopped on the circular output itself, the monitor only sees the frames
+        monitored = output if self.metrics is None else FrameMonitor(output, self.metrics, self.framerate)
+        self.picam2.start_recording(self.encoder, monitored, quality=quality)
+        config = self.picam2.stream_configuration("lores")
+        width, height = config["size"]
+        stride = config["stride"]
+        self.detector.reset()
+        logging.info("[Video] Motion detection started")
+
+        period = 1.0 / self.analysis_rate
+        end = self.clock.monotonic() + duration
+        scale = getattr(self.clock, "scale", 1.0)  # waits are in real seconds
+        try:
+            while not self.stop_event.is_set():
+                now = self.clock.monotonic()
+                if now >= end:
+                    break
+                action = self.tracker.update(self.detector.score(self._luma(width, height, stride)), now)
+                if action == "start":
+                    self._start_clip(output)
+                elif action == "stop":
+                    self._stop_clip(output, now)
+                self.stop_event.wait(timeout=max(0.0, period - (self.clock.monotonic() - now)) / scale)
+        finally:
+            if self.tracker.active:
+                self.tracker.active = False
+                self._stop_clip(output, self.clock.monotonic())
+            self.picam2.stop_recording()
+            self.clips.flush()
+            logging.info("[Video] Motion detection finished")
+
+
+def read_frames(path, width, height):
+    """Yield luma frames of a raw YUV420 (.yuv) file or an .h264 file (decoded with ffmpeg)."""
+    frame_size = width * height
+    if path.endswith(".yuv"):
+        with open(path, "rb") as file:
+            while True:
+                data = file.read(frame_size * 3 // 2)
+                if len(data) < frame_size * 3 // 2:
+                    return
+                yield np.frombuffer(data, dtype=np.uint8, count=frame_size).reshape(height, width)
+    else:
+        command = ["ffmpeg", "-loglevel", "error", "-i", path, "-f", "rawvideo", "-pix_fmt", "gray",
+                   "-s", f"{width}x{height}", "-"]
+        with subprocess.Popen(command, stdout=subprocess.PIPE) as process:
+            while True:
+                data = process.stdout.read(frame_size)
+                if len(data) < frame_size:
+                    return
+                yield np.frombuffer(data, dtype=np.uint8).reshape(height, width)
+
+
+def replay(path, width, height, framerate, analysis_rate, threshold, hold, pixel_threshold):
+    """Run the detector over a recorded file and return the clips it would have written."""
+    detector = MotionDetector(pixel_threshold)
+    tracker = ActivityTracker(threshold, hold)
+    step = max(1, round(framerate / analysis_rate))  # analyse frames at the live analysis rate
+    clips, now = [], 0.0
+    for index, luma in enumerate(read_frames(path, width, height)):
+        if index % step:
+            continue
+        now = index / framerate
+        action = tracker.update(detector.score(luma), now)
+        if action == "stop":
+            clips.append(tracker.summary(now))
+    if tracker.active:
+        clips.append(tracker.summary(now))
+    return clips
+
+
+if __name__ == "__main__":
+    # usage: python3 motion_recording.py <file.yuv|file.h264> --size 320x240 [--threshold 0.02]
+    parser = argparse.ArgumentParser(description="Replay the motion detector on a recorded file")
+    parser.add_argument("path")
+    parser.add_argument("--size", default="320x240", help="frame size of the analysis stream")
+    parser.add_argument("--framerate", type=float, default=30)
+    parser.add_argument("--analysis-rate", type=float, default=5.0)
+    parser.add_argument("--threshold", type=float, default=0.02)
+    parser.add_argument("--hold", type=float, default=5.0)
+    parser.add_argument("--pixel-threshold", type=int, default=12)
+    args = parser.parse_args()
+    width, height = map(int, args.size.split("x"))
+
+    started = time.process_time()
+    clips = replay(args.path, width, height, args.framerate, args.analysis_rate, args.threshold, args.hold,
+                   args.pixel_threshold)
+    for start, duration, peak, mean, frames in clips:
+        print(f"clip at {start:8.1f} s  duration {duration:6.1f} s  peak {peak:.3f}  mean {mean:.3f}  frames {frames}")
+    print(f"{len(clips)} clips, {time.process_time() - started:.2f} s cpu")
@@ -0,0 +1,80 @@
+import os           # filepath generation
+import threading    # cache is shared between threads, optional polling thread
+import time         # cache ttl
+import logging      # error reporting
+
+
+class NetworkMonitor:
+    """Cached connection state of a network interface, read from sysfs and /proc.
+
+    An interface counts as connected when its operstate is `up` and the kernel has
+    an IPv4 route through it, which is what `inet` in the ifconfig output meant.
+    Reading two small files replaces the fork/exec of `ifconfig`, and the result
+    is cached for `ttl` seconds. Subscribers are called with the new state
+    whenever it changes.
+    """
+
+    def __init__(self, interface="wlan0", ttl=5.0, sysfs="/sys/class/net", route_table="/proc/net/route"):
+        self.interface = interface
+        self.ttl = ttl
+        self.operstate_path = os.path.join(sysfs, interface, "operstate")
+        self.route_table = route_table
+
+        self._lock = threading.Lock()
+        self._connected = None   # unknown until the first check
+        self._checked_at = None  # monotonic time of the last check
+        self._subscribers = []
+        self._thread = None
+
+    def subscribe(self, callback):
+        """Call `callback(connected)` every time the connection state changes."""
+        with self._lock:
+            self._subscribers.append(callback)
+
+    def _read_state(self):
+        try:
+            with open(self.operstate_path) as file:
+                if file.read().strip() != "up":
+                    return False
+            with open(self.route_table) as file:
+                next(file, None)  # header line
+                prefix = self.interface + "\t"
+                return any(line.startswith(prefix) for line in file)
+        except OSError:
+            # interface does not exist (e.g. wifi disabled)
+            return False
+
+    def refresh(self):
+        """Read the interface state now, notify subscribers on a change and return it."""
+        connected = self._read_state()
+        with self._lock:
+            changed = self._connected is not None and connected != self._connected
+            self._connected = connected
+            self._checked_at = time.monotonic()
+            subscribers = list(self._subscribers) if changed else []
+        for callback in subscribers:
+            try:
+                callback(connected)
+            except Exception as e:
+                logging.error(f"[Network] Subscriber error: {e}")
+        return connected
+
+    def is_connected(self):
+        """Cached connection state, refreshed when older than `ttl` seconds."""
+        with self._lock:
+            fresh = self._checked_at is not None and time.monotonic() - self._checked_at < self.ttl
+            if fresh:
+                return self._connected
+        return self.refresh()
+
+    def start(self, stop_event, interval=None):
+        """Poll in a background thread so subscribers are notified without callers."""
+        interval = self.ttl if interval is None else interval
+
+        def poll():
+            while not stop_event.is_set():
+                self.refresh()
+                stop_event.wait(timeout=interval)
+
+        self._thread = threading.Thread(target=poll, name="network-monitor", daemon=True)
+        self._thread.start()
@@ -0,0 +1,483 @@
+import os           # file sizes, paths
+import time         # default clock, backoff
+import socket       # unit name
+import logging      # event logging
+import sqlite3      # persistent upload queue
+import argparse     # command line interface
+import threading    # upload worker, stand-in server
+import http.client  # uploads
+import urllib.parse # upload urls
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler  # stand-in server
+
+from postprocess import sha256                  # interruptible whole-file hash
+from storage import name_time, companions, is_catalogued  # telemetry file dates, files of a recording
+from acoustic_features import FEATURE_SUFFIX    # features next to the audio recordings
+
+# lower is sent first: small telemetry and summaries before the recordings
+PRIORITIES = {"telemetry": 0, "summary": 1, "audio": 2, "video": 3}
+KINDS = {"data": "telemetry", "video": "video", "recordings": "audio"}  # folder -> kind
+SUMMARY_SUFFIXES = (".json", ".thumbs.jpg", FEATURE_SUFFIX)  # next to the recordings
+TELEMETRY_GRACE = 3600  # seconds after the end of its day until a daily telemetry file counts as closed
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS queue (
+    path TEXT PRIMARY KEY,      -- relative to the storage root, also the remote name below the unit
+    priority INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    mtime REAL NOT NULL,        -- a changed file is sent again
+    added REAL NOT NULL,
+    sent INTEGER DEFAULT 0,     -- bytes confirmed by the server
+    attempts INTEGER DEFAULT 0,
+    next_try REAL DEFAULT 0,    -- wall clock, backoff after failures
+    done REAL,                  -- wall clock of the completed upload, NULL while queued
+    error TEXT
+);
+CREATE INDEX IF NOT EXISTS queue_order ON queue (done, priority, added);
+"""
+
+
+def classify(path):
+    """Kind of a file by its folder below the storage root and its name (None: not uploaded)."""
+    folder, name = os.path.split(path)
+    kind = KINDS.get(folder)
+    if kind is None or ".tmp" in name:
+        return None
+    if kind != "telemetry" and name.endswith(SUMMARY_SUFFIXES):
+        return "summary"
+    # the same files as in the storage catalog: not the queues and databases
+    return kind if is_catalogued(name, kind) else None
+
+
+class UploadError(Exception):
+    """The server refused an upload (e.g. the hash did not match)."""
+
+
+class TokenBucket:
+    """Limits the average rate to `rate` bytes per second with bursts of up to `burst` bytes."""
+
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.burst = burst or rate
+        self._tokens = self.burst
+        self._last = time.monotonic()
+
+    def delay(self, amount):
+        """Takes `amount` bytes; returns the seconds to wait before sending them."""
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._last) * self.rate)
+        self._last = now
+        self._tokens -= amount
+        return max(0.0, -self._tokens / self.rate)
+
+
+class UploadQueue:
+    """Files to upload, kept in SQLite so the queue and the progress survive a reboot."""
+
+    def __init__(self, path):
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.row_factory = sqlite3.Row
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(SCHEMA)
+
+    def _execute(self, sql, parameters=()):
+        with self._lock:
+            if self._db is None:
+                return []  # closed, e.g. a late callback after shutdown
+            with self._db:
+                return self._db.execute(sql, parameters).fetchall()
+
+    def add(self, path, priority, size, mtime, now):
+        """Queue a file; returns False if it is queued or sent already and has not changed since."""
+        rows = self._execute("SELECT size, mtime FROM queue WHERE path = ?", (path,))
+        if rows and (rows[0]["size"], rows[0]["mtime"]) == (size, mtime):
+            return False
+        self._execute("INSERT OR REPLACE INTO queue (path, priority, size, mtime, added) VALUES (?, ?, ?, ?, ?)",
+                      (path, priority, size, mtime, now))
+        return True
+
+    def next(self, now):
+        """Queued file that is due, highest priority and oldest first."""
+        rows = self._execute("SELECT * FROM queue WHERE done IS NULL AND next_try <= ? ORDER BY priority, added"
+                             " LIMIT 1", (now,))
+        return dict(rows[0]) if rows else None
+
+    def progress(self, path, sent):
+        self._execute("UPDATE queue SET sent = ? WHERE path = ?", (sent, path))
+
+    def done(self, path, now):
+        self._execute("UPDATE queue SET done = ?, sent = size, error = NULL WHERE path = ?", (now, path))
+
+    def failed(self, path, error, next_try):
+        self._execute("UPDATE queue SET attempts = attempts + 1, next_try = ?, error = ? WHERE path = ?",
+                      (next_try, error, path))
+
+    def remove(self, path):
+        self._execute("DELETE FROM queue WHERE path = ?", (path,))
+
+    def pending(self):
+        """(files, bytes) still to send."""
+        rows = self._execute("SELECT COUNT(*) AS files, SUM(size - sent) AS bytes FROM queue WHERE done IS NULL")
+        return (rows[0]["files"], rows[0]["bytes"] or 0) if rows else (0, 0)
+
+    def rows(self, done=False):
+        return [dict(row) for row in self._execute(
+            f"SELECT * FROM queue WHERE done IS {'NOT ' if done else ''}NULL ORDER BY priority, added")]
+
+    def close(self):
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+
+class HttpTarget:
+    """Resumable, hash-verified uploads over HTTP or HTTPS (served by `python3 offload.py serve`).
+
+    HEAD <name> returns the bytes received so far (Upload-Offset) and the hash
+    of a completed upload (Upload-Digest). PATCH <name> appends a chunk at
+    Upload-Offset (0 restarts the upload); a wrong offset is answered with 409
+    and the server's offset. POST <name> with Upload-Length and Digest
+    completes the upload once the server computed the same sha256.
+    """
+
+    def __init__(self, url, timeout=30.0):
+        parts = urllib.parse.urlsplit(url)
+        if parts.scheme not in ("http", "https"):
+            raise ValueError(f"Unsupported upload url (http or https only): {url}")
+        self.connection = http.client.HTTPSConnection if parts.scheme == "https" else http.client.HTTPConnection
+        self.host, self.port = parts.hostname, parts.port or self.connection.default_port
+        self.base = parts.path.rstrip("/")
+        self.timeout = timeout
+        self._connection = None
+
+    def _request(self, method, name, body=None, headers=None):
+        path = f"{self.base}/{urllib.parse.quote(name)}"
+        for attempt in range(2):
+            if self._connection is None:
+                self._connection = self.connection(self.host, self.port, timeout=self.timeout)
+            try:
+                self._connection.request(method, path, body=body, headers=headers or {})
+                response = self._connection.getresponse()
+                response.read()
+                return response
+            except (http.client.HTTPException, OSError):
+                # e.g. a keep-alive connection closed by the server while uploads were paused
+                self.close()
+                if attempt:
+                    raise
+
+    def status(self, name):
+        """(bytes received, sha256 of the completed upload or None)."""
+        response = self._request("HEAD", name)
+        if response.status == 404:
+            return 0, None
+        if response.status != 200:
+            raise UploadError(f"HEAD {response.status} {response.reason}")
+        digest = response.getheader("Upload-Digest")
+        return int(response.getheader("Upload-Offset", 0)), digest.split("=", 1)[1] if digest else None
+
+    def append(self, name, offset, data):
+        """Send a chunk at `offset`; returns the new offset (the server's offset after a conflict)."""
+        response = self._request("PATCH", name, data, {"Upload-Offset": str(offset),
+                                                       "Content-Type": "application/offset+octet-stream"})
+        if response.status not in (204, 409):
+            raise UploadError(f"PATCH {response.status} {response.reason}")
+        return int(response.getheader("Upload-Offset"))
+
+    def complete(self, name, size, digest):
+        response = self._request("POST", name, b"", {"Upload-Length": str(size), "Digest": f"sha-256={digest}"})
+        if response.status not in (200, 201):
+            raise UploadError(f"POST {response.status} {response.reason}")
+
+    def close(self):
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+
+
+class Offloader:
+    """Uploads finished recordings and telemetry while wifi is up, outside the capture.
+
+    Files are queued with a priority (telemetry, then sidecars/thumbnails/
+    features, then audio, then video) in a persistent queue. A single worker
+    thread at nice `nice` uploads them in `chunk_size` chunks, limited to
+    `rate` bytes per second, and only while the window opened by `resume` is
+    open and `connected()` is true; `pause` holds it between two chunks. An
+    interrupted upload continues at the offset the server reports. Failed
+    uploads are retried with an exponential backoff.
+    """
+
+    def __init__(self, storage, target, queue_path, unit=None, rate=250e3, chunk_size=256 * 1024, nice=19,
+                 connected=None, clock=time, metrics=None, retry=60.0, max_retry=3600.0):
+        self.storage = storage
+        self.target = target
+        self.queue = UploadQueue(queue_path)
+        self.unit = unit or socket.gethostname()
+        self.bucket = TokenBucket(rate, burst=chunk_size)
+        self.chunk_size = chunk_size
+        self.nice = nice
+        self.connected = connected or (lambda: True)
+        self.clock = clock
+        self.metrics = metrics
+        self.retry = retry
+        self.max_retry = max_retry
+
+        self._condition = threading.Condition()
+        self._running = threading.Event()  # set while a window is open
+        self._stopped = threading.Event()
+        self._thread = None
+        self.sent = 0      # bytes
+        self.uploaded = 0  # files
+        self.failed = 0    # attempts
+
+    # --- queue
+
+    def add(self, path):
+        """Queue a file below the storage root (and the companion files of a recording)."""
+        names = [path]
+        if classify(os.path.relpath(path, self.storage)) in ("video", "audio"):
+            names += companions(path)
+        for name in names:
+            relative = os.path.relpath(name, self.storage)
+            kind = classify(relative)
+            if kind is None or not os.path.exists(name):
+                continue
+            stat = os.stat(name)
+            if self.queue.add(relative, PRIORITIES[kind], stat.st_size, stat.st_mtime, self.clock.time()):
+                self.wake()
+
+    def add_telemetry(self):
+        """Queue the daily telemetry files whose day is over."""
+        directory = os.path.join(self.storage, "data")
+        for name in sorted(os.listdir(directory)):
+            day = name_time(name)
+            if classify(os.path.join("data", name)) and day + 86400 + TELEMETRY_GRACE < self.clock.time():
+                self.add(os.path.join(directory, name))
+
+    # --- control
+
+    def start(self):
+        self._thread = threading.Thread(target=self._work, name="offload", daemon=True)
+        self._thread.start()
+        return self
+
+    def wake(self):
+        """Look for work now, e.g. after the wifi came up."""
+        with self._condition:
+            self._condition.notify_all()
+
+    def resume(self):
+        self._running.set()
+        self.wake()
+
+    def pause(self):
+        self._running.clear()
+
+    def shutdown(self):
+        self._stopped.set()
+        self._running.set()
+        self.wake()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+        self.target.close()
+        self.queue.close()
+
+    # --- worker
+
+    def _checkpoint(self):
+        """Blocks while the window is closed; raises once the offloader is shut down."""
+        self._running.wait()
+        if self._stopped.is_set():
+            raise InterruptedError("Offload stopped")
+
+    def _next(self):
+        with self._condition:
+            while not self._stopped.is_set():
+                if self._running.is_set() and self.connected():
+                    item = self.queue.next(self.clock.time())
+                    if item is not None:
+                        return item
+                self._condition.wait(timeout=1.0)
+            return None
+
+    def _work(self):
+        try:
+            os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), self.nice)
+        except (AttributeError, OSError):
+            pass
+        while True:
+            item = self._next()
+            if item is None:
+                return
+            started = time.perf_counter()
+            try:
+                self._upload(item)
+            except InterruptedError:
+                return
+            except (OSError, http.client.HTTPException, UploadError) as e:
+                delay = min(self.max_retry, self.retry * 2 ** item["attempts"])
+                self.queue.failed(item["path"], str(e), self.clock.time() + delay)
+                self.failed += 1
+                logging.warning(f"[Offload] {item['path']} failed, retry in {delay:.0f} s: {e}")
+                if self.metrics is not None:
+                    self.metrics.counter("offload.failed").inc()
+            else:
+                if self.metrics is not None:
+                    self.metrics.observe("offload.file", time.perf_counter() - started)
+
+    def _upload(self, item):
+        path = os.path.join(self.storage, item["path"])
+        if not os.path.exists(path):
+            self.queue.remove(item["path"])  # evicted or replaced meanwhile
+            logging.info(f"[Offload] {item['path']} no longer exists, dropped")
+            return
+        name = f"{self.unit}/{item['path']}"
+        size = os.path.getsize(path)
+        digest = sha256(path, self._checkpoint)
+        offset, remote = self.target.status(name)
+        if remote == digest:
+            offset = size  # completed before, e.g. just before a reboot
+        elif offset > size:
+            offset = 0
+        with open(path, "rb") as file:
+            while offset < size:
+                self._checkpoint()
+                file.seek(offset)
+                data = file.read(self.chunk_size)
+                if self._stopped.wait(self.bucket.delay(len(data))):
+                    raise InterruptedError("Offload stopped")
+                self._checkpoint()
+                offset = self.target.append(name, offset, data)
+                self.queue.progress(item["path"], offset)
+                self.sent += len(data)
+                if self.metrics is not None:
+                    self.metrics.counter("offload.bytes").inc(len(data))
+        if remote != digest:
+            self.target.complete(name, size, digest)
+        self.queue.done(item["path"], self.clock.time())
+        self.uploaded += 1
+        if self.metrics is not None:
+            self.metrics.counter("offload.files").inc()
+        logging.info(f"[Offload] {item['path']} uploaded ({size / 1024:.0f} kB)")
+
+
+class UploadHandler(BaseHTTPRequestHandler):
+    """Stand-in server: receives uploads below `directory` (see HttpTarget for the protocol)."""
+
+    directory = "."
+    lock = threading.Lock()
+    protocol_version = "HTTP/1.1"  # keep-alive between the chunks
+
+    def _paths(self):
+        name = os.path.normpath(urllib.parse.unquote(urllib.parse.urlsplit(self.path).path).lstrip("/"))
+        if name.startswith("..") or os.path.isabs(name):
+            self._reply(400)
+            return None, None
+        target = os.path.join(self.directory, name)
+        return target, target + ".part"
+
+    def _reply(self, status, headers=None):
+        self.send_response(status)
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def do_HEAD(self):
+        target, part = self._paths()
+        if target is None:
+            return
+        with self.lock:
+            headers = {"Upload-Offset": str(os.path.getsize(part) if os.path.exists(part) else 0)}
+            if os.path.exists(target):
+                headers["Upload-Digest"] = f"sha-256={sha256(target)}"
+            elif not os.path.exists(part):
+                return self._reply(404)
+        self._reply(200, headers)
+
+    def do_PATCH(self):
+        target, part = self._paths()
+        if target is None:
+            return
+        offset = int(self.headers.get("Upload-Offset", -1))
+        data = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        with self.lock:
+            current = os.path.getsize(part) if os.path.exists(part) else 0
+            if offset != current and offset != 0:
+                return self._reply(409, {"Upload-Offset": str(current)})
+            os.makedirs(os.path.dirname(part), exist_ok=True)
+            with open(part, "wb" if offset == 0 else "ab") as file:
+                file.write(data)
+            self._reply(204, {"Upload-Offset": str(offset + len(data))})
+
+    def do_POST(self):
+        target, part = self._paths()
+        if target is None:
+            return
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        expected = self.headers.get("Digest", "").split("=", 1)[-1]
+        with self.lock:
+            source = part if os.path.exists(part) else target
+            if not os.path.exists(source) or os.path.getsize(source) != int(self.headers.get("Upload-Length", -1)):
+                return self._reply(409)
+            if sha256(source) != expected:
+                if source == part:
+                    os.remove(part)
+                return self._reply(422)  # hash mismatch, the client starts over
+            os.replace(source, target)
+        self._reply(201)
+
+    def log_message(self, format, *args):
+        logging.debug(f"[Offload] {self.address_string()} {format % args}")
+
+
+def serve(directory, port=8080, host="127.0.0.1"):
+    """Stand-in upload server in a background thread; returns the server (call shutdown() to stop)."""
+    handler = type("Handler", (UploadHandler,), {"directory": directory})
+    server = ThreadingHTTPServer((host, port), handler)
+    threading.Thread(target=server.serve_forever, name="offload-server", daemon=True).start()
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Offload of recordings and telemetry")
+    parser.add_argument("command", choices=("serve", "push", "status"))
+    parser.add_argument("directory", help="serve: receiving folder; push/status: storage root")
+    parser.add_argument("--url", default="http://127.0.0.1:8080")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--host", default="127.0.0.1", help="address the stand-in server listens on")
+    parser.add_argument("--rate", type=float, default=250e3, help="bytes per second")
+    parser.add_argument("--queue", help="queue database, default <storage>/data/offload.sqlite")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    queue_path = args.queue or os.path.join(args.directory, "data", "offload.sqlite")
+
+    if args.command == "serve":
+        server = serve(args.directory, args.port, args.host)
+        print(f"Receiving uploads in {args.directory} on {args.host}:{args.port}, Ctrl+C to stop")
+        try:
+            threading.Event().wait()
+        except KeyboardInterrupt:
+            server.shutdown()
+    elif args.command == "status":
+        queue = UploadQueue(queue_path)
+        files, size = queue.pending()
+        print(f"{files} files, {size / 2 ** 20:.1f} MB queued, {len(queue.rows(done=True))} uploaded")
+        for row in queue.rows():
+            print(f"  {row['priority']} {row['path']} {row['sent']}/{row['size']} B"
+                  + (f", {row['attempts']} failed: {row['error']}" if row["attempts"] else ""))
+    else:
+        # upload everything of a storage folder now, e.g. a retrieved card
+        offloader = Offloader(args.directory, HttpTarget(args.url), queue_path, rate=args.rate, nice=0)
+        for folder in KINDS:
+            for name in sorted(os.listdir(os.path.join(args.directory, folder))):
+                if classify(os.path.join(folder, name)) in ("telemetry", "video", "audio"):
+                    offloader.add(os.path.join(args.directory, folder, name))
+        started = time.perf_counter()
+        offloader.start().resume()
+        while offloader.queue.pending()[0] and offloader.failed < 3:
+            time.sleep(0.2)
+        offloader.shutdown()
+        print(f"{offloader.uploaded} files, {offloader.sent / 2 ** 20:.1f} MB in {time.perf_counter() - started:.1f} s")
@@ -0,0 +1,424 @@
+import os           # file handling, thread priority
+import json         # journal and metadata sidecars
+import time         # job durations, processing time
+import shutil       # ffmpeg discovery
+import signal       # pausing running subprocesses
+import hashlib      # content hashes
+import logging      # event logging
+import argparse     # command line interface
+import threading    # worker threads, pause/resume
+import subprocess   # ffmpeg and ffprobe
+from collections import OrderedDict
+
+VIDEO_SUFFIXES = (".h264",)
+AUDIO_SUFFIXES = (".flac", ".wav")
+HASH_BLOCK = 1 << 20  # bytes read per hash update, the worker can be paused in between
+
+
+def sidecar_path(path):
+    """Metadata record stored next to the recording."""
+    return os.path.splitext(path)[0] + ".json"
+
+
+def sha256(path, checkpoint=None):
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        for block in iter(lambda: file.read(HASH_BLOCK), b""):
+            digest.update(block)
+            if checkpoint is not None:
+                checkpoint()
+    return digest.hexdigest()
+
+
+class Journal:
+    """Append-only job journal (JSON lines); replayed at start, so unfinished jobs survive a reboot.
+
+    A job is added before any work is done and marked done once its outputs
+    are complete. Every step of a job can be repeated, so a job interrupted by
+    a power cut is simply run again. Jobs failing `max_attempts` times are
+    given up. The journal is rewritten with the open jobs only when it is loaded.
+    """
+
+    def __init__(self, path, max_attempts=3):
+        self.path = path
+        self.max_attempts = max_attempts
+        self.jobs = OrderedDict()  # path -> job of every open job
+        self.attempts = {}         # path -> failed attempts of open jobs
+        self._lock = threading.Lock()
+        self._load()
+        self._file = open(self.path, "a")
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        with open(self.path) as file:
+            for line in file:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue  # line cut off by a power loss
+                path = entry.get("path")
+                if entry["op"] == "add":
+                    self.jobs[path] = entry["job"]
+                elif entry["op"] == "done":
+                    self.jobs.pop(path, None)
+                    self.attempts.pop(path, None)
+                elif entry["op"] == "failed":
+                    self.attempts[path] = self.attempts.get(path, 0) + 1
+                    if self.attempts[path] >= self.max_attempts:
+                        self.jobs.pop(path, None)
+        # compact: only the open jobs and their attempts
+        temporary = self.path + ".tmp"
+        with open(temporary, "w") as file:
+            for path, job in self.jobs.items():
+                file.write(json.dumps({"op": "add", "path": path, "job": job}) + "\n")
+                for _ in range(self.attempts.get(path, 0)):
+                    file.write(json.dumps({"op": "failed", "path": path}) + "\n")
+        os.replace(temporary, self.path)
+
+    def _append(self, entry):
+        if self._file.closed:
+            return  # a worker finishing after shutdown, the job runs again
+        self._file.write(json.dumps(entry) + "\n")
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def add(self, job):
+        with self._lock:
+            if job["path"] in self.jobs:
+                return False
+            self.jobs[job["path"]] = job
+            self._append({"op": "add", "path": job["path"], "job": job})
+            return True
+
+    def done(self, path):
+        with self._lock:
+            self.jobs.pop(path, None)
+            self.attempts.pop(path, None)
+            self._append({"op": "done", "path": path})
+
+    def failed(self, path, error):
+        with self._lock:
+            self.attempts[path] = self.attempts.get(path, 0) + 1
+            self._append({"op": "failed", "path": path, "error": error})
+            if self.attempts[path] >= self.max_attempts:
+                self.jobs.pop(path, None)
+                return True  # given up
+            return False
+
+    def pending(self, exclude=()):
+        with self._lock:
+            return [job for path, job in self.jobs.items() if path not in exclude]
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+class PostProcessor:
+    """Post-processing of finished recordings in the idle part of each cycle.
+
+    Videos are remuxed into a seekable .mp4 (stream copy), hashed and get a
+    thumbnail strip; audio files are hashed. Every recording gets a JSON
+    sidecar with size, sha256, duration and the metadata it was submitted with
+    (cycle, schedule, conditions during the recording).
+
+    `submit` only records the job in the journal; `resume(deadline)` lets the
+    worker threads run jobs until `deadline` (clock monotonic), a job is only
+    started when its predicted duration fits. `pause` suspends running ffmpeg
+    processes (SIGSTOP) and hashing until the next `resume`, so the work never
+    overlaps capture. Workers and their ffmpeg processes run at nice `nice`.
+    """
+
+    def __init__(self, journal_path, workers=1, nice=19, framerate=30, thumbnails=6, thumbnail_width=160,
+                 keep_raw=False, clock=time, metrics=None, ffmpeg="ffmpeg", ffprobe="ffprobe", on_done=None):
+        self.journal = Journal(journal_path)
+        self.workers = workers
+        self.nice = nice
+        self.framerate = framerate  # of raw h264 streams (no timestamps) submitted without a "framerate"
+        self.thumbnails = thumbnails
+        self.thumbnail_width = thumbnail_width
+        self.keep_raw = keep_raw
+        self.clock = clock
+        self.metrics = metrics
+        self.on_done = on_done  # called with (job, sidecar record) of every processed recording
+        self.ffmpeg = shutil.which(ffmpeg)
+        self.ffprobe = shutil.which(ffprobe)
+        if self.ffmpeg is None or self.ffprobe is None:
+            logging.warning("[Postprocess] ffmpeg/ffprobe not found, videos are only hashed")
+
+        self._condition = threading.Condition()
+        self._running = threading.Event()   # set while a window is open
+        self._deadline = None
+        self._active = set()                # paths of jobs being processed
+        self._processes = set()             # running subprocesses
+        self._stopped = False
+        self._estimate = 1.0                # expected real seconds per job, moving average
+        self._threads = []
+        self.processed = 0
+        self.failed = 0
+
+    # --- control
+
+    def start(self):
+        for index in range(self.workers):
+            thread = threading.Thread(target=self._work, name=f"postprocess-{index}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        return self
+
+    def _job(self, path, metadata):
+        kind = "video" if path.endswith(VIDEO_SUFFIXES) else "audio"
+        return {"path": path, "kind": kind, "submitted": round(self.clock.time(), 3), "metadata": metadata}
+
+    def submit(self, path, **metadata):
+        """Queue a finished recording; `metadata` goes into its sidecar."""
+        if self.journal.add(self._job(path, metadata)):
+            with self._condition:
+                self._condition.notify_all()
+
+    def recover(self, folder):
+        """Queue recordings of `folder` that have neither a sidecar nor a journal entry (e.g. from before)."""
+        count = 0
+        for name in sorted(os.listdir(folder)):
+            path = os.path.join(folder, name)
+            if name.endswith(VIDEO_SUFFIXES + AUDIO_SUFFIXES) and not os.path.exists(sidecar_path(path)):
+                count += self.journal.add(self._job(path, {}))
+        if count:
+            logging.info(f"[Postprocess] {count} unprocessed recordings found in {folder}")
+        return count
+
+    def resume(self, deadline):
+        """Open a processing window until `deadline` (clock monotonic)."""
+        with self._condition:
+            self._deadline = deadline
+            for process in self._processes:
+                process.send_signal(signal.SIGCONT)
+            self._running.set()
+            self._condition.notify_all()
+
+    def pause(self):
+        """Close the window: no new jobs, running ones are suspended where they are."""
+        with self._condition:
+            self._running.clear()
+            for process in self._processes:
+                process.send_signal(signal.SIGSTOP)
+        pending = len(self.journal.jobs)
+        if pending:
+            logging.info(f"[Postprocess] Paused with {pending} jobs pending")
+
+    def shutdown(self):
+        """Stop the workers; interrupted jobs stay in the journal and run again after a restart."""
+        with self._condition:
+            self._stopped = True
+            self._running.set()
+            for process in self._processes:
+                process.kill()
+                process.send_signal(signal.SIGCONT)
+            self._condition.notify_all()
+        for thread in self._threads:
+            thread.join(timeout=5)
+        self.journal.close()
+
+    # --- workers
+
+    def _checkpoint(self):
+        """Blocks while the window is closed; raises once the processor is shut down."""
+        self._running.wait()
+        if self._stopped:
+            raise InterruptedError("Post-processing stopped")
+
+    def _next(self):
+        """Next job that fits the window, None when stopped."""
+        with self._condition:
+            while not self._stopped:
+                if self._running.is_set():
+                    left = self._deadline - self.clock.monotonic()
+                    jobs = self.journal.pending(exclude=self._active)
+                    # predicted duration in clock seconds (the clock may run faster than real time)
+                    if jobs and left > self._estimate * getattr(self.clock, "scale", 1.0):
+                        self._active.add(jobs[0]["path"])
+                        return jobs[0]
+                self._condition.wait(timeout=1.0)
+            return None
+
+    def _work(self):
+        try:
+            # linux niceness is per thread and inherited by the ffmpeg processes started here
+            os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), self.nice)
+        except (AttributeError, OSError):
+            pass
+        while True:
+            job = self._next()
+            if job is None:
+                return
+            started = time.perf_counter()
+            try:
+                record = self._process(job)
+            except InterruptedError:
+                return
+            except Exception as e:
+                self.failed += 1
+                given_up = self.journal.failed(job["path"], str(e))
+                logging.error(f"[Postprocess] {os.path.basename(job['path'])} failed"
+                              f"{' (given up)' if given_up else ''}: {e}")
+                if self.metrics is not None:
+                    self.metrics.counter("postprocess.failed").inc()
+            else:
+                self.processed += 1
+                self.journal.done(job["path"])
+                if self.on_done is not None:
+                    try:
+                        self.on_done(job, record)
+                    except Exception as e:
+                        logging.error(f"[Postprocess] Callback for {os.path.basename(job['path'])} failed: {e}")
+                duration = time.perf_counter() - started
+                self._estimate = 0.8 * self._estimate + 0.2 * duration
+                if self.metrics is not None:
+                    self.metrics.observe("postprocess.job", duration)
+            finally:
+                with self._condition:
+                    self._active.discard(job["path"])
+
+    def _run(self, args):
+        """Run a tool; it is stopped and continued with the window."""
+        process = subprocess.Popen(args, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        with self._condition:
+            self._processes.add(process)
+            if not self._running.is_set():
+                process.send_signal(signal.SIGSTOP)
+        try:
+            out, err = process.communicate()
+        finally:
+            with self._condition:
+                self._processes.discard(process)
+        self._checkpoint()
+        if process.returncode != 0:
+            raise RuntimeError(f"{os.path.basename(args[0])}: {err.decode(errors='replace').strip()[-200:]}")
+        return out.decode()
+
+    # --- steps
+
+    def _probe(self, path, framerate=None):
+        """(duration [s], frames) of the first video stream."""
+        out = self._run([self.ffprobe, "-v", "error", "-select_streams", "v:0", "-count_packets",
+                         "-show_entries", "stream=nb_read_packets:format=duration", "-of", "json", path])
+        info = json.loads(out)
+        frames = int(info["streams"][0]["nb_read_packets"]) if info.get("streams") else 0
+        duration = float(info.get("format", {}).get("duration") or frames / (framerate or self.framerate))
+        return duration, frames
+
+    def _remux(self, raw, target, framerate):
+        temporary = target + ".tmp.mp4"
+        self._run([self.ffmpeg, "-hide_banner", "-loglevel", "error", "-y", "-framerate", str(framerate),
+                   "-i", raw, "-c", "copy", "-movflags", "+faststart", temporary])
+        if self._probe(temporary)[1] == 0:
+            os.remove(temporary)
+            raise RuntimeError("remuxed file has no frames")
+        os.replace(temporary, target)  # a half-written file never looks finished
+
+    def _thumbnails(self, path, frames, target):
+        step = max(1, frames // self.thumbnails)
+        temporary = target + ".tmp.jpg"
+        self._run([self.ffmpeg, "-hide_banner", "-loglevel", "error", "-y", "-i", path,
+                   "-vf", f"select='not(mod(n\\,{step}))',scale={self.thumbnail_width}:-2,tile={self.thumbnails}x1",
+                   "-frames:v", "1", "-q:v", "5", temporary])
+        os.replace(temporary, target)
+
+    def _process(self, job):
+        path, base = job["path"], os.path.splitext(job["path"])[0]
+        record = {"kind": job["kind"], "source": os.path.basename(path)}
+        if job["kind"] == "video":
+            target = base + ".mp4"
+            framerate = job["metadata"].get("framerate") or self.framerate
+            if os.path.exists(path) and self.ffmpeg and self.ffprobe:
+                self._remux(path, target, framerate)
+                if not self.keep_raw:
+                    os.remove(path)
+            if not os.path.exists(target):
+                target = path  # no ffmpeg: the raw stream is the result
+            if not os.path.exists(target):
+                raise FileNotFoundError(path)
+            if self.ffprobe:
+                record["duration"], record["frames"] = self._probe(target, framerate)
+                if record["frames"] and self.ffmpeg:
+                    thumbnails = base + ".thumbs.jpg"
+                    self._thumbnails(target, record["frames"], thumbnails)
+                    record["thumbnails"] = os.path.basename(thumbnails)
+        else:
+            target = path
+            try:
+                import soundfile as sf
+                record["duration"] = sf.info(target).duration
+            except Exception:
+                pass  # duration is optional, the hash is not
+        self._checkpoint()
+        record["file"] = os.path.basename(target)
+        record["size"] = os.path.getsize(target)
+        record["sha256"] = sha256(target, self._checkpoint)
+        record.update(job["metadata"])
+        record["processed"] = round(self.clock.time(), 3)
+
+        sidecar = sidecar_path(target)
+        temporary = sidecar + ".tmp"
+        with open(temporary, "w") as file:
+            json.dump(record, file, indent=1)
+        os.replace(temporary, sidecar)
+        return record
+
+
+def verify(folder):
+    """Check every sidecar of `folder` against its file; returns (ok, mismatched, missing)."""
+    ok, mismatched, missing = 0, [], []
+    for name in sorted(os.listdir(folder)):
+        if not name.endswith(".json"):
+            continue
+        with open(os.path.join(folder, name)) as file:
+            record = json.load(file)
+        if "sha256" not in record or "evicted" in record:
+            continue  # not processed, or deleted to make room (see storage.py)
+        path = os.path.join(folder, record["file"])
+        if not os.path.exists(path):
+            missing.append(record["file"])
+        elif sha256(path) != record["sha256"]:
+            mismatched.append(record["file"])
+        else:
+            ok += 1
+    return ok, mismatched, missing
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Post-processing of recordings")
+    parser.add_argument("command", choices=("run", "verify", "pending"))
+    parser.add_argument("folders", nargs="+", help="recording folders, e.g. video recordings")
+    parser.add_argument("--journal", default="postprocess.jsonl")
+    parser.add_argument("--framerate", type=int, default=30)
+    parser.add_argument("--keep-raw", action="store_true")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+
+    if args.command == "verify":
+        # e.g. on a retrieved sd card
+        for folder in args.folders:
+            ok, mismatched, missing = verify(folder)
+            print(f"{folder}: {ok} ok, {len(mismatched)} mismatched, {len(missing)} missing")
+            for name in mismatched:
+                print(f"  mismatch: {name}")
+            for name in missing:
+                print(f"  missing: {name}")
+    elif args.command == "pending":
+        journal = Journal(args.journal)
+        for job in journal.pending():
+            print(f"{job['kind']:5s} {job['path']} ({journal.attempts.get(job['path'], 0)} failed attempts)")
+    else:
+        # process everything now, without window
+        processor = PostProcessor(args.journal, framerate=args.framerate, keep_raw=args.keep_raw, nice=0)
+        for folder in args.folders:
+            processor.recover(folder)
+        started = time.perf_counter()
+        processor.start()
+        processor.resume(float("inf"))
+        while processor.journal.pending():
+            time.sleep(0.1)
+        processor.shutdown()
+        print(f"{processor.processed} processed, {processor.failed} failed in {time.perf_counter() - started:.1f} s")
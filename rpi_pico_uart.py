@@ -1,5 +1,6 @@
 from machine import Pin, I2C, UART
 import time
+import struct
 
 # Define I2C bus (I2C1 on GP4 and GP5)
 i2c = I2C(0, scl=Pin(5), sda=Pin(4), freq=400000)
@@ -15,10 +16,30 @@ INA260_ADDR = 0x44 # I've bridged the corresponding address on the INA260 to cha
 # Since there were problems with access, with another I2C device
 
 # Register Addresses
+REG_CONFIG = 0x00
 REG_VOLTAGE = 0x02
 REG_CURRENT = 0x01
 REG_POWER = 0x03
 
+# Protocol sent to the rpi, has to match the protocol set in cst_main.py
+#   "text":   "voltage, current, power\n" about once per second
+#   "binary": framed min/mean/max of every window, see send_frame()
+PROTOCOL = "binary"
+
+# Binary mode: INA260 averaging and conversion time (datasheet table 6 and 7)
+# 4 averages x 588 us for voltage and current -> a new value about every 4.7 ms
+AVG_CODE = 1        # 0:1 1:4 2:16 3:64 4:128 5:256 6:512 7:1024 averages
+CT_CODE = 3         # 0:140us 1:204us 2:332us 3:588us 4:1.1ms 5:2.1ms 6:4.2ms 7:8.2ms
+SAMPLE_US = 5000    # sampling period, slightly longer than one conversion
+WINDOW_MS = 1000    # one frame per window
+
+# Frame: sync | version, seq, samples, window ms | voltage min/mean/max | current min/mean/max
+#        | power min/mean/max | crc16 (CCITT-FALSE over everything between sync and crc)
+# voltage in 1.25 mV, current in 1.25 mA (signed), power in 10 mW
+FRAME_SYNC = b"\xa5\x5a"
+FRAME_VERSION = 1
+FRAME_BODY = "<BHHH3H3h3H"
+
 # blink onboard led in different patterns
 def blink_led(times, delay=0.25):
     """Blink the onboard LED a specified number of times."""
@@ -32,17 +53,92 @@ def read_register(register):
     data = i2c.readfrom_mem(INA260_ADDR, register, 2)
     return int.from_bytes(data, 'big')
 
-while True:
-    try: 
-        voltage = read_register(REG_VOLTAGE) * 1.25 / 1000  # Convert to volts
-        current = read_register(REG_CURRENT) * 1.25 / 1000  # Convert to Amps
-        power = read_register(REG_POWER) * 10 / 1000  # Convert to Watts
-        print(f"Voltage: {voltage:.2f} V, Current: {current:.2f} A, Power: {power:.2f} W")
-        uart.write(f"{voltage:.2f}, {current:.2f}, {power:.2f}\n")
-        blink_led(1, 0.25) #one blink if successfull
-        time.sleep(0.75)
-        uart.flush()
-    except Exception as e:
-        print(f"Error occured: {e}")
-        blink_led(3, 0.25) # triple blink for error
-        time.sleep(1) # retry so that led blinks continuously
+# Write 16-bit data to a register
+def write_register(register, value):
+    i2c.writeto_mem(INA260_ADDR, register, bytes(((value >> 8) & 0xFF, value & 0xFF)))
+
+def crc16(data):
+    """CRC-16/CCITT-FALSE (poly 0x1021, init 0xFFFF)."""
+    crc = 0xFFFF
+    for byte in data:
+        crc ^= byte << 8
+        for _ in range(8):
+            if crc & 0x8000:
+                crc = ((crc << 1) ^ 0x1021) & 0xFFFF
+            else:
+                crc = (crc << 1) & 0xFFFF
+    return crc
+
+def send_frame(seq, count, window_ms, v_min, v_sum, v_max, i_min, i_sum, i_max, p_min, p_sum, p_max):
+    body = struct.pack(FRAME_BODY, FRAME_VERSION, seq, count, window_ms,
+                       v_min, (v_sum + count // 2) // count, v_max,
+                       i_min, round(i_sum / count), i_max,
+                       p_min, (p_sum + count // 2) // count, p_max)
+    uart.write(FRAME_SYNC + body + struct.pack("<H", crc16(body)))
+
+def run_text():
+    while True:
+        try:
+            voltage = read_register(REG_VOLTAGE) * 1.25 / 1000  # Convert to volts
+            current = read_register(REG_CURRENT) * 1.25 / 1000  # Convert to Amps
+            power = read_register(REG_POWER) * 10 / 1000  # Convert to Watts
+            print(f"Voltage: {voltage:.2f} V, Current: {current:.2f} A, Power: {power:.2f} W")
+            uart.write(f"{voltage:.2f}, {current:.2f}, {power:.2f}\n")
+            blink_led(1, 0.25) #one blink if successfull
+            time.sleep(0.75)
+            uart.flush()
+        except Exception as e:
+            print(f"Error occured: {e}")
+            blink_led(3, 0.25) # triple blink for error
+            time.sleep(1) # retry so that led blinks continuously
+
+def run_binary():
+    # continuous shunt and bus conversion with the chosen averaging
+    write_register(REG_CONFIG, 0x6000 | (AVG_CODE << 9) | (CT_CODE << 6) | (CT_CODE << 3) | 0b111)
+    buf = bytearray(2)  # reused for every read, no allocation in the sampling loop
+    seq = 0
+    while True:
+        try:
+            count = v_sum = i_sum = p_sum = 0
+            v_min = i_min = p_min = 0x7FFFFFFF
+            v_max = i_max = p_max = -0x7FFFFFFF
+            window_start = time.ticks_ms()
+            next_sample = time.ticks_us()
+            while time.ticks_diff(time.ticks_ms(), window_start) < WINDOW_MS:
+                i2c.readfrom_mem_into(INA260_ADDR, REG_VOLTAGE, buf)
+                v = (buf[0] << 8) | buf[1]
+                i2c.readfrom_mem_into(INA260_ADDR, REG_CURRENT, buf)
+                i = (buf[0] << 8) | buf[1]
+                if i & 0x8000:
+                    i -= 0x10000  # two's complement
+                # 1.25 mV * 1.25 mA = 1.5625 uW, 10 mW / 1.5625 uW = 6400
+                p = abs(v * i) // 6400
+                count += 1
+                v_sum += v
+                i_sum += i
+                p_sum += p
+                if v < v_min: v_min = v
+                if v > v_max: v_max = v
+                if i < i_min: i_min = i
+                if i > i_max: i_max = i
+                if p < p_min: p_min = p
+                if p > p_max: p_max = p
+                next_sample = time.ticks_add(next_sample, SAMPLE_US)
+                wait = time.ticks_diff(next_sample, time.ticks_us())
+                if wait > 0:
+                    time.sleep_us(wait)
+                else:
+                    next_sample = time.ticks_us()  # fell behind, do not try to catch up
+            send_frame(seq, count, time.ticks_diff(time.ticks_ms(), window_start),
+                       v_min, v_sum, v_max, i_min, i_sum, i_max, min(p_min, 0xFFFF), p_sum, min(p_max, 0xFFFF))
+            seq = (seq + 1) & 0xFFFF
+            led.toggle()  # toggles once per frame, no blocking blink
+        except Exception as e:
+            print(f"Error occured: {e}")
+            blink_led(3, 0.25) # triple blink for error
+            time.sleep(1)
+
+if PROTOCOL == "binary":
+    run_binary()
+else:
+    run_text()
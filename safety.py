@@ -0,0 +1,169 @@
+import os           # thread scheduling priority
+import sys          # exit code of the test harness
+import time         # detection timestamps
+import threading    # watchdog thread
+import logging      # event logging
+from collections import namedtuple
+
+# detected/acted are monotonic times; latency = acted - detected in seconds
+SafetyEvent = namedtuple("SafetyEvent", ["reason", "value", "detected", "acted", "latency"])
+
+
+class VoltageEvaluator:
+    """Decides on low voltage from individual samples, with debounce and hysteresis.
+
+    The evaluator trips after `debounce` consecutive samples at or below
+    `threshold`. A sample only clears the count once the voltage is back above
+    `threshold + hysteresis`, so noise around the threshold cannot keep
+    resetting it.
+    """
+
+    def __init__(self, threshold=10.5, hysteresis=0.2, debounce=3):
+        self.threshold = threshold
+        self.hysteresis = hysteresis
+        self.debounce = debounce
+        self._low = 0           # consecutive low samples
+        self._first_low = None  # arrival time of the first of them
+
+    def update(self, voltage, arrived):
+        """Feed one sample; returns the arrival time of the first low sample once tripped, else None."""
+        if voltage <= self.threshold:
+            if self._low == 0:
+                self._first_low = arrived
+            self._low += 1
+            if self._low >= self.debounce:
+                return self._first_low
+        elif voltage > self.threshold + self.hysteresis:
+            self._low = 0
+        return None
+
+
+class SafetyWatchdog(threading.Thread):
+    """Watches the leak sensor and the battery voltage and triggers the shutdown action.
+
+    The leak input is sampled every `poll_interval` seconds from this thread,
+    which asks for real-time scheduling when allowed. Voltage samples are pushed
+    in by `on_sample` (called from the UART ingest thread) and wake the watchdog
+    right away. `action(reason)` is called once for the first event; the time
+    from detection to that call is recorded for every event, on `clock`, which
+    has to be the clock of the sample timestamps.
+    """
+
+    def __init__(self, read_leak, action, stop_event, voltage=None, poll_interval=0.02, leak_debounce=2,
+                 realtime_priority=10, clock=time):
+        super().__init__(name="safety-watchdog", daemon=True)
+        self.read_leak = read_leak
+        self.action = action
+        self.stop_event = stop_event
+        self.voltage = voltage or VoltageEvaluator()
+        self.poll_interval = poll_interval
+        self.leak_debounce = leak_debounce
+        self.realtime_priority = realtime_priority
+        self.clock = clock
+        self.events = []
+        self.tripped = False
+
+        self._wake = threading.Event()
+        self._pending = None  # (reason, value, detected) handed over by on_sample
+        self._leak_count = 0
+        self._leak_first = None
+
+    def on_sample(self, sample):
+        """UART listener: evaluate the voltage of a new sample."""
+        detected = self.voltage.update(sample.voltage, sample.monotonic)
+        if detected is not None and self._pending is None and not self.tripped:
+            self._pending = ("Voltage treshold reached", sample.voltage, detected)
+            self._wake.set()
+
+    def _raise_priority(self):
+        if not self.realtime_priority:
+            return
+        try:
+            # pid 0 is the calling thread on linux
+            os.sched_setscheduler(0, os.SCHED_FIFO, os.sched_param(self.realtime_priority))
+        except (AttributeError, PermissionError, OSError) as e:
+            logging.info(f"[Safety] Running without real-time priority: {e}")
+
+    def _check_leak(self):
+        now = self.clock.monotonic()
+        if self.read_leak():
+            if self._leak_count == 0:
+                self._leak_first = now
+            self._leak_count += 1
+            if self._leak_count >= self.leak_debounce:
+                return ("Leak", True, self._leak_first)
+        else:
+            self._leak_count = 0
+        return None
+
+    def _trigger(self, reason, value, detected):
+        acted = self.clock.monotonic()
+        event = SafetyEvent(reason, value, detected, acted, acted - detected)
+        self.events.append(event)
+        logging.error(f"[Safety] {reason} ({value}), action after {event.latency * 1000:.1f} ms")
+        if not self.tripped:
+            self.tripped = True
+            self.action(reason)
+
+    def run(self):
+        self._raise_priority()
+        while not self.stop_event.is_set() and not self.tripped:
+            self._wake.wait(timeout=self.poll_interval)
+            self._wake.clear()
+            pending, self._pending = self._pending, None
+            if pending is not None:
+                self._trigger(*pending)
+                continue
+            leak = self._check_leak()
+            if leak is not None:
+                self._trigger(*leak)
+
+
+def measure_latencies(runs=20):
+    """Inject leak and low voltage events into a watchdog; returns the response latencies per reason."""
+    from uart_ingest import Sample
+
+    results = {"Leak": [], "Voltage treshold reached": []}
+    for run in range(runs):
+        leak = {"value": False}
+        done = threading.Event()
+        stop_event = threading.Event()
+        watchdog = SafetyWatchdog(lambda: leak["value"], lambda reason: done.set(), stop_event,
+                                  VoltageEvaluator(threshold=10.5, hysteresis=0.2, debounce=3), realtime_priority=0)
+        watchdog.start()
+        time.sleep(0.05)
+        if run % 2 == 0:
+            injected = time.monotonic()
+            leak["value"] = True
+        else:
+            # noisy voltage around the threshold, the third low sample trips the evaluator
+            for voltage in (10.6, 10.5, 10.6, 10.5, 10.4):
+                watchdog.on_sample(Sample(time.time(), time.monotonic(), voltage, 1.0, 10.0))
+                time.sleep(0.001)
+        done.wait(timeout=2)
+        stop_event.set()
+        watchdog.join()
+        event = watchdog.events[0]
+        # leak latency is measured from the injection, the watchdog cannot see the edge earlier
+        latency = event.acted - injected if event.reason == "Leak" else event.latency
+        results[event.reason].append(latency)
+    return results
+
+
+def run_harness(leak_bound=0.1, voltage_bound=0.01, runs=20):
+    """Inject leak and low voltage events into a watchdog and check the response latency."""
+    results = measure_latencies(runs)
+    failed = False
+    for reason, bound in (("Leak", leak_bound), ("Voltage treshold reached", voltage_bound)):
+        latencies = results[reason]
+        worst = max(latencies)
+        ok = worst <= bound
+        failed |= not ok
+        print(f"{reason}: {len(latencies)} events, mean {sum(latencies) / len(latencies) * 1000:.1f} ms, "
+              f"max {worst * 1000:.1f} ms (bound {bound * 1000:.0f} ms) {'OK' if ok else 'FAILED'}")
+    return not failed
+
+
+if __name__ == "__main__":
+    # usage: python3 safety.py  (injects leak/voltage events and checks the latency bounds)
+    sys.exit(0 if run_harness() else 1)
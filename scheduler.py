@@ -0,0 +1,190 @@
+import threading    # dispatcher thread
+import time         # monotonic clock, task durations
+import heapq        # timer queue
+import itertools    # insertion order for equal due times
+import logging      # error reporting
+from concurrent.futures import ThreadPoolExecutor   # worker pool for the actions
+
+
+class Task:
+    """Handle of a scheduled action, returned by `call_at`, `call_later` and `every`."""
+
+    def __init__(self, name, when, fn, args, period=None):
+        self.name = name
+        self.when = when        # next due time on the scheduler clock
+        self.fn = fn
+        self.args = args
+        self.period = period    # None for one-shot actions
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+
+class TaskStats:
+    """How late a task was started compared with its scheduled time."""
+
+    def __init__(self):
+        self.runs = 0
+        self.skipped = 0        # periodic runs dropped because the previous one was still busy
+        self.errors = 0
+        self.last_lateness = 0.0
+        self.max_lateness = 0.0
+        self.total_lateness = 0.0
+
+    def add(self, lateness):
+        self.runs += 1
+        self.last_lateness = lateness
+        self.max_lateness = max(self.max_lateness, lateness)
+        self.total_lateness += lateness
+
+    @property
+    def mean_lateness(self):
+        return self.total_lateness / self.runs if self.runs else 0.0
+
+
+class Scheduler:
+    """Drift-free timer queue on a monotonic clock.
+
+    One dispatcher thread waits for the next due action and hands it to a
+    small worker pool. `clock` may run faster than real time (simulation);
+    `timescale` is its speed in clock seconds per real second. Periodic tasks are rescheduled from their due time,
+    not from when they finished, so they do not drift, and a periodic task
+    never runs twice at the same time: a run that comes due while the
+    previous one is still busy is skipped and counted. With `metrics` (see
+    metrics.py) every run also records `task.<name>.lateness` (clock seconds)
+    and `task.<name>.duration` (real seconds).
+    """
+
+    def __init__(self, stop_event, workers=4, clock=time.monotonic, timescale=1.0, metrics=None):
+        self.stop_event = stop_event
+        self.clock = clock
+        self.timescale = timescale
+        self._heap = []  # (when, order, task)
+        self._order = itertools.count()
+        self._condition = threading.Condition()
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="task")
+        self._periodic = {}     # name -> Task, guarantees one periodic task per name
+        self._busy = set()      # names of periodic tasks currently running
+        self._thread = None
+        self.stats = {}         # name -> TaskStats
+        self.metrics = metrics
+
+    def now(self):
+        return self.clock()
+
+    def _push(self, task):
+        with self._condition:
+            heapq.heappush(self._heap, (task.when, next(self._order), task))
+            self._condition.notify()
+        return task
+
+    def call_at(self, when, fn, name, args=()):
+        """Run `fn(*args)` once at `when` (scheduler clock)."""
+        return self._push(Task(name, when, fn, args))
+
+    def call_later(self, delay, fn, name, args=()):
+        """Run `fn(*args)` once after `delay` seconds."""
+        return self.call_at(self.clock() + delay, fn, name, args)
+
+    def every(self, period, fn, name, args=(), first=None):
+        """Run `fn(*args)` every `period` seconds, starting at `first` (default: now)."""
+        with self._condition:
+            existing = self._periodic.get(name)
+            if existing is not None and not existing.cancelled:
+                raise ValueError(f"Periodic task already scheduled: {name}")
+            task = Task(name, self.clock() if first is None else first, fn, args, period)
+            self._periodic[name] = task
+        return self._push(task)
+
+    def _stats(self, name):
+        """TaskStats of `name`; call with `_condition` held, the workers update them concurrently."""
+        stats = self.stats.get(name)
+        if stats is None:
+            stats = self.stats[name] = TaskStats()
+        return stats
+
+    def _run(self, task, due):
+        lateness = self.clock() - due
+        with self._condition:
+            self._stats(task.name).add(lateness)
+        started = time.perf_counter()
+        try:
+            task.fn(*task.args)
+        except Exception as e:
+            with self._condition:
+                self._stats(task.name).errors += 1
+            if self.metrics is not None:
+                self.metrics.counter(f"task.{task.name}.errors").inc()
+            logging.error(f"[Scheduler] Task {task.name} failed: {e}")
+        finally:
+            if self.metrics is not None:
+                self.metrics.observe(f"task.{task.name}.lateness", lateness)
+                self.metrics.observe(f"task.{task.name}.duration", time.perf_counter() - started)
+            if task.period is not None:
+                with self._condition:
+                    self._busy.discard(task.name)
+
+    def _dispatch(self, task):
+        due = task.when
+        if task.period is not None:
+            with self._condition:
+                busy = task.name in self._busy
+                if not busy:
+                    self._busy.add(task.name)
+                # next run from the due time; skip periods that were missed entirely
+                now = self.clock()
+                task.when += task.period
+                if task.when <= now:
+                    task.when += ((now - task.when) // task.period + 1) * task.period
+                heapq.heappush(self._heap, (task.when, next(self._order), task))
+                if busy:
+                    self._stats(task.name).skipped += 1
+            if busy:
+                if self.metrics is not None:
+                    self.metrics.counter(f"task.{task.name}.skipped").inc()
+                return
+        self._executor.submit(self._run, task, due)
+
+    def run(self):
+        """Dispatcher loop, runs until the stop event is set."""
+        while not self.stop_event.is_set():
+            with self._condition:
+                while self._heap and self._heap[0][2].cancelled:
+                    heapq.heappop(self._heap)
+                if not self._heap:
+                    self._condition.wait(timeout=0.5)
+                    continue
+                delay = self._heap[0][0] - self.clock()
+                if delay > 0:
+                    # woken early by new tasks; at most 0.5 s to recheck stop_event
+                    self._condition.wait(timeout=min(delay / self.timescale, 0.5))
+                    continue
+                _, _, task = heapq.heappop(self._heap)
+            self._dispatch(task)
+
+    def start(self):
+        self._thread = threading.Thread(target=self.run, name="scheduler", daemon=True)
+        self._thread.start()
+
+    def shutdown(self, wait=True):
+        """Stop dispatching and wait for running actions to return."""
+        self.stop_event.set()
+        with self._condition:
+            self._heap.clear()
+            self._condition.notify()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join()
+        self._executor.shutdown(wait=wait, cancel_futures=True)
+
+    def report(self):
+        """One line per task with run count and lateness in milliseconds."""
+        lines = []
+        with self._condition:
+            items = sorted(self.stats.items())
+        for name, stats in items:
+            lines.append(
+                f"{name}: runs={stats.runs} skipped={stats.skipped} errors={stats.errors} "
+                f"late mean={stats.mean_lateness * 1000:.1f} ms max={stats.max_lateness * 1000:.1f} ms"
+            )
+        return lines
@@ -0,0 +1,167 @@
+import os           # output redirection
+import sys          # exit code
+import time         # cpu and real time
+import argparse     # command line interface
+import threading    # thread count, stop timer
+import contextlib   # silence the console output of the system
+import statistics   # cycle statistics
+
+from hal import ScaledClock, FakeDevices, read_rows
+from energy import SCHEDULES
+from cst_main import CameraSystem
+
+START = time.mktime(time.strptime("2025-03-01", "%Y-%m-%d"))  # simulated deployment start
+
+
+class ThreadSampler(threading.Thread):
+    """Samples the number of threads of the process every `interval` real seconds."""
+
+    def __init__(self, interval=0.1):
+        super().__init__(name="thread-sampler", daemon=True)
+        self.interval = interval
+        self.counts = []
+        self.stop_event = threading.Event()
+
+    def run(self):
+        while not self.stop_event.wait(self.interval):
+            self.counts.append(threading.active_count())
+
+
+def _quiet(enabled):
+    return contextlib.redirect_stdout(open(os.devnull, "w")) if enabled else contextlib.nullcontext()
+
+
+def _stop(system):
+    """Release the devices like a termination signal would (signal_handler ends with exit)."""
+    try:
+        system.signal_handler(None, None)
+    except SystemExit:
+        pass
+    system.log_pipeline.stop()
+
+
+def run(schedule, days, scale, rows=None, quiet=True):
+    """Run CameraSystem on fake devices for `days` simulated days; returns a dict of measurements."""
+    threads_before = threading.active_count()
+    clock = ScaledClock(scale, START)
+    devices = FakeDevices(clock, rows)
+    cycles = []  # (cpu time, thread count) at every cycle start
+    sampler = ThreadSampler()
+    with _quiet(quiet):
+        system = CameraSystem(schedule, devices, clock)
+        schedule_cycle = system.schedule_cycle
+
+        def timed_cycle(cycle_start, plan):
+            cycles.append((time.process_time(), threading.active_count()))
+            return schedule_cycle(cycle_start, plan)
+
+        system.schedule_cycle = timed_cycle
+        timer = threading.Thread(target=lambda: clock.wait(system.stop_event, days * 86400) or system.stop_event.set(),
+                                 daemon=True)
+        sampler.start()
+        started, cpu_started = time.monotonic(), time.process_time()
+        timer.start()
+        system.start()
+        elapsed, cpu = time.monotonic() - started, time.process_time() - cpu_started
+        simulated = clock.monotonic()
+        _stop(system)
+    sampler.stop_event.set()
+    sampler.join()
+    time.sleep(0.5)  # daemon threads notice the stop event
+    videos = len(os.listdir(os.path.join(devices.storage, "video")))
+    recordings = len(os.listdir(os.path.join(devices.storage, "recordings")))
+    devices.close()
+
+    cpu_per_cycle = [b[0] - a[0] for a, b in zip(cycles, cycles[1:])]
+    return {
+        "days": simulated / 86400,
+        "real": elapsed,
+        "cpu": cpu,
+        "cycles": len(cycles),
+        "cpu_per_cycle": cpu_per_cycle,
+        "threads": sampler.counts,
+        "threads_left": threading.active_count() - threads_before,
+        "lateness": {name: (stats.runs, stats.skipped, stats.mean_lateness / scale, stats.max_lateness / scale)
+                     for name, stats in system.scheduler.stats.items()},
+        "frames": system.uart_ingest.frames,
+        "gaps": system.uart_ingest.gaps,
+        "energy_wh": system.energy.used_wh,
+        "videos": videos,
+        "recordings": recordings,
+    }
+
+
+def emergency(kind, schedule, delay=2.0, quiet=True):
+    """Inject a leak or a low voltage after `delay` s in real time; returns (to shutdown command, to stopped)."""
+    clock = ScaledClock(1.0, START)
+    devices = FakeDevices(clock)
+    with _quiet(quiet):
+        system = CameraSystem(schedule, devices, clock)
+
+        def inject():
+            time.sleep(delay)
+            inject.time = clock.monotonic()
+            if kind == "leak":
+                devices.pins["D16"].value = True
+            else:
+                devices.serial.voltage = 10.0
+
+        injector = threading.Thread(target=inject, daemon=True)
+        injector.start()
+        system.start()
+        stopped = clock.monotonic()
+        system.log_pipeline.stop()
+    devices.close()
+    if not devices.shutdowns:
+        return None, None
+    return devices.shutdowns[0] - inject.time, stopped - inject.time
+
+
+def benchmark(days, scale, rows=None, emergencies=3):
+    schedule = dict(SCHEDULES["p"], target_days=None)  # configured schedule, no energy policy
+    result = run(schedule, days, scale, rows)
+    per_cycle = result["cpu_per_cycle"]
+    print(f"{result['days']:.2f} days at {scale:g}x in {result['real']:.1f} s real, {result['cycles']} cycles, "
+          f"{result['videos']} videos, {result['recordings']} audio files, "
+          f"{result['frames']} uart frames ({result['gaps']} lost), {result['energy_wh']:.0f} Wh booked")
+    if per_cycle:
+        print(f"cpu per cycle: mean {statistics.mean(per_cycle) * 1000:.0f} ms, "
+              f"max {max(per_cycle) * 1000:.0f} ms (total {result['cpu']:.1f} s)")
+    threads = result["threads"]
+    if threads:
+        print(f"threads: min {min(threads)}, max {max(threads)}, last {threads[-1]}, "
+              f"{result['threads_left']} left after stop")
+    print("scheduling lateness in real time (clock lateness / scale):")
+    for name, (runs, skipped, mean, worst) in sorted(result["lateness"].items()):
+        print(f"  {name}: runs={runs} skipped={skipped} mean={mean * 1000:.2f} ms max={worst * 1000:.2f} ms")
+
+    for kind in ("leak", "voltage"):
+        latencies = [emergency(kind, schedule) for _ in range(emergencies)]
+        missing = sum(1 for command, _ in latencies if command is None)
+        latencies = [latency for latency in latencies if latency[0] is not None]
+        if not latencies:
+            print(f"{kind}: no shutdown")
+            continue
+        print(f"{kind}: injection -> shutdown command max {max(l[0] for l in latencies) * 1000:.0f} ms, "
+              f"-> main loop stopped max {max(l[1] for l in latencies) * 1000:.0f} ms"
+              + (" (3 sample debounce at one frame per second)" if kind == "voltage" else "")
+              + (f", {missing} runs without shutdown" if missing else ""))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the monitoring unit on simulated hardware")
+    parser.add_argument("command", choices=("run", "bench"))
+    parser.add_argument("--days", type=float, default=2.0)
+    parser.add_argument("--scale", type=float, default=20000.0, help="simulated seconds per real second")
+    parser.add_argument("--mode", choices=sorted(SCHEDULES), default="p")
+    parser.add_argument("--trace", help="telemetry csv replayed as pico frames")
+    parser.add_argument("--motion", action="store_true", help="motion-triggered instead of fixed length videos")
+    args = parser.parse_args()
+
+    rows = read_rows(args.trace) if args.trace else None
+    if args.command == "bench":
+        benchmark(args.days, args.scale, rows)
+    else:
+        result = run(dict(SCHEDULES[args.mode], target_days=None, motion_video=args.motion), args.days, args.scale, rows, quiet=False)
+        print(f"[System] {result['cycles']} cycles in {result['real']:.1f} s, cpu {result['cpu']:.1f} s")
+    sys.exit(0)
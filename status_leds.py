@@ -0,0 +1,100 @@
+import threading    # controller runs in its own thread
+import heapq        # prioritized pattern queue
+import itertools    # insertion order for equal priorities
+import logging      # error reporting
+from collections import namedtuple
+
+# A pattern is a named sequence of steps; every step is (leds that are on, seconds)
+LedPattern = namedtuple("LedPattern", ["name", "steps"])
+
+# Lower numbers are played first and interrupt running patterns with a higher number
+PRIORITY_ERROR = 0
+PRIORITY_STATUS = 5
+PRIORITY_HEARTBEAT = 9
+
+
+def blink(name, leds, times=1, on_duration=0.2, off_duration=0.2):
+    """Blink `leds` together `times` times."""
+    leds = tuple(leds)
+    return LedPattern(name, ((leds, on_duration), ((), off_duration)) * times)
+
+
+def heartbeat(led):
+    """Short single flash that shows the system is alive."""
+    return LedPattern("heartbeat", (((led,), 0.05), ((), 0.2)))
+
+
+def error_code(leds, code, on_duration=0.3, off_duration=0.3, pause=1.5):
+    """Blink `code` times, followed by a pause so repeated codes can be counted."""
+    pattern = blink(f"error-{code}", leds, code, on_duration, off_duration)
+    return LedPattern(pattern.name, pattern.steps + (((), pause),))
+
+
+class LedController(threading.Thread):
+    """Owns the status LEDs and plays queued patterns from a single timing loop.
+
+    `post` only queues a pattern and returns immediately. Patterns that are
+    already waiting under the same name are not queued twice, so a fast caller
+    cannot build up a backlog of blinks.
+    """
+
+    def __init__(self, leds, stop_event):
+        super().__init__(name="status-leds", daemon=True)
+        self.leds = list(leds)
+        self.stop_event = stop_event
+        self._condition = threading.Condition()
+        self._queue = []  # heap of (priority, order, pattern)
+        self._order = itertools.count()
+        self._queued = set()  # names of waiting patterns
+
+    def post(self, pattern, priority=PRIORITY_STATUS):
+        """Queue a pattern; returns False if the same pattern is already waiting."""
+        with self._condition:
+            if pattern.name in self._queued:
+                return False
+            self._queued.add(pattern.name)
+            heapq.heappush(self._queue, (priority, next(self._order), pattern))
+            self._condition.notify()
+        return True
+
+    def clear(self):
+        """Drop all waiting patterns."""
+        with self._condition:
+            self._queue.clear()
+            self._queued.clear()
+
+    def _next(self):
+        with self._condition:
+            while not self._queue and not self.stop_event.is_set():
+                self._condition.wait(timeout=0.5)  # recheck stop_event regularly
+            if not self._queue:
+                return None, None
+            priority, _, pattern = heapq.heappop(self._queue)
+            self._queued.discard(pattern.name)
+            return priority, pattern
+
+    def _preempted(self, priority):
+        with self._condition:
+            return bool(self._queue) and self._queue[0][0] < priority
+
+    def _show(self, on):
+        for led in self.leds:
+            led.value = led in on
+
+    def run(self):
+        try:
+            while not self.stop_event.is_set():
+                priority, pattern = self._next()
+                if pattern is None:
+                    continue
+                for on, duration in pattern.steps:
+                    if self._preempted(priority):
+                        break
+                    self._show(on)
+                    if self.stop_event.wait(timeout=duration):
+                        break
+                self._show(())
+        except Exception as e:
+            logging.error(f"[LED] Status LED controller stopped: {e}")
+        finally:
+            self._show(())  # leave all LEDs off
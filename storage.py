@@ -0,0 +1,423 @@
+import os           # file sizes, removal
+import re           # timestamps in file names
+import json         # sidecars of evicted recordings
+import time         # default clock, file name timestamps
+import shutil       # free disk space
+import logging      # event logging
+import sqlite3      # file catalog
+import argparse     # command line interface
+import threading    # the catalog is used from scheduler and post-processing threads
+
+from postprocess import sidecar_path, VIDEO_SUFFIXES, AUDIO_SUFFIXES  # sidecars of processed recordings
+from acoustic_features import FEATURE_SUFFIX  # feature files next to the audio recordings
+
+# folder below the storage root -> kind of the files in it
+FOLDERS = {"video": "video", "recordings": "audio", "data": "telemetry"}
+RECORDINGS = ("video", "audio")  # kinds that may be evicted, telemetry is always kept
+SUFFIXES = {"video": VIDEO_SUFFIXES + (".mp4",), "audio": AUDIO_SUFFIXES}
+TIMESTAMP = re.compile(r"\d{4}-\d{2}-\d{2}(--\d{2}-\d{2}-\d{2})?")
+# bytes per second of a recording, until the catalog knows better (800 kbit/s video, stereo flac)
+DEFAULT_RATES = {"video": 100e3, "audio": 250e3}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,  -- relative to the storage root
+    kind TEXT NOT NULL,     -- video, audio or telemetry
+    start REAL,             -- recording start / first entry, wall clock
+    end REAL,               -- recording end / last modification
+    size INTEGER NOT NULL,  -- bytes on disk including sidecar, thumbnails and features
+    score REAL,             -- activity 0..1, NULL if unknown
+    cycle INTEGER,
+    state TEXT NOT NULL     -- pending (not post-processed), stored or evicted
+);
+CREATE INDEX IF NOT EXISTS files_time ON files (kind, start);
+CREATE INDEX IF NOT EXISTS files_score ON files (kind, score);
+CREATE INDEX IF NOT EXISTS files_state ON files (state, kind, start);
+"""
+FIELDS = ("path", "kind", "start", "end", "size", "score", "cycle", "state")
+
+
+def companions(path):
+    """Files that belong to a recording: sidecar, thumbnails and acoustic features."""
+    base = os.path.splitext(path)[0]
+    return (sidecar_path(path), base + ".thumbs.jpg", base + FEATURE_SUFFIX)
+
+
+def footprint(path):
+    """Bytes of a recording and its companion files that exist."""
+    return sum(os.path.getsize(name) for name in (path,) + companions(path) if os.path.exists(name))
+
+
+def name_time(name, default=None):
+    """Wall clock time in a file name like 2025-03-01--12-00-00_d40.h264 or data_2025-03-01.bin."""
+    match = TIMESTAMP.search(name)
+    if match is None:
+        return default
+    layout = "%Y-%m-%d--%H-%M-%S" if match.group(1) else "%Y-%m-%d"
+    return time.mktime(time.strptime(match.group(0), layout))
+
+
+def is_recording(name, kind):
+    """False for companion files next to the recordings."""
+    return name.endswith(SUFFIXES.get(kind, ()))
+
+
+def is_catalogued(name, kind):
+    """Recordings, and telemetry files with a date in their name (daily segments, rollups, metrics).
+
+    The state files next to them (catalog, queues, journal, energy state, index) are
+    rewritten all the time and are neither catalogued, evicted nor uploaded.
+    """
+    if ".tmp" in name:
+        return False
+    if kind == "telemetry":
+        return TIMESTAMP.search(name) is not None
+    return is_recording(name, kind)
+
+
+class Catalog:
+    """SQLite index of every recording and telemetry file below the storage root.
+
+    Queries by time range, score or state use the indexes instead of listing
+    the folders. Paths are stored relative to the storage root, so a catalog
+    on a retrieved card can be queried from any mount point.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.row_factory = sqlite3.Row
+        self._db.execute("PRAGMA journal_mode=WAL")     # readers do not block the writer
+        self._db.execute("PRAGMA synchronous=NORMAL")   # fewer flushes of the sd card
+        self._db.executescript(SCHEMA)
+
+    def _execute(self, sql, parameters=()):
+        with self._lock:
+            if self._db is None:
+                return []  # closed: late callbacks are dropped, sync finds their files at the next start
+            with self._db:
+                return self._db.execute(sql, parameters).fetchall()
+
+    def put(self, path, kind, start, end, size, score=None, cycle=None, state="stored"):
+        self._execute(f"INSERT OR REPLACE INTO files ({', '.join(FIELDS)}) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                      (path, kind, start, end, size, score, cycle, state))
+
+    def update(self, path, **values):
+        assignments = ", ".join(f"{name} = ?" for name in values)
+        self._execute(f"UPDATE files SET {assignments} WHERE path = ?", tuple(values.values()) + (path,))
+
+    def rename(self, path, new_path, **values):
+        """A recording replaced by its processed file (e.g. .h264 -> .mp4)."""
+        assignments = "".join(f", {name} = ?" for name in values)
+        with self._lock:
+            if self._db is None:
+                return
+            with self._db:
+                self._db.execute("DELETE FROM files WHERE path = ? AND ? != ?", (new_path, path, new_path))
+                self._db.execute(f"UPDATE files SET path = ?{assignments} WHERE path = ?",
+                                 (new_path,) + tuple(values.values()) + (path,))
+
+    def remove(self, path):
+        self._execute("DELETE FROM files WHERE path = ?", (path,))
+
+    def get(self, path):
+        rows = self._execute("SELECT * FROM files WHERE path = ?", (path,))
+        return dict(rows[0]) if rows else None
+
+    def paths(self, kind):
+        """path -> (size, end) of every file of `kind` that was not evicted."""
+        rows = self._execute("SELECT path, size, end FROM files WHERE kind = ? AND state != 'evicted'", (kind,))
+        return {row["path"]: (row["size"], row["end"]) for row in rows}
+
+    def query(self, start=None, end=None, kind=None, min_score=None, state=None, order="start", limit=None):
+        """Files overlapping [start, end), optionally by kind, minimum score and state."""
+        where, parameters = [], []
+        if start is not None:
+            where.append("end >= ?")
+            parameters.append(start)
+        if end is not None:
+            where.append("start < ?")
+            parameters.append(end)
+        for column, value in (("kind", kind), ("state", state)):
+            if value is not None:
+                where.append(f"{column} = ?")
+                parameters.append(value)
+        if min_score is not None:
+            where.append("score >= ?")
+            parameters.append(min_score)
+        sql = "SELECT * FROM files" + (" WHERE " + " AND ".join(where) if where else "")
+        sql += " ORDER BY score DESC, start" if order == "score" else " ORDER BY start"
+        if limit is not None:
+            sql += f" LIMIT {int(limit)}"
+        return [dict(row) for row in self._execute(sql, parameters)]
+
+    def usage(self):
+        """kind -> bytes of all files that were not evicted."""
+        rows = self._execute("SELECT kind, SUM(size) AS size FROM files WHERE state != 'evicted' GROUP BY kind")
+        return {row["kind"]: row["size"] or 0 for row in rows}
+
+    def rate(self, kind, recent=20):
+        """Mean bytes per second of the `recent` last recordings of `kind`, None without any."""
+        rows = self._execute("SELECT SUM(size) AS size, SUM(end - start) AS seconds FROM ("
+                             " SELECT size, start, end FROM files WHERE kind = ? AND state != 'evicted'"
+                             " AND end > start ORDER BY start DESC LIMIT ?)", (kind, recent))
+        size, seconds = rows[0]["size"], rows[0]["seconds"]
+        return size / seconds if seconds else None
+
+    def growth(self, kind="telemetry"):
+        """Bytes per second that the files of `kind` grew over their time span, None if unknown."""
+        rows = self._execute("SELECT SUM(size) AS size, MIN(start) AS first, MAX(end) AS last FROM files"
+                             " WHERE kind = ?", (kind,))
+        size, first, last = rows[0]["size"], rows[0]["first"], rows[0]["last"]
+        return size / (last - first) if size and last and first and last > first else None
+
+    def eviction_candidates(self, now, empty_score, thin_after, thin_interval):
+        """Stored recordings in the order they are given up.
+
+        1. empty: recordings scored below `empty_score`, lowest score first
+        2. thinned: recordings older than `thin_after` seconds except the best
+           of each `thin_interval` (highest score, else the first), oldest first
+        3. oldest: everything else, oldest first
+        Telemetry and recordings that are not post-processed yet are never evicted.
+        """
+        kinds = ", ".join(f"'{kind}'" for kind in RECORDINGS)
+        stored = f"state = 'stored' AND kind IN ({kinds})"
+        yield from self._execute(f"SELECT * FROM files WHERE {stored} AND score < ? ORDER BY score, start",
+                                 (empty_score,))
+        yield from self._execute(
+            f"SELECT * FROM (SELECT *, ROW_NUMBER() OVER (PARTITION BY kind, CAST(start / ? AS INTEGER)"
+            f" ORDER BY score IS NULL, score DESC, start) AS rank FROM files WHERE {stored} AND start < ?)"
+            f" WHERE rank > 1 ORDER BY start", (thin_interval, now - thin_after))
+        yield from self._execute(f"SELECT * FROM files WHERE {stored} ORDER BY start")
+
+    def close(self):
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+
+class StorageManager:
+    """Keeps the recordings within a disk budget and knows where every file is.
+
+    Recordings are registered when they are finished and updated once they are
+    post-processed; dated telemetry files are picked up from the data folder
+    before every cycle. `check(schedule)` predicts the space the next
+    cycle needs from the recent recordings and evicts recordings (see
+    Catalog.eviction_candidates) until it fits into the budget and leaves
+    `reserve` bytes free; if it still does not fit, the cycle records no video
+    (and if need be no audio). Evicted recordings keep their sidecar and
+    features, marked as evicted, and their catalog entry.
+    """
+
+    def __init__(self, storage, budget=None, reserve=256 * 2 ** 20, empty_score=0.05, thin_after=7 * 86400,
+                 thin_interval=6 * 3600, margin=1.2, catalog_path=None, clock=time, metrics=None):
+        self.storage = storage
+        self.budget = budget            # bytes for all files below the storage root, None: the whole card
+        self.reserve = reserve          # bytes kept free on the card in any case
+        self.empty_score = empty_score
+        self.thin_after = thin_after
+        self.thin_interval = thin_interval
+        self.margin = margin            # prediction safety factor
+        self.clock = clock
+        self.metrics = metrics
+        self.catalog = Catalog(catalog_path or os.path.join(storage, "data", "catalog.sqlite"))
+        self.evicted = 0
+
+    def _relative(self, path):
+        return os.path.relpath(path, self.storage)
+
+    def _absolute(self, path):
+        return os.path.join(self.storage, path)
+
+    # --- registration
+
+    def register(self, paths, start, end, scores=None, cycle=None):
+        """The files of a finished recording from `start` to `end`, not post-processed yet.
+
+        Each file starts at the time in its name (chunks, segments) and ends where the next one starts.
+        """
+        starts = [name_time(os.path.basename(path), start) for path in paths]
+        for path, first, last in zip(paths, starts, starts[1:] + [end]):
+            kind = "video" if path.endswith(SUFFIXES["video"]) else "audio"
+            self.catalog.put(self._relative(path), kind, max(first, start), last, footprint(path),
+                             (scores or {}).get(path), cycle, "pending")
+
+    def processed(self, job, record):
+        """Post-processing callback: the recording is stored under its final name."""
+        path = self._relative(job["path"])
+        final = os.path.join(os.path.dirname(job["path"]), record["file"])
+        self.catalog.rename(path, self._relative(final), size=footprint(final), state="stored")
+        if self.catalog.get(self._relative(final)) is None:
+            # not registered before, e.g. recovered from an earlier run
+            start, end = record.get("recorded") or (name_time(record["file"]), record.get("processed"))
+            kind = "video" if record["kind"] == "video" else "audio"
+            self.catalog.put(self._relative(final), kind, start, end, footprint(final), record.get("score"),
+                             record.get("cycle"), "stored")
+
+    def scored(self, path, score):
+        """Activity score known after the recording (e.g. from the acoustic features)."""
+        self.catalog.update(self._relative(path), score=score, size=footprint(path))
+
+    def sync(self, kinds=None):
+        """Reconcile the catalog with the folders, e.g. at startup or after files were copied by hand.
+
+        Returns the number of added, updated and removed entries.
+        """
+        added = updated = removed = 0
+        for folder, kind in FOLDERS.items():
+            if kinds is not None and kind not in kinds:
+                continue
+            directory = self._absolute(folder)
+            if not os.path.isdir(directory):
+                continue
+            known = {path: entry for path, entry in self.catalog.paths(kind).items()
+                     if os.path.dirname(path) == folder}
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    if not is_catalogued(entry.name, kind):
+                        continue
+                    path = os.path.join(folder, entry.name)
+                    try:
+                        if not entry.is_file():
+                            continue
+                        stat = entry.stat()
+                        size = stat.st_size if kind == "telemetry" else footprint(entry.path)
+                    except FileNotFoundError:
+                        continue  # replaced or removed meanwhile
+                    end = stat.st_mtime
+                    if path not in known:
+                        state = "pending" if kind != "telemetry" and not os.path.exists(sidecar_path(entry.path)) \
+                            else "stored"
+                        self.catalog.put(path, kind, name_time(entry.name, end), end, size, state=state)
+                        added += 1
+                    elif known.pop(path)[0] != size:
+                        # a telemetry file ends with its last write, a recording only gained companion files
+                        self.catalog.update(path, size=size, **({"end": end} if kind == "telemetry" else {}))
+                        updated += 1
+            for path in known:  # removed by hand
+                self.catalog.remove(path)
+                removed += 1
+        return added, updated, removed
+
+    # --- budget
+
+    def free(self):
+        return shutil.disk_usage(self.storage).free
+
+    def used(self):
+        return sum(self.catalog.usage().values())
+
+    def predict(self, schedule):
+        """Bytes the cycle of `schedule` is expected to write."""
+        needed = 0.0
+        for kind in RECORDINGS:
+            rate = self.catalog.rate(kind) or DEFAULT_RATES[kind]
+            needed += rate * schedule.get(f"{kind}_duration", 0)
+        needed += (self.catalog.growth() or 0.0) * schedule["interval"]
+        return int(needed * self.margin)
+
+    def _shortfall(self, needed, free, used):
+        """Bytes missing for `needed` more bytes, 0 if they fit."""
+        missing = self.reserve + needed - free
+        if self.budget is not None:
+            missing = max(missing, used + needed - self.budget)
+        return max(0, missing)
+
+    def ensure(self, needed):
+        """Evict recordings until `needed` bytes fit; returns whether they do."""
+        free, used = self.free(), self.used()
+        missing = self._shortfall(needed, free, used)
+        if not missing:
+            return True
+        freed, count = 0, 0
+        for row in self.catalog.eviction_candidates(self.clock.time(), self.empty_score, self.thin_after,
+                                                    self.thin_interval):
+            if freed >= missing:
+                break
+            freed += self.evict(dict(row))
+            count += 1
+        if count:
+            logging.warning(f"[Storage] Evicted {count} recordings, {freed / 2 ** 20:.1f} MB freed")
+        return freed >= missing
+
+    def evict(self, row):
+        """Delete a recording and its thumbnails; returns the bytes freed."""
+        if row["kind"] not in RECORDINGS:
+            raise ValueError(f"Only recordings are evicted, not {row['path']}")
+        path = self._absolute(row["path"])
+        for name in (path, os.path.splitext(path)[0] + ".thumbs.jpg"):
+            if os.path.exists(name):
+                os.remove(name)
+        sidecar = sidecar_path(path)
+        if os.path.exists(sidecar):
+            # the sidecar stays as a record of what was recorded
+            with open(sidecar) as file:
+                record = json.load(file)
+            record["evicted"] = round(self.clock.time(), 3)
+            with open(sidecar + ".tmp", "w") as file:
+                json.dump(record, file, indent=1)
+            os.replace(sidecar + ".tmp", sidecar)
+        size = footprint(path)
+        self.catalog.update(row["path"], state="evicted", size=size)
+        self.evicted += 1
+        if self.metrics is not None:
+            self.metrics.counter(f"storage.evicted.{row['kind']}").inc()
+        return row["size"] - size
+
+    def check(self, schedule):
+        """Make room for the cycle of `schedule`; returns the schedule that fits (without video/audio if not)."""
+        self.sync(kinds=("telemetry",))
+        needed = self.predict(schedule)
+        if self.metrics is not None:
+            self.metrics.gauge("storage.predicted").set(needed)
+        if self.ensure(needed):
+            return schedule
+        # the light is only needed for the video
+        for label, dropped in (("video", ("video", "light")), ("video and audio", ("video", "light", "audio"))):
+            reduced = dict(schedule, **{f"{name}_duration": 0 for name in dropped})
+            if self.ensure(self.predict(reduced)):
+                break
+        logging.error(f"[Storage] Not enough space for the next cycle, recording without {label}")
+        if self.metrics is not None:
+            self.metrics.counter("storage.reduced_cycles").inc()
+        return reduced
+
+    def close(self):
+        self.catalog.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Recording catalog of a storage folder")
+    parser.add_argument("command", choices=("sync", "usage", "query"))
+    parser.add_argument("storage", help="storage root with the video, recordings, data and error folders")
+    parser.add_argument("--start", help="e.g. 2025-03-01 or 2025-03-01--12-00-00")
+    parser.add_argument("--end")
+    parser.add_argument("--kind", choices=("video", "audio", "telemetry"))
+    parser.add_argument("--min-score", type=float)
+    parser.add_argument("--state", choices=("pending", "stored", "evicted"))
+    parser.add_argument("--by-score", action="store_true", help="highest score first")
+    parser.add_argument("--limit", type=int)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+
+    manager = StorageManager(args.storage)
+    if args.command == "sync":
+        added, updated, removed = manager.sync()
+        print(f"{added} added, {updated} updated, {removed} removed")
+    elif args.command == "usage":
+        for kind, size in sorted(manager.catalog.usage().items()):
+            print(f"{kind:10s} {size / 2 ** 20:10.1f} MB")
+        print(f"{'free':10s} {manager.free() / 2 ** 20:10.1f} MB")
+    else:
+        started = time.perf_counter()
+        rows = manager.catalog.query(name_time(args.start) if args.start else None,
+                                     name_time(args.end) if args.end else None, args.kind, args.min_score,
+                                     args.state, "score" if args.by_score else "start", args.limit)
+        for row in rows:
+            score = f"{row['score']:.3f}" if row["score"] is not None else "-"
+            print(f"{time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(row['start']))} {row['kind']:9s} "
+                  f"{row['state']:7s} {score:>6s} {row['size'] / 1024:9.1f} kB {row['path']}")
+        print(f"{len(rows)} files in {(time.perf_counter() - started) * 1000:.1f} ms")
+    manager.close()
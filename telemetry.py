@@ -0,0 +1,207 @@
+import os           # filepath generation and fsync
+import sys          # command line arguments
+import time         # timestamps for segment names and flush policy
+import math         # NaN handling for missing values
+import struct       # fixed-width binary records
+import threading    # writer is shared between sensor threads
+import glob         # segment discovery for the exporter
+import csv          # csv export of binary segments
+
+# Segment layout:
+#   header  = MAGIC | version (u8) | field count (u8) | name length (u16) | comma separated field names
+#   records = time as float64 followed by one float32 per remaining field (NaN for missing values)
+MAGIC = b"SSTL"
+VERSION = 1
+SENSOR_FIELDS = ("time", "voltage", "current", "power", "temperature", "current_max")
+
+
+def record_format(fields):
+    """Struct format of a single record for the given fields."""
+    return "<d" + "f" * (len(fields) - 1)
+
+
+def segment_header(fields):
+    """Build the header that is written at the start of every segment."""
+    names = ",".join(fields).encode("ascii")
+    return MAGIC + struct.pack("<BBH", VERSION, len(fields), len(names)) + names
+
+
+class TelemetryWriter:
+    """Buffered, append-only writer for fixed-width binary telemetry segments.
+
+    Rows are kept in memory and written in one batch once `max_rows` rows are
+    pending or the oldest pending row is older than `max_age` seconds. Every
+    batch is followed by an fsync so that a flushed row survives a power cut.
+    Segments rotate per day (`rotate="day"`) or per cycle (`rotate="cycle"`);
+    `suffix` is appended to the segment names, e.g. to keep imported rows apart.
+    """
+
+    def __init__(self, directory, prefix="data", fields=SENSOR_FIELDS, max_rows=64, max_age=300.0, rotate="day",
+                 suffix=""):
+        if rotate not in ("day", "cycle"):
+            raise ValueError(f"Unknown rotation policy: {rotate}")
+        self.directory = directory
+        self.prefix = prefix
+        self.fields = tuple(fields)
+        self.max_rows = max_rows
+        self.max_age = max_age
+        self.rotate = rotate
+        self.suffix = suffix
+
+        self._struct = struct.Struct(record_format(self.fields))
+        self._header = segment_header(self.fields)
+        self._lock = threading.Lock()
+        self._pending = []          # packed records waiting for the next flush
+        self._pending_since = None  # monotonic time of the oldest pending record
+        self._file = None
+        self._segment = None        # name of the segment the file handle points to
+        self.path = None
+        self.rows_written = 0
+
+        os.makedirs(self.directory, exist_ok=True)
+
+    def _segment_name(self, timestamp):
+        if self.rotate == "day":
+            return time.strftime("%Y-%m-%d", time.localtime(timestamp))
+        return time.strftime("%Y-%m-%d--%H-%M-%S", time.localtime(timestamp))
+
+    def _open(self, segment):
+        """Open (or reopen after a reboot) the segment file for appending."""
+        self._close_file()
+        base = os.path.join(self.directory, f"{self.prefix}_{segment}{self.suffix}")
+        path, suffix = f"{base}.bin", 0
+        # never append to a segment written with a different layout
+        while os.path.exists(path) and os.path.getsize(path) > 0:
+            with open(path, "rb") as existing:
+                if existing.read(len(self._header)) == self._header:
+                    break
+            suffix += 1
+            path = f"{base}_{suffix}.bin"
+
+        if os.path.exists(path):
+            # a power cut can leave a torn record at the end: cut it off, or every
+            # appended record would be read shifted by its length
+            size = os.path.getsize(path)
+            whole = len(self._header) + max(0, size - len(self._header)) // self._struct.size * self._struct.size
+            if 0 < whole < size:
+                os.truncate(path, whole)
+        self._file = open(path, "ab")
+        if self._file.tell() == 0:
+            self._file.write(self._header)
+        self._segment = segment
+        self.path = path
+
+    def _close_file(self):
+        if self._file is not None:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._file.close()
+            self._file = None
+
+    def _flush_locked(self):
+        if not self._pending:
+            return
+        if self._file is None:
+            self._open(self._segment or self._segment_name(time.time()))
+        self._file.write(b"".join(self._pending))
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self.rows_written += len(self._pending)
+        self._pending = []
+        self._pending_since = None
+
+    def write(self, row):
+        """Queue a row (sequence matching `fields`); None values are stored as NaN."""
+        values = [math.nan if value is None else value for value in row]
+        record = self._struct.pack(*values)
+        with self._lock:
+            if self.rotate == "day":
+                segment = self._segment_name(values[0])
+                if segment != self._segment:
+                    # rows of the previous day go to the previous segment
+                    self._flush_locked()
+                    self._close_file()
+                    self._segment = segment
+            self._pending.append(record)
+            if self._pending_since is None:
+                self._pending_since = time.monotonic()
+            if len(self._pending) >= self.max_rows or time.monotonic() - self._pending_since >= self.max_age:
+                self._flush_locked()
+
+    def new_cycle(self):
+        """Start a new segment if the writer rotates per cycle."""
+        if self.rotate != "cycle":
+            return
+        with self._lock:
+            self._flush_locked()
+            self._close_file()
+            self._segment = self._segment_name(time.time())
+
+    def flush(self):
+        """Write and fsync all pending rows."""
+        with self._lock:
+            self._flush_locked()
+
+    def close(self):
+        """Flush pending rows and release the file handle."""
+        with self._lock:
+            self._flush_locked()
+            self._close_file()
+
+
+def read_header(file):
+    """Parse a segment header and return the field names."""
+    magic = file.read(len(MAGIC))
+    if magic != MAGIC:
+        raise ValueError("Not a telemetry segment")
+    version, count, length = struct.unpack("<BBH", file.read(4))
+    if version != VERSION:
+        raise ValueError(f"Unsupported segment version: {version}")
+    fields = tuple(file.read(length).decode("ascii").split(","))
+    if len(fields) != count:
+        raise ValueError("Corrupt segment header")
+    return fields
+
+
+def read_segment(path):
+    """Return (fields, rows) of a segment; NaN values are returned as None."""
+    with open(path, "rb") as file:
+        fields = read_header(file)
+        data = file.read()
+    layout = struct.Struct(record_format(fields))
+    usable = len(data) - len(data) % layout.size  # ignore a torn last record
+    rows = [
+        tuple(None if value != value else value for value in values)
+        for values in layout.iter_unpack(data[:usable])
+    ]
+    return fields, rows
+
+
+def segment_paths(directory, prefix="data"):
+    """All segments of a prefix in chronological order."""
+    return sorted(glob.glob(os.path.join(directory, f"{prefix}_*.bin")))
+
+
+def export_csv(paths, output):
+    """Convert binary segments to a csv file in the same row format as the old data.txt."""
+    count = 0
+    with open(output, "wt", newline="") as file:
+        wr = csv.writer(file, quoting=csv.QUOTE_MINIMAL)
+        for path in paths:
+            _, rows = read_segment(path)
+            for row in rows:
+                # float32 values are printed with the precision they were stored in
+                wr.writerow([row[0]] + ["" if value is None else f"{value:.7g}" for value in row[1:]])
+            count += len(rows)
+    return count
+
+
+if __name__ == "__main__":
+    # usage: python3 telemetry.py <data directory> <output.csv> [prefix]
+    if len(sys.argv) < 3:
+        print("usage: python3 telemetry.py <data directory> <output.csv> [prefix]")
+        sys.exit(1)
+    prefix = sys.argv[3] if len(sys.argv) > 3 else "data"
+    paths = segment_paths(sys.argv[1], prefix)
+    rows = export_csv(paths, sys.argv[2])
+    print(f"[Telemetry] Exported {rows} rows from {len(paths)} segments to {sys.argv[2]}")
@@ -0,0 +1,212 @@
+import os           # sysfs paths
+import sys          # command line arguments
+import glob         # sensor discovery
+import time         # default clock
+import threading    # background reader
+import logging      # error reporting
+import tempfile     # fake sysfs tree of the command line demo
+
+# DS18B20 conversion time per resolution [s], from the datasheet
+CONVERSION_TIME = {9: 0.094, 10: 0.188, 11: 0.375, 12: 0.750}
+# values the DS18B20 reports when a conversion did not happen or the read failed
+INVALID_VALUES = (85.0, -127.0)
+
+
+class W1Bus:
+    """DS18B20 sensors of one 1-Wire master, accessed through the w1_therm sysfs files.
+
+    `trigger` starts a conversion on all sensors at once (therm_bulk_read) and
+    returns immediately; `read` afterwards returns the converted value without
+    starting a new conversion.
+    """
+
+    def __init__(self, root="/sys/bus/w1/devices", master="w1_bus_master1"):
+        self.root = root
+        self.bulk_path = os.path.join(root, master, "therm_bulk_read")
+
+    def sensors(self):
+        """Ids of all DS18B20 sensors on the bus."""
+        return sorted(os.path.basename(path) for path in glob.glob(os.path.join(self.root, "28-*")))
+
+    def _path(self, sensor, name):
+        return os.path.join(self.root, sensor, name)
+
+    def resolution(self, sensor):
+        with open(self._path(sensor, "resolution")) as file:
+            return int(file.read())
+
+    def set_resolution(self, sensor, bits):
+        """Set 9..12 bit resolution; lower resolution converts faster (see CONVERSION_TIME)."""
+        if bits not in CONVERSION_TIME:
+            raise ValueError(f"Unsupported resolution: {bits}")
+        with open(self._path(sensor, "resolution"), "w") as file:
+            file.write(str(bits))
+
+    @property
+    def supports_bulk(self):
+        return os.path.exists(self.bulk_path)
+
+    def trigger(self):
+        """Start a conversion on all sensors of the bus."""
+        with open(self.bulk_path, "w") as file:
+            file.write("trigger")
+
+    def converting(self):
+        """True while a bulk conversion is still in progress."""
+        with open(self.bulk_path) as file:
+            return file.read().strip() == "-1"
+
+    def read(self, sensor):
+        """Temperature in °C; after `trigger` this does not start another conversion."""
+        with open(self._path(sensor, "temperature")) as file:
+            return int(file.read()) / 1000
+
+
+class TemperatureReader(threading.Thread):
+    """Acquires all bus temperatures in the background and caches the last good values.
+
+    Each round triggers one conversion for all sensors, sleeps for the conversion
+    time of the configured resolution and then collects the results, so no caller
+    ever waits for a conversion. Without bulk support the sensors are read one by
+    one, which blocks only this thread. Times and waits are taken from `clock`.
+    """
+
+    def __init__(self, bus, stop_event, interval=10.0, resolution=12, clock=time):
+        super().__init__(name="temperature", daemon=True)
+        self.bus = bus
+        self.stop_event = stop_event
+        self.interval = interval
+        self.resolution = resolution
+        self.clock = clock
+        self.conversion_time = CONVERSION_TIME[resolution]
+        self.sensors = []
+        self.errors = 0
+        self._values = {}  # sensor -> (temperature, clock monotonic time of the reading)
+
+    def setup(self):
+        """Discover the sensors and apply the resolution."""
+        self.sensors = self.bus.sensors()
+        for sensor in self.sensors:
+            try:
+                if self.bus.resolution(sensor) != self.resolution:
+                    self.bus.set_resolution(sensor, self.resolution)
+            except OSError as e:
+                logging.error(f"[Temperature] Could not set resolution of {sensor}: {e}")
+        logging.info(f"[Temperature] {len(self.sensors)} sensors, {self.resolution} bit "
+                     f"({self.conversion_time * 1000:.0f} ms conversion)")
+
+    def _wait(self, seconds):
+        """Wait `seconds` of the clock (which may run faster than real time); True once stopped."""
+        return self.stop_event.wait(timeout=seconds / getattr(self.clock, "scale", 1.0))
+
+    def acquire(self):
+        """One acquisition round for all sensors."""
+        if self.bus.supports_bulk:
+            self.bus.trigger()
+            if self._wait(self.conversion_time):
+                return
+            deadline = self.clock.monotonic() + self.conversion_time
+            while self.bus.converting() and self.clock.monotonic() < deadline:
+                if self._wait(0.01):
+                    return
+        for sensor in self.sensors:
+            try:
+                value = self.bus.read(sensor)
+            except (OSError, ValueError) as e:
+                self.errors += 1
+                logging.error(f"[Temperature] Error reading {sensor}: {e}")
+                continue
+            if value in INVALID_VALUES:
+                self.errors += 1
+                continue
+            self._values[sensor] = (value, self.clock.monotonic())
+
+    def latest(self, sensor=None):
+        """(temperature, age in seconds) of a sensor (default: the first one); (None, None) if never read."""
+        if sensor is None:
+            if not self.sensors:
+                return None, None
+            sensor = self.sensors[0]
+        value = self._values.get(sensor)
+        if value is None:
+            return None, None
+        return value[0], self.clock.monotonic() - value[1]
+
+    def run(self):
+        self.setup()
+        while not self.stop_event.is_set():
+            started = self.clock.monotonic()
+            try:
+                self.acquire()
+            except OSError as e:
+                self.errors += 1
+                logging.error(f"[Temperature] Acquisition error: {e}")
+            self._wait(max(0.0, self.interval - (self.clock.monotonic() - started)))
+
+
+class FakeW1Bus:
+    """sysfs stand-in: builds the w1_therm file layout in a directory and plays the kernel's part.
+
+    A thread answers `trigger` writes like the driver does: the bulk file reads
+    -1 during the conversion time, then the temperature files are updated and
+    the bulk file reads 1. The conversion takes its time on `clock`.
+    """
+
+    def __init__(self, root, temperatures, resolution=12, clock=time):
+        self.root = root
+        self.clock = clock
+        self.temperatures = dict(temperatures)  # sensor id -> °C, change to simulate
+        self.bus = W1Bus(root)
+        os.makedirs(os.path.dirname(self.bus.bulk_path), exist_ok=True)
+        self._write(self.bus.bulk_path, "0")
+        for sensor in self.temperatures:
+            os.makedirs(os.path.join(root, sensor), exist_ok=True)
+            self._write(os.path.join(root, sensor, "resolution"), str(resolution))
+            self._write(os.path.join(root, sensor, "temperature"), "85000")  # power-on value
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._driver, daemon=True)
+        self._thread.start()
+
+    def _write(self, path, text):
+        # replaced at once: with a fast clock the reader may read while the driver writes
+        with open(path + ".tmp", "w") as file:
+            file.write(text)
+        os.replace(path + ".tmp", path)
+
+    def _driver(self):
+        while not self._stop.wait(timeout=0.005):
+            with open(self.bus.bulk_path) as file:
+                if file.read().strip() != "trigger":
+                    continue
+            self._write(self.bus.bulk_path, "-1")
+            resolution = max(self.bus.resolution(sensor) for sensor in self.temperatures)
+            time.sleep(CONVERSION_TIME[resolution] / getattr(self.clock, "scale", 1.0))
+            for sensor, value in self.temperatures.items():
+                self._write(os.path.join(self.root, sensor, "temperature"), str(int(round(value * 1000))))
+            self._write(self.bus.bulk_path, "1")
+
+    def close(self):
+        self._stop.set()
+        self._thread.join()
+
+
+if __name__ == "__main__":
+    # usage: python3 temperature.py [resolution]  (runs the reader against a fake sysfs tree)
+    resolution = int(sys.argv[1]) if len(sys.argv) > 1 else 12
+    with tempfile.TemporaryDirectory() as root:
+        fake = FakeW1Bus(root, {"28-000000000001": 6.5, "28-000000000002": 7.25}, resolution)
+        stop_event = threading.Event()
+        reader = TemperatureReader(fake.bus, stop_event, interval=1.0, resolution=resolution)
+        reader.start()
+        time.sleep(0.1)
+        started = time.monotonic()
+        print(f"latest() before the first conversion: {reader.latest()} "
+              f"({(time.monotonic() - started) * 1e6:.0f} us)")
+        time.sleep(CONVERSION_TIME[resolution] + 0.2)
+        for sensor in reader.sensors:
+            started = time.monotonic()
+            value, age = reader.latest(sensor)
+            print(f"{sensor}: {value} °C, age {age:.2f} s ({(time.monotonic() - started) * 1e6:.0f} us)")
+        stop_event.set()
+        reader.join()
+        fake.close()
@@ -0,0 +1,29 @@
+import numpy as np
+import soundfile as sf
+
+from acoustic_features import pooling, spectrogram_bins, process, feature_path
+
+
+def test_pooling_averages_every_band():
+    freqs = np.fft.rfftfreq(2048, 1 / 48000)
+    starts, counts = pooling(spectrogram_bins(freqs, 64), len(freqs))
+    spectrum = np.arange(len(freqs), dtype=float)
+    pooled = np.add.reduceat(spectrum, starts) / counts
+    ends = list(starts[1:]) + [len(freqs)]
+    expected = [spectrum[start:max(end, start + 1)].mean() for start, end in zip(starts, ends)]
+    assert np.allclose(pooled, expected)
+    assert counts[-1] == len(freqs) - starts[-1]
+
+
+def test_broken_recording_does_not_stop_the_batch(tmp_path):
+    broken = tmp_path / "a_broken.flac"
+    broken.write_bytes(b"fLaC" + b"\x00" * 20)  # cut off right after the header
+    good = tmp_path / "b_good.flac"
+    rng = np.random.default_rng(1)
+    sf.write(str(good), rng.normal(0, 0.1, 8000 * 3).astype(np.float32), 8000)
+
+    written, failed = process([str(broken), str(good)], window_seconds=1.0, nfft=1024)
+    assert [path for path, _ in written] == [str(good)]
+    assert [path for path, _ in failed] == [str(broken)]
+    assert (tmp_path / "b_good.features.npz").exists()
+    assert feature_path(str(good)) == str(tmp_path / "b_good.features.npz")
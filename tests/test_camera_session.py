@@ -0,0 +1,22 @@
+import threading
+
+from hal import FakeCamera, FakeEncoder, FakeOutput, ScaledClock
+from metrics import Metrics
+from camera_session import CameraSession
+
+
+def test_framerate_change_starts_a_new_file(tmp_path):
+    clock = ScaledClock(1000.0)
+    session = CameraSession(FakeCamera(clock), lambda bitrate: FakeEncoder(), FakeOutput, Metrics(clock),
+                            threading.Event(), clock=clock, phases={"dark": {"framerate": 15}}, settle_timeout=0.5)
+    session.warm_up()
+    session.start_recording(str(tmp_path / "clip.h264"))
+    session.light_on()
+    session.light_off()
+    session.light_on()
+    session.stop_recording()
+    session.close()
+
+    names = [path.rsplit("/", 1)[1] for path in session.files]
+    assert names == ["clip.h264", "clip_settling.h264", "clip_dark.h264", "clip_settling2.h264"]
+    assert [session.framerates[path] for path in session.files] == [15, 30, 15, 30]
@@ -0,0 +1,58 @@
+import threading
+
+from energy import EnergyLedger, EnergyManager, SCHEDULES, TASKS, simulate
+
+
+def test_ledger_is_read_while_the_uart_thread_adds(tmp_path):
+    manager = EnergyManager(1000.0, None, state_path=str(tmp_path / "energy.json"), started=0.0)
+    ledger = manager.ledger
+    stop = threading.Event()
+
+    def uart():
+        now = 0.0
+        while not stop.is_set():
+            # every sample with another task combination
+            ledger.active = frozenset(task for bit, task in enumerate(TASKS) if int(now) & 1 << bit)
+            now += 1.0
+            ledger.add(5.0, now)
+
+    thread = threading.Thread(target=uart)
+    thread.start()
+    try:
+        for index in range(300):
+            if index % 10 == 0:
+                ledger.load({})  # so that new task combinations keep appearing
+            manager.save()
+            ledger.task_power()
+    finally:
+        stop.set()
+        thread.join()
+
+
+def test_idle_power_stays_positive():
+    ledger = EnergyLedger()
+    # a fit that would put idle power below zero
+    ledger.load({"idle": [0.1 * 600, 600], "light": [30.0 * 600, 600], "light+video": [10.0 * 600, 600]})
+    power = ledger.task_power()
+    assert power["idle"] > 0
+    assert EnergyManager(1000.0, 13.0, started=0.0).plan(SCHEDULES["p"], now=0.0) is not None
+
+
+def test_new_battery_resets_the_state(tmp_path):
+    path = str(tmp_path / "energy.json")
+    manager = EnergyManager(1000.0, 13.0, state_path=path, started=0.0)
+    manager.add(0.0, 0.0, 11.9, 3.0)
+    manager.ledger.load({"idle": [500 * 3600.0, 1e5]})
+    manager.save()
+
+    restarted = EnergyManager(1000.0, 13.0, state_path=path, started=100.0)
+    assert restarted.started == 0.0 and restarted.used_wh == 500.0
+    restarted.add(200.0, 200.0, 12.6, 3.0)  # full battery after the reboot
+    assert restarted.started == 200.0 and restarted.used_wh == 0.0
+    assert restarted.policy.target_end == 200.0 + 13 * 86400
+
+
+def test_adaptive_schedule_reaches_the_target():
+    fixed, _ = simulate(SCHEDULES["p"], 300.0, 4.0, adaptive=False)
+    adaptive, _ = simulate(SCHEDULES["p"], 300.0, 4.0, adaptive=True)
+    assert fixed < 4.0 <= adaptive
@@ -0,0 +1,19 @@
+import os
+import threading
+
+from hal import FakeCamera, FakeEncoder, ScaledClock
+from motion_recording import MotionRecorder
+
+
+def test_motion_is_recorded_into_one_clip(tmp_path):
+    clock = ScaledClock(100.0)  # the fake lores stream shows motion for the first 20 s
+    camera = FakeCamera(clock)
+    camera.configure(camera.create_video_configuration(lores={"size": (320, 240), "format": "YUV420"}))
+    recorder = MotionRecorder(camera, FakeEncoder(), str(tmp_path), str(tmp_path), threading.Event(),
+                              hold=2.0, preroll=1.0, clock=clock)
+    recorder.run(30.0)
+
+    assert len(recorder.files) == 1
+    assert recorder.scores[recorder.files[0]] > 0.02
+    # the 20 s of motion at 30 fps, 4 bytes per fake frame
+    assert os.path.getsize(recorder.files[0]) >= 4 * 30 * 20
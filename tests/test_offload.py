@@ -0,0 +1,71 @@
+import os
+import time
+
+from offload import Offloader, HttpTarget, serve
+
+
+class RecordingTarget(HttpTarget):
+    """Notes the offset of every chunk; the link drops before chunk `drop_at`."""
+
+    def __init__(self, url, drop_at=None):
+        super().__init__(url)
+        self.drop_at = drop_at
+        self.offsets = []
+
+    def append(self, name, offset, data):
+        if len(self.offsets) == self.drop_at:
+            raise ConnectionResetError("link down")
+        self.offsets.append(offset)
+        return super().append(name, offset, data)
+
+
+class LaterClock:
+    """Wall clock `offset` seconds ahead, past the retry delay of a failed upload."""
+
+    def __init__(self, offset):
+        self.offset = offset
+
+    def time(self):
+        return time.time() + self.offset
+
+
+def wait_for(condition, timeout=10.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+
+def test_interrupted_upload_continues_at_the_server_offset(tmp_path):
+    storage, received = tmp_path / "storage", tmp_path / "received"
+    (storage / "video").mkdir(parents=True)
+    (storage / "data").mkdir()
+    path = storage / "video" / "2025-03-01--00-00-00_d40.mp4"
+    content = os.urandom(10 * 64 * 1024 + 123)
+    path.write_bytes(content)
+    queue = str(storage / "data" / "offload.sqlite")
+    server = serve(str(received), port=0)
+    url = f"http://127.0.0.1:{server.server_address[1]}"
+    try:
+        chunk = 64 * 1024
+        first = RecordingTarget(url, drop_at=3)
+        offloader = Offloader(str(storage), first, queue, unit="unit", rate=1e9, chunk_size=chunk).start()
+        offloader.add(str(path))
+        offloader.resume()
+        wait_for(lambda: offloader.failed == 1)
+        offloader.shutdown()
+        assert first.offsets == [0, chunk, 2 * chunk]
+
+        # after a reboot an hour later the queue is read again and the upload goes on where the server stopped
+        second = RecordingTarget(url)
+        offloader = Offloader(str(storage), second, queue, unit="unit", rate=1e9, chunk_size=chunk,
+                              clock=LaterClock(3600)).start()
+        offloader.resume()
+        wait_for(lambda: offloader.uploaded == 1)
+        offloader.shutdown()
+        assert second.offsets[0] == 3 * chunk
+        assert offloader.sent == len(content) - 3 * chunk
+    finally:
+        server.shutdown()
+    assert (received / "unit" / "video" / path.name).read_bytes() == content
+    assert not (received / "unit" / "video" / (path.name + ".part")).exists()
@@ -0,0 +1,26 @@
+import json
+
+from postprocess import PostProcessor
+
+
+def test_remux_uses_the_framerate_of_the_file(tmp_path):
+    raw = tmp_path / "2025-03-01--12-00-00_d40_dark.h264"
+    raw.write_bytes(b"\x00\x00\x00\x01" * 16)
+    processor = PostProcessor(str(tmp_path / "journal.jsonl"), ffmpeg="sh", ffprobe="sh")
+    calls = []
+
+    def run(args):
+        calls.append(args)
+        if "-show_entries" in args:
+            return json.dumps({"streams": [{"nb_read_packets": "300"}], "format": {}})
+        with open(args[-1], "wb") as file:  # remuxed file or thumbnail strip
+            file.write(b"out")
+        return ""
+
+    processor._run = run
+    processor.resume(float("inf"))  # steps wait for an open window
+    record = processor._process(processor._job(str(raw), {"framerate": 15}))
+    remux = next(args for args in calls if "-c" in args)
+    assert remux[remux.index("-framerate") + 1] == "15"
+    assert record["duration"] == 20.0  # 300 frames at 15 fps
+    processor.journal.close()
@@ -0,0 +1,8 @@
+from safety import measure_latencies
+
+
+def test_response_latency_bounds():
+    results = measure_latencies(runs=20)
+    assert len(results["Leak"]) == len(results["Voltage treshold reached"]) == 10
+    assert max(results["Leak"]) < 0.1
+    assert max(results["Voltage treshold reached"]) < 0.01
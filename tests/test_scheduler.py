@@ -0,0 +1,23 @@
+import threading
+
+from scheduler import Scheduler
+
+
+def test_runs_of_all_workers_are_counted():
+    stop_event = threading.Event()
+    scheduler = Scheduler(stop_event, workers=8)
+    done = threading.Semaphore(0)
+
+    def fail():
+        done.release()
+        raise RuntimeError("expected")
+
+    for _ in range(2000):
+        scheduler.call_later(0.0, fail, "fail")
+    scheduler.start()
+    for _ in range(2000):
+        assert done.acquire(timeout=10)
+    scheduler.shutdown()
+
+    stats = scheduler.stats["fail"]
+    assert stats.runs == stats.errors == 2000
@@ -0,0 +1,34 @@
+import os
+
+import pytest
+
+from storage import StorageManager
+from offload import classify
+
+
+def touch(path, size=100):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as file:
+        file.write(b"x" * size)
+
+
+def test_only_dated_telemetry_is_catalogued(tmp_path):
+    storage = str(tmp_path)
+    dated = ["data_2025-03-01.bin", "rollup60_2025-03-01.bin", "metrics_2025-03-01.jsonl"]
+    state = ["energy.json", "index.json", "postprocess.jsonl", "offload.sqlite", "catalog.sqlite-wal"]
+    for name in dated + state:
+        touch(os.path.join(storage, "data", name))
+    touch(os.path.join(storage, "video", "2025-03-01--12-00-00_d40.mp4"))
+    touch(os.path.join(storage, "error", "system_log.jsonl"))
+
+    manager = StorageManager(storage)
+    manager.sync()
+    telemetry = sorted(os.path.basename(row["path"]) for row in manager.catalog.query(kind="telemetry"))
+    assert telemetry == sorted(dated)
+    # the offload picks the same files
+    assert sorted(name for name in os.listdir(os.path.join(storage, "data"))
+                  if classify(os.path.join("data", name))) == sorted(dated)
+
+    with pytest.raises(ValueError):
+        manager.evict(manager.catalog.query(kind="telemetry")[0])
+    manager.close()
@@ -0,0 +1,35 @@
+from telemetry import TelemetryWriter, read_segment
+
+DAY = 1741000000.0  # 2025-03-03
+
+
+def rows(start, count):
+    return [[DAY + start + index, 12.0, 0.5, 6.0, 8.0, 0.6] for index in range(count)]
+
+
+def test_rows_read_back(tmp_path):
+    writer = TelemetryWriter(str(tmp_path), max_rows=4)
+    for row in rows(0, 10):
+        writer.write(row)
+    writer.close()
+    _, read = read_segment(writer.path)
+    assert [row[0] for row in read] == [row[0] for row in rows(0, 10)]
+
+
+def test_torn_record_is_cut_off_on_reopen(tmp_path):
+    writer = TelemetryWriter(str(tmp_path))
+    for row in rows(0, 3):
+        writer.write(row)
+    writer.close()
+    with open(writer.path, "ab") as file:
+        file.write(b"\x01\x02\x03\x04\x05")  # power cut in the middle of a record
+
+    writer = TelemetryWriter(str(tmp_path))
+    for row in rows(10, 3):
+        writer.write(row)
+    writer.close()
+
+    fields, read = read_segment(writer.path)
+    assert len(read) == 6
+    assert [row[0] for row in read] == [DAY + offset for offset in (0, 1, 2, 10, 11, 12)]
+    assert all(row[1] == 12.0 and row[5] is not None and abs(row[5] - 0.6) < 1e-6 for row in read)
@@ -0,0 +1,41 @@
+import threading
+
+from uart_ingest import UartIngest, SampleRing, FRAME_SYNC, FRAME_BODY, FRAME_VERSION, crc16
+
+
+def frame(seq, volts=12.5):
+    counts = round(volts / 0.00125)
+    body = FRAME_BODY.pack(FRAME_VERSION, seq, 64, 1000, counts, counts, counts, 240, 240, 240, 370, 370, 370)
+    crc = crc16(body)
+    return FRAME_SYNC + body + bytes((crc & 0xFF, crc >> 8))
+
+
+def ingest():
+    return UartIngest(None, SampleRing(), threading.Event(), protocol="binary")
+
+
+def test_pico_restart_is_not_counted_as_lost_frames():
+    uart = ingest()
+    before = b"".join(frame(seq) for seq in range(100, 110))
+    torn = frame(110)[:9]  # the pico reset in the middle of a frame
+    after = b"".join(frame(seq) for seq in range(5))
+    stream = before + torn + after
+    for start in range(0, len(stream), 7):  # arbitrary read boundaries
+        uart.feed(stream[start:start + 7])
+
+    assert uart.frames == 15
+    assert uart.resets == 1
+    assert uart.gaps == 0
+    assert [sample.seq for sample in uart.ring.snapshot()] == list(range(100, 110)) + list(range(5))
+
+
+def test_lost_and_corrupted_frames_are_counted():
+    uart = ingest()
+    broken = bytearray(frame(2))
+    broken[6] ^= 0xFF
+    uart.feed(frame(0) + frame(1) + bytes(broken) + frame(4))
+
+    assert uart.frames == 3
+    assert uart.corrupt >= 1
+    assert uart.gaps == 2
+    assert uart.ring.latest().voltage == 12.5
@@ -0,0 +1,493 @@
+import os           # filepath generation
+import csv          # import of old data.txt files
+import glob         # segment discovery
+import json         # partition index
+import math         # bucket alignment, NaN handling
+import bisect       # time range lookup in segments
+import struct       # record size of a segment
+import time         # partition names, timestamps, benchmark timing
+import random       # simulated dataset of the benchmark
+import argparse     # command line interface
+import tempfile     # benchmark directory
+import threading    # writes from scheduler workers, flushes from the safety thread
+
+from telemetry import TelemetryWriter, SENSOR_FIELDS, read_segment, read_header, record_format
+from dates import day_name  # partition names
+
+RESOLUTIONS = (60, 3600)  # rollup bucket sizes [s]
+
+
+def rollup_fields(value_fields):
+    """Record layout of a rollup segment: bucket start, then count/min/max/mean per value field."""
+    fields = ["time"]
+    for field in value_fields:
+        fields += [f"{field}_count", f"{field}_min", f"{field}_max", f"{field}_mean"]
+    return tuple(fields)
+
+
+def first(row):
+    return row[0]
+
+
+def segment_rows(path):
+    """Number of complete records in a segment, from its size (None: not a readable segment)."""
+    try:
+        with open(path, "rb") as file:
+            fields = read_header(file)
+            header = file.tell()
+        return (os.path.getsize(path) - header) // struct.calcsize(record_format(fields))
+    except (OSError, ValueError, struct.error):
+        return None
+
+
+class Stats:
+    """Count/min/max/mean of one field that can be merged with other stats."""
+
+    __slots__ = ("count", "min", "max", "total")
+
+    def __init__(self, count=0, minimum=math.inf, maximum=-math.inf, total=0.0):
+        self.count, self.min, self.max, self.total = count, minimum, maximum, total
+
+    def add(self, value):
+        if value is None or value != value:
+            return
+        self.count += 1
+        self.total += value
+        if value < self.min:
+            self.min = value
+        if value > self.max:
+            self.max = value
+
+    def merge(self, count, minimum, maximum, mean):
+        if not count:
+            return
+        self.count += count
+        self.total += mean * count
+        self.min = min(self.min, minimum)
+        self.max = max(self.max, maximum)
+
+    @property
+    def mean(self):
+        return self.total / self.count if self.count else None
+
+    def as_dict(self):
+        if not self.count:
+            return {"count": 0, "min": None, "max": None, "mean": None}
+        return {"count": self.count, "min": self.min, "max": self.max, "mean": self.mean}
+
+
+class Rollup:
+    """Accumulates rows into fixed buckets and writes one rollup record per finished bucket."""
+
+    def __init__(self, directory, resolution, value_fields, suffix=""):
+        self.resolution = resolution
+        self.value_fields = value_fields
+        self.writer = TelemetryWriter(directory, prefix=f"rollup{resolution}", fields=rollup_fields(value_fields),
+                                      max_rows=64, max_age=600.0, suffix=suffix)
+        self.bucket = None  # start of the open bucket
+        self._stats = None
+
+    def add(self, row):
+        bucket = row[0] // self.resolution * self.resolution
+        if bucket != self.bucket:
+            self.emit()
+            self.bucket = bucket
+            self._stats = [Stats() for _ in self.value_fields]
+        for stats, value in zip(self._stats, row[1:]):
+            stats.add(value)
+
+    def emit(self):
+        """Write the open bucket (also used for a partial bucket on close)."""
+        if self.bucket is None:
+            return
+        record = [self.bucket]
+        for stats in self._stats:
+            record += [stats.count, stats.min, stats.max, stats.mean] if stats.count else [0, None, None, None]
+        self.writer.write(record)
+        self.bucket = None
+
+
+class TimeSeriesStore:
+    """Local time-series store for the deployment telemetry.
+
+    Raw rows go into daily telemetry segments (`data_<day>.bin`, readable by
+    telemetry.py) while 1-minute and 1-hour rollups with count/min/max/mean per
+    field are maintained on the fly in their own daily segments. `index.json`
+    keeps the time range and row count of every day, so queries only open
+    the partitions they need and aggregates are answered from the coarsest
+    rollups that fit the range. Rollups and index are written whenever raw rows
+    reach the disk; on load, days whose row count does not match their segments
+    (e.g. after a power cut) are scanned again and their rollups rebuilt. Offers the TelemetryWriter
+    interface, so it can replace the plain writer.
+    """
+
+    def __init__(self, directory, fields=SENSOR_FIELDS, max_rows=64, max_age=300.0):
+        self.directory = directory
+        self.fields = tuple(fields)
+        self.value_fields = self.fields[1:]
+        self.raw = TelemetryWriter(directory, prefix="data", fields=self.fields, max_rows=max_rows, max_age=max_age)
+        self.rollups = {resolution: Rollup(directory, resolution, self.value_fields) for resolution in RESOLUTIONS}
+        self.index_path = os.path.join(directory, "index.json")
+        self._lock = threading.RLock()  # rollup writers and index: write, flush, close, queries
+        self.index = self._load_index()
+        self._cache = {}  # path -> ((mtime, size), rows) of recently read segments
+        self.cache_size = 32
+
+    # --- writing
+
+    def _load_index(self):
+        try:
+            with open(self.index_path) as file:
+                index = json.load(file)
+        except (OSError, ValueError):
+            index = {}
+        return self._reconcile(index)
+
+    def _save_index(self, closed=False):
+        """Write the index; `closed` marks a store whose open rollup buckets were written too."""
+        self.index["closed"] = closed
+        temporary = self.index_path + ".tmp"
+        with open(temporary, "w") as file:
+            json.dump(self.index, file)
+        os.replace(temporary, self.index_path)
+
+    def _note(self, prefix, timestamp):
+        partitions = self.index.setdefault(prefix, {})
+        day = day_name(timestamp)
+        entry = partitions.get(day)
+        if entry is None:
+            partitions[day] = [timestamp, timestamp, 1]
+        else:
+            entry[0], entry[1], entry[2] = min(entry[0], timestamp), max(entry[1], timestamp), entry[2] + 1
+
+    def _append(self, raw, rollups, row):
+        raw.write(row)
+        self._note("data", row[0])
+        for resolution, rollup in rollups.items():
+            bucket = rollup.bucket
+            rollup.add(row)
+            if bucket is not None and bucket != rollup.bucket:
+                self._note(f"rollup{resolution}", bucket)
+
+    def _close(self, raw, rollups):
+        """Write the open (partial) buckets too; readers merge buckets with the same start."""
+        for resolution, rollup in rollups.items():
+            if rollup.bucket is not None:
+                self._note(f"rollup{resolution}", rollup.bucket)
+            rollup.emit()
+            rollup.writer.close()
+        raw.close()
+
+    def write(self, row):
+        """Append a raw row and update the rollups."""
+        with self._lock:
+            written = self.raw.rows_written
+            self._append(self.raw, self.rollups, row)
+            if self.raw.rows_written != written:
+                # the rows just reached the disk: keep rollups and index up to date with them
+                for rollup in self.rollups.values():
+                    rollup.writer.flush()
+                self._save_index()
+
+    def new_cycle(self):
+        self.raw.new_cycle()
+
+    def flush(self):
+        with self._lock:
+            self.raw.flush()
+            for rollup in self.rollups.values():
+                rollup.writer.flush()
+            self._save_index()
+
+    def close(self):
+        with self._lock:
+            self._close(self.raw, self.rollups)
+            self._save_index(closed=True)
+
+    def _segments(self, prefix):
+        """day -> segment paths of `prefix`, the day is part of the name."""
+        days = {}
+        for path in glob.glob(os.path.join(self.directory, f"{prefix}_*.bin")):
+            days.setdefault(os.path.basename(path)[len(prefix) + 1:len(prefix) + 11], []).append(path)
+        return days
+
+    def _rebuild_rollups(self, day, paths):
+        """Write the rollups of `day` again from its raw segments `paths`."""
+        for resolution in RESOLUTIONS:
+            for path in glob.glob(os.path.join(self.directory, f"rollup{resolution}_{day}*.bin")):
+                os.remove(path)
+        rows = []
+        for path in paths:
+            rows += read_segment(path)[1]
+        rows.sort(key=first)
+        for resolution in RESOLUTIONS:
+            rollup = Rollup(self.directory, resolution, self.value_fields)
+            for row in rows:
+                rollup.add(row)
+            rollup.emit()
+            rollup.writer.close()
+
+    def _reconcile(self, index):
+        """`index` checked against the segments.
+
+        Days that are missing or whose row count differs from their segments are
+        scanned again and get their rollups rebuilt from the raw rows, as does the
+        last day of a store that was not closed (its open buckets were lost).
+        """
+        prefixes = ["data"] + [f"rollup{resolution}" for resolution in RESOLUTIONS]
+        segments = {prefix: self._segments(prefix) for prefix in prefixes}
+        counts = {prefix: {day: [segment_rows(path) for path in paths] for day, paths in days.items()}
+                  for prefix, days in segments.items()}
+        stale = set()
+        for prefix in prefixes:
+            partitions = index.setdefault(prefix, {})
+            for day in set(partitions) - set(segments[prefix]):
+                del partitions[day]
+            for day, day_counts in counts[prefix].items():
+                entry = partitions.get(day)
+                if entry is None or entry[2] != sum(count or 0 for count in day_counts):
+                    stale.add(day)
+        if not index.get("closed", True) and segments["data"]:
+            stale.add(max(segments["data"]))
+
+        for day in sorted(stale):
+            if day in segments["data"]:
+                self._rebuild_rollups(day, segments["data"][day])
+            for prefix in prefixes:
+                paths = glob.glob(os.path.join(self.directory, f"{prefix}_{day}*.bin"))
+                index[prefix].pop(day, None)
+                for path in paths:
+                    _, rows = read_segment(path)
+                    if not rows:
+                        continue
+                    first_time, last_time = min(row[0] for row in rows), max(row[0] for row in rows)
+                    entry = index[prefix].setdefault(day, [first_time, last_time, 0])
+                    entry[0], entry[1] = min(entry[0], first_time), max(entry[1], last_time)
+                    entry[2] += len(rows)
+        return index
+
+    def rebuild_index(self):
+        """Recreate the partition index and the rollups from the segment files."""
+        with self._lock:
+            self.index = self._reconcile({})
+            return self.index
+
+    # --- reading
+
+    def _partitions(self, prefix, start, end):
+        """Segment files of `prefix` that hold rows in [start, end)."""
+        with self._lock:
+            days = sorted(self.index.get(prefix, {}).items())
+        paths = []
+        for day, (first, last, _) in days:
+            if first < end and last >= start:
+                paths += sorted(glob.glob(os.path.join(self.directory, f"{prefix}_{day}*.bin")))
+        return paths
+
+    def _read(self, path):
+        """Rows of a segment, cached as long as the file does not change."""
+        stat = os.stat(path)
+        key = (stat.st_mtime_ns, stat.st_size)
+        cached = self._cache.get(path)
+        if cached is not None and cached[0] == key:
+            return cached[1]
+        fields, rows = read_segment(path)
+        if fields[0] != "time":
+            rows = []
+        if len(self._cache) >= self.cache_size:
+            self._cache.pop(next(iter(self._cache)))
+        self._cache[path] = (key, rows)
+        return rows
+
+    def _rows(self, prefix, start, end):
+        rows = []
+        for path in self._partitions(prefix, start, end):
+            segment = self._read(path)
+            # segments are written in time order
+            rows += segment[bisect.bisect_left(segment, start, key=first):
+                            bisect.bisect_left(segment, end, key=first)]
+        rows.sort(key=lambda row: row[0])
+        return rows
+
+    def _buckets(self, resolution, start, end):
+        """Rollup rows of [start, end) with buckets of the same start merged."""
+        merged = {}
+        for row in self._rows(f"rollup{resolution}", start, end):
+            stats = merged.get(row[0])
+            if stats is None:
+                stats = merged[row[0]] = [Stats() for _ in self.value_fields]
+            for index, field_stats in enumerate(stats):
+                count, minimum, maximum, mean = row[1 + 4 * index: 5 + 4 * index]
+                field_stats.merge(int(count or 0), minimum, maximum, mean)
+        return merged
+
+    def range(self, start, end, resolution=0):
+        """Raw rows (resolution 0) or rollup buckets as (time, {field: stats dict}) in [start, end)."""
+        if not resolution:
+            return self._rows("data", start, end)
+        buckets = self._buckets(resolution, start, end)
+        return [(bucket, {field: stats.as_dict() for field, stats in zip(self.value_fields, buckets[bucket])})
+                for bucket in sorted(buckets)]
+
+    def _aggregate(self, column, start, end, level):
+        """Stats of one field in [start, end), using rollup `RESOLUTIONS[level]` and finer ones at the edges."""
+        result = Stats()
+        if level < 0:
+            for row in self._rows("data", start, end):
+                result.add(row[column + 1])
+            return result
+        resolution = RESOLUTIONS[level]
+        first = math.ceil(start / resolution) * resolution
+        last = math.floor(end / resolution) * resolution
+        # buckets that are still open in this process are not in the rollup files yet
+        open_bucket = self.rollups[resolution].bucket
+        if open_bucket is not None:
+            last = min(last, open_bucket)
+        if first >= last:
+            return self._aggregate(column, start, end, level - 1)
+        for stats in self._buckets(resolution, first, last).values():
+            field = stats[column]
+            if field.count:
+                result.merge(field.count, field.min, field.max, field.mean)
+        for edge_start, edge_end in ((start, first), (last, end)):
+            if edge_start < edge_end:
+                edge = self._aggregate(column, edge_start, edge_end, level - 1)
+                if edge.count:
+                    result.merge(edge.count, edge.min, edge.max, edge.mean)
+        return result
+
+    def aggregate(self, field, start, end):
+        """Count/min/max/mean of `field` in [start, end) without scanning raw data of whole buckets."""
+        return self._aggregate(self.value_fields.index(field), start, end, len(RESOLUTIONS) - 1).as_dict()
+
+    # --- import
+
+    def import_csv(self, path):
+        """Add the rows of an old `data.txt` (time, voltage, current, power, temperature).
+
+        The rows are sorted and go into segments of their own (`data_<day>_import<n>.bin`),
+        since appending them to the existing daily segments would break their time order.
+        """
+        rows = []
+        with open(path, newline="") as file:
+            for line in csv.reader(file):
+                if not line:
+                    continue
+                try:
+                    values = [None if value in ("", "None") else float(value) for value in line]
+                except ValueError:
+                    continue  # header or broken line
+                values += [None] * (len(self.fields) - len(values))
+                rows.append(values[:len(self.fields)])
+        rows.sort(key=first)
+        with self._lock:
+            self._import(rows)
+        return len(rows)
+
+    def _import(self, rows):
+        number = 1
+        while glob.glob(os.path.join(self.directory, f"*_import{number}.bin")):
+            number += 1
+        suffix = f"_import{number}"
+        raw = TelemetryWriter(self.directory, prefix="data", fields=self.fields, max_rows=1024, suffix=suffix)
+        rollups = {resolution: Rollup(self.directory, resolution, self.value_fields, suffix)
+                   for resolution in RESOLUTIONS}
+        for row in rows:
+            self._append(raw, rollups, row)
+        self._close(raw, rollups)
+        self._save_index()
+
+
+def parse_time(text):
+    """Epoch seconds or local time as YYYY-MM-DD[THH:MM]."""
+    try:
+        return float(text)
+    except ValueError:
+        layout = "%Y-%m-%dT%H:%M" if "T" in text else "%Y-%m-%d"
+        return time.mktime(time.strptime(text, layout))
+
+
+def benchmark(days=60, period=30.0, cycle=1800):
+    """Simulate a deployment, then compare rollup queries with a full scan of the raw data."""
+    with tempfile.TemporaryDirectory() as directory:
+        store = TimeSeriesStore(directory, max_rows=256)
+        start = time.mktime(time.strptime("2025-03-01", "%Y-%m-%d"))
+        rows = int(days * 86400 / period)
+        started = time.perf_counter()
+        for index in range(rows):
+            t = start + index * period
+            light = (t - start) % cycle < 60
+            store.write([t, 12.6 - 2.0 * index / rows, 2.5 if light else 0.3 + random.random() * 0.05,
+                         None, 6.0 + random.random(), 2.8 if light else 0.4])
+        store.close()
+        ingest = time.perf_counter() - started
+        size = sum(os.path.getsize(path) for path in glob.glob(os.path.join(directory, "*.bin")))
+        print(f"ingest: {rows} rows over {days} days in {ingest:.2f} s, {size / 1e6:.1f} MB on disk")
+
+        store = TimeSeriesStore(directory)
+        week3 = (start + 14 * 86400, start + 21 * 86400)
+        started = time.perf_counter()
+        result = store.aggregate("current", *week3)
+        rollup = time.perf_counter() - started
+        started = time.perf_counter()
+        scan = Stats()
+        for path in sorted(glob.glob(os.path.join(directory, "data_*.bin"))):
+            for row in read_segment(path)[1]:
+                if week3[0] <= row[0] < week3[1]:
+                    scan.add(row[2])
+        full = time.perf_counter() - started
+        print(f"mean current week 3: {result['mean']:.4f} A via rollups in {rollup * 1000:.1f} ms, "
+              f"{scan.mean:.4f} A via full scan in {full * 1000:.1f} ms")
+
+        started = time.perf_counter()
+        cycles = [store.aggregate("current", t, t + cycle) for t in range(int(week3[0]), int(week3[1]), cycle)]
+        print(f"per-cycle mean current week 3: {len(cycles)} aggregates in "
+              f"{(time.perf_counter() - started) * 1000:.1f} ms")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Query the local telemetry store")
+    commands = parser.add_subparsers(dest="command", required=True)
+    command = commands.add_parser("import", help="import an old data.txt file")
+    command.add_argument("directory")
+    command.add_argument("csv")
+    for name in ("query", "aggregate"):
+        command = commands.add_parser(name)
+        command.add_argument("directory")
+        command.add_argument("--start", required=True, help="epoch or YYYY-MM-DD[THH:MM] (local time)")
+        command.add_argument("--end", required=True)
+        command.add_argument("--field", default="voltage")
+        if name == "query":
+            command.add_argument("--resolution", type=int, default=3600, choices=(0,) + RESOLUTIONS)
+    commands.add_parser("rebuild-index").add_argument("directory")
+    command = commands.add_parser("bench", help="benchmark on a simulated deployment")
+    command.add_argument("--days", type=int, default=60)
+    command.add_argument("--period", type=float, default=30.0)
+    args = parser.parse_args()
+
+    if args.command == "bench":
+        benchmark(args.days, args.period)
+    elif args.command == "import":
+        store = TimeSeriesStore(args.directory)
+        rows = store.import_csv(args.csv)
+        store.close()
+        print(f"[Telemetry] Imported {rows} rows")
+    elif args.command == "rebuild-index":
+        store = TimeSeriesStore(args.directory)
+        store.rebuild_index()
+        store.close()
+    else:
+        store = TimeSeriesStore(args.directory)
+        start, end = parse_time(args.start), parse_time(args.end)
+        if args.command == "aggregate":
+            print(json.dumps({args.field: store.aggregate(args.field, start, end)}))
+        elif args.resolution:
+            for bucket, stats in store.range(start, end, args.resolution):
+                field = stats[args.field]
+                values = "  ".join(f"{name} {'' if field[name] is None else format(field[name], '.7g')}"
+                                   for name in ("min", "max", "mean"))
+                print(f"{time.strftime('%Y-%m-%d %H:%M', time.localtime(bucket))}  count {field['count']:5d}  {values}")
+        else:
+            column = store.fields.index(args.field)
+            for row in store.range(start, end):
+                print(f"{row[0]:.0f},{'' if row[column] is None else format(row[column], '.7g')}")
@@ -0,0 +1,242 @@
+import threading    # ingest runs in its own thread
+import time         # sample timestamps
+import logging      # error reporting
+import struct       # binary frames of the pico
+from collections import namedtuple
+
+# One INA260 reading as sent by the Pico; `time` is wall clock, `monotonic` is used for windows.
+# Binary frames carry the mean of a window as voltage/current/power plus its extremes,
+# the number of INA260 samples, the frame sequence number and the window length in seconds;
+# text lines leave those None.
+Sample = namedtuple(
+    "Sample",
+    ["time", "monotonic", "voltage", "current", "power",
+     "voltage_min", "voltage_max", "current_min", "current_max", "power_max", "count", "seq", "window"],
+    defaults=(None,) * 8,
+)
+
+# Binary frame of rpi_pico_uart.py: sync | body | crc16 (CCITT-FALSE over the body)
+FRAME_SYNC = b"\xa5\x5a"
+FRAME_VERSION = 1
+FRAME_BODY = struct.Struct("<BHHH3H3h3H")
+FRAME_SIZE = len(FRAME_SYNC) + FRAME_BODY.size + 2
+VOLTAGE_LSB, CURRENT_LSB, POWER_LSB = 0.00125, 0.00125, 0.01  # V, A, W per count
+
+
+def _crc_table():
+    table = []
+    for byte in range(256):
+        crc = byte << 8
+        for _ in range(8):
+            crc = ((crc << 1) ^ 0x1021) if crc & 0x8000 else crc << 1
+        table.append(crc & 0xFFFF)
+    return table
+
+
+CRC_TABLE = _crc_table()
+
+
+def crc16(data):
+    """CRC-16/CCITT-FALSE, same as crc16() in rpi_pico_uart.py."""
+    crc = 0xFFFF
+    for byte in data:
+        crc = ((crc << 8) & 0xFFFF) ^ CRC_TABLE[(crc >> 8) ^ byte]
+    return crc
+
+
+class SampleRing:
+    """Bounded ring buffer of samples with a single writer and any number of readers.
+
+    The writer stores a sample in its slot before publishing it by advancing the
+    write counter, so readers never need a lock: they copy the slots and only
+    return entries that cannot have been overwritten while they were copying.
+    """
+
+    def __init__(self, capacity=3600):
+        self.capacity = capacity
+        self._slots = [None] * capacity
+        self._count = 0  # number of samples ever written
+
+    def __len__(self):
+        return min(self._count, self.capacity)
+
+    @property
+    def total(self):
+        """Number of samples pushed since start, including overwritten ones."""
+        return self._count
+
+    def push(self, sample):
+        """Store a sample; only one thread may push."""
+        self._slots[self._count % self.capacity] = sample
+        self._count += 1
+
+    def latest(self):
+        """The newest sample or None if nothing was received yet."""
+        count = self._count
+        if count == 0:
+            return None
+        return self._slots[(count - 1) % self.capacity]
+
+    def snapshot(self, last=None):
+        """Copy of the buffered samples (oldest first), optionally only the `last` ones."""
+        count = self._count
+        slots = self._slots[:]  # list copy is atomic under the GIL
+        after = self._count
+        # entries up to `after - capacity` may have been replaced during the copy
+        first = max(count - self.capacity, after - self.capacity + 1, 0)
+        if last is not None:
+            first = max(first, count - last)
+        return [slots[index % self.capacity] for index in range(first, count)]
+
+    def window(self, seconds, now=None):
+        """Samples received within the last `seconds` (monotonic clock)."""
+        if now is None:
+            now = time.monotonic()
+        since = now - seconds
+        samples = self.snapshot()
+        # samples are ordered, so search from the newest end
+        index = len(samples)
+        while index > 0 and samples[index - 1].monotonic >= since:
+            index -= 1
+        return samples[index:]
+
+
+class UartIngest(threading.Thread):
+    """Drains the Pico UART, parses its messages and fills a SampleRing.
+
+    Everything buffered by the port is read in one call and parsed on the raw
+    bytes, so no sample is dropped and nothing blocks the other sensor loops.
+    `protocol` has to match PROTOCOL in rpi_pico_uart.py: "text" lines of
+    `voltage, current, power`, or "binary" frames with sequence number and CRC,
+    for which lost and corrupted frames are counted. Samples are stamped with
+    `clock.time()` and `clock.monotonic()`.
+    """
+
+    def __init__(self, ser, ring, stop_event, protocol="text", voltage_range=(5.0, 15.0), max_line=256, clock=time):
+        super().__init__(name="uart-ingest", daemon=True)
+        if protocol not in ("text", "binary"):
+            raise ValueError(f"Unknown protocol: {protocol}")
+        self.protocol = protocol
+        self.ser = ser
+        self.ring = ring
+        self.stop_event = stop_event
+        self.voltage_range = voltage_range
+        self.max_line = max_line
+        self.clock = clock
+        self._buffer = bytearray()
+        self.listeners = []  # called with every new sample from the ingest thread, must be fast
+
+        # counters for rejected input
+        self.malformed = 0
+        self.out_of_range = 0
+        # binary protocol: frames, frames lost between sequence numbers, frames with a bad crc,
+        # sequence restarts (pico reset)
+        self.frames = 0
+        self.gaps = 0
+        self.corrupt = 0
+        self.resets = 0
+        self._last_seq = None
+
+    def run(self):
+        while not self.stop_event.is_set():
+            try:
+                # read everything that is waiting, or block up to the port timeout for one byte
+                chunk = self.ser.read(self.ser.in_waiting or 1)
+            except OSError as e:  # serial.SerialException is an OSError
+                logging.error(f"[UART] Read error: {e}")
+                self.stop_event.wait(timeout=1)
+                continue
+            if chunk:
+                self.feed(chunk)
+
+    def feed(self, chunk, timestamp=None, monotonic=None):
+        """Append raw bytes and parse every complete line or frame in the buffer."""
+        if timestamp is None:
+            timestamp, monotonic = self.clock.time(), self.clock.monotonic()
+        self._buffer += chunk
+        if self.protocol == "binary":
+            self._feed_frames(timestamp, monotonic)
+        else:
+            self._feed_lines(timestamp, monotonic)
+
+    def _feed_lines(self, timestamp, monotonic):
+        buffer = self._buffer
+        start = 0
+        while True:
+            end = buffer.find(b"\n", start)
+            if end < 0:
+                break
+            self._parse(buffer[start:end], timestamp, monotonic)
+            start = end + 1
+        del buffer[:start]
+        if len(buffer) > self.max_line:
+            # no line break in sight, the stream is garbage
+            self.malformed += 1
+            buffer.clear()
+
+    def _parse(self, line, timestamp, monotonic):
+        parts = line.split(b",")
+        if len(parts) != 3:
+            if line.strip():
+                self.malformed += 1
+            return
+        try:
+            # float() accepts ascii bytes including surrounding whitespace
+            voltage, current, power = float(parts[0]), float(parts[1]), float(parts[2])
+        except ValueError:
+            self.malformed += 1
+            return
+        self._publish(Sample(timestamp, monotonic, voltage, current, power))
+
+    def _feed_frames(self, timestamp, monotonic):
+        buffer = self._buffer
+        start = 0
+        while True:
+            start = buffer.find(FRAME_SYNC, start)
+            if start < 0:
+                # keep a trailing first sync byte, the second one may still arrive
+                del buffer[:max(0, len(buffer) - 1)]
+                return
+            if len(buffer) - start < FRAME_SIZE:
+                break
+            body_start = start + len(FRAME_SYNC)
+            body_end = body_start + FRAME_BODY.size
+            crc = buffer[body_end] | (buffer[body_end + 1] << 8)
+            if crc != crc16(buffer[body_start:body_end]):
+                # corrupted frame or a sync pattern inside data, resync after this sync byte
+                self.corrupt += 1
+                start += 1
+                continue
+            self._frame(FRAME_BODY.unpack_from(buffer, body_start), timestamp, monotonic)
+            start += FRAME_SIZE
+        del buffer[:start]
+
+    def _frame(self, fields, timestamp, monotonic):
+        version, seq, count, window_ms, v_min, v_mean, v_max, i_min, i_mean, i_max, p_min, p_mean, p_max = fields
+        if version != FRAME_VERSION or count == 0:
+            self.malformed += 1
+            return
+        self.frames += 1
+        if self._last_seq is not None:
+            step = (seq - self._last_seq) & 0xFFFF
+            if step == 0 or step > 0x8000:
+                # the sequence went backwards: the pico restarted, nothing was lost in between
+                self.resets += 1
+                logging.warning(f"[UART] Sequence restarted at {seq} after {self._last_seq}")
+            else:
+                self.gaps += step - 1
+        self._last_seq = seq
+        self._publish(Sample(
+            timestamp, monotonic, v_mean * VOLTAGE_LSB, i_mean * CURRENT_LSB, p_mean * POWER_LSB,
+            v_min * VOLTAGE_LSB, v_max * VOLTAGE_LSB, i_min * CURRENT_LSB, i_max * CURRENT_LSB,
+            p_max * POWER_LSB, count, seq, window_ms / 1000,
+        ))
+
+    def _publish(self, sample):
+        low, high = self.voltage_range
+        if not low <= sample.voltage <= high:  # sanity check on voltage range
+            self.out_of_range += 1
+            return
+        self.ring.push(sample)
+        for listener in self.listeners:
+            listener(sample)